@@ -0,0 +1,136 @@
+# services/adapter_pool.py
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# ----------------------------
+# Config
+# ----------------------------
+# 1: load the base model once and serve personas as LoRA adapters instead of a merged copy each
+ADAPTER_SERVING = os.getenv("ADAPTER_SERVING", "0") == "1"
+BASE_MODEL_DIR = os.getenv("BASE_MODEL_DIR", "TinyLlama/TinyLlama-1.1B-Chat-v1.0")
+# "name=path,name=path"; every sub-directory of ADAPTERS_DIR with an adapter_config.json is added too
+ADAPTERS = os.getenv("ADAPTERS", "kalam=models/kalam_brain/kalam_finetune_model")
+ADAPTERS_DIR = os.getenv("ADAPTERS_DIR", "models/adapters")
+DEFAULT_ADAPTER = os.getenv("DEFAULT_ADAPTER", "kalam")
+MAX_RESIDENT_ADAPTERS = int(os.getenv("MAX_RESIDENT_ADAPTERS", "4"))
+BASE_ADAPTER = "__base__"  # PEFT's name for "no adapter" in a mixed batch
+
+
+def discover_adapters(spec=ADAPTERS, directory=ADAPTERS_DIR):
+    """{name: adapter path} from the ADAPTERS list plus ADAPTERS_DIR/<name>/adapter_config.json."""
+    found = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, path = item.partition("=")
+        found[name.strip()] = path.strip()
+    if directory and os.path.isdir(directory):
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            if os.path.exists(os.path.join(path, "adapter_config.json")):
+                found.setdefault(name, path)
+    return found
+
+
+class AdapterPool:
+    """
+    One base model wrapped by PEFT with an LRU of resident LoRA adapters.
+    Requests name their adapter; the generation scheduler batches mixed adapters together
+    (PEFT adapter_names), so no per-request set_adapter swaps are needed. Each resident
+    persona costs its adapter's size, not another model copy.
+
+    Adapters in use are pinned and never evicted; the default adapter is always resident.
+    Loads and evictions are serialized; they only add or drop that adapter's own LoRA weights,
+    so generations on other adapters keep running.
+    """
+
+    def __init__(self, base_model, adapters, default=DEFAULT_ADAPTER, max_resident=MAX_RESIDENT_ADAPTERS):
+        from peft import PeftModel
+
+        if not adapters:
+            raise ValueError("No LoRA adapters configured (ADAPTERS / ADAPTERS_DIR)")
+        self.paths = dict(adapters)
+        self.default = default if default in self.paths else next(iter(self.paths))
+        self.max_resident = max(1, int(max_resident))
+        self.base_bytes = sum(p.numel() * p.element_size() for p in base_model.parameters())
+
+        self.model = PeftModel.from_pretrained(base_model, self.paths[self.default], adapter_name=self.default)
+        self.model.eval()
+
+        self._resident = OrderedDict([(self.default, self._adapter_bytes(self.default))])
+        self._pins = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "loads": 0, "evictions": 0}
+        print(f"🧩 Base model + adapter '{self.default}' ready ({len(self.paths)} personas available)")
+
+    def _adapter_bytes(self, name):
+        marker = f".{name}."
+        return sum(p.numel() * p.element_size() for n, p in self.model.named_parameters() if marker in n)
+
+    def _evict_over_budget(self):
+        for name in list(self._resident):
+            if len(self._resident) <= self.max_resident:
+                break
+            if name == self.default or self._pins.get(name):
+                continue
+            self.model.delete_adapter(name)
+            del self._resident[name]
+            self._stats["evictions"] += 1
+            print(f"🗑️ Evicted adapter '{name}'")
+
+    def acquire(self, name):
+        """Make sure the adapter is resident and pin it; raises KeyError for unknown names."""
+        name = name or self.default
+        if name not in self.paths:
+            raise KeyError(name)
+        with self._lock:
+            if name in self._resident:
+                self._resident.move_to_end(name)
+                self._stats["hits"] += 1
+            else:
+                self.model.load_adapter(self.paths[name], adapter_name=name)
+                self._resident[name] = self._adapter_bytes(name)
+                self._stats["loads"] += 1
+                print(f"🧩 Loaded adapter '{name}' ({self._resident[name] / 2**20:.1f} MB)")
+            self._pins[name] = self._pins.get(name, 0) + 1
+            self._evict_over_budget()
+        return name
+
+    def release(self, name):
+        with self._lock:
+            self._pins[name] -= 1
+            if not self._pins[name]:
+                del self._pins[name]
+            self._evict_over_budget()
+
+    @contextmanager
+    def use(self, name=None):
+        name = self.acquire(name)
+        try:
+            yield name
+        finally:
+            self.release(name)
+
+    def stats(self):
+        with self._lock:
+            resident = {name: round(nbytes / 2**20, 2) for name, nbytes in self._resident.items()}
+            return {
+                **self._stats,
+                "default": self.default,
+                "available": sorted(self.paths),
+                "resident_mb": resident,
+                "max_resident": self.max_resident,
+                "base_mb": round(self.base_bytes / 2**20, 1),
+                "pinned": dict(self._pins),
+            }
+
+
+def load_adapter_pool(precision="fp32"):
+    """Base model (fp32/bf16) + adapters from the environment."""
+    from services.model_precision import load_model
+
+    if precision == "int8":
+        # Dynamic int8 replaces nn.Linear, which LoRA layers need to wrap
+        raise ValueError("Adapter serving needs fp32 or bf16 base weights, not int8")
+    base_model = load_model(BASE_MODEL_DIR, precision)
+    return AdapterPool(base_model, discover_adapters())
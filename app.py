@@ -1,200 +1,853 @@
-from flask import Flask, request, jsonify
-from werkzeug.utils import secure_filename
-import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM
-import os
-from dotenv import load_dotenv
-from services.styletts_service import load_styletts, clone_voice, adjust_voice_male  # ✅ Local voice cloning
-
-import librosa
-import soundfile as sf
-import numpy as np
-import tempfile
-import pyttsx3
-
-# ----------------------------
-# ✅ Setup
-# ----------------------------
-load_dotenv()
-
-os.makedirs("results", exist_ok=True)
-os.makedirs("samples", exist_ok=True)
-
-app = Flask(__name__)
-
-MODEL_DIR = "models/kalam_brain/merged_model"
-
-print(f"🧠 Loading Kalam Brain from: {MODEL_DIR}")
-tokenizer = AutoTokenizer.from_pretrained(MODEL_DIR)
-model = AutoModelForCausalLM.from_pretrained(
-    MODEL_DIR,
-    dtype=torch.float32,  # ✅ CPU only (replaces deprecated torch_dtype)
-    device_map=None,
-    low_cpu_mem_usage=True
-)
-model.eval()
-print("✅ Kalam Brain Loaded Successfully!")
-
-# ✅ Load StyleTTS2 (Local Voice Cloning)
-styletts_model = load_styletts()
-
-
-# ----------------------------
-# 🔊 Text → Base Speech (TTS)
-# ----------------------------
-def synthesize_speech(text, output_file="results/kalam_tts.wav"):
-    """Offline base TTS using pyttsx3 to WAV, then resample to 24kHz mono. No ffmpeg required."""
-    try:
-        # Use explicit SAPI5 driver on Windows
-        engine = pyttsx3.init(driverName='sapi5')
-        # Try to select a male voice if available
-        try:
-            voices = engine.getProperty('voices')
-            male_voice_id = None
-            for v in voices:
-                name = (getattr(v, 'name', '') or '').lower()
-                gender = (getattr(v, 'gender', '') or '').lower()
-                if 'male' in gender or 'male' in name or 'david' in name or 'george' in name:
-                    male_voice_id = v.id
-                    break
-            if male_voice_id:
-                engine.setProperty('voice', male_voice_id)
-        except Exception:
-            pass
-        # Slightly slower for base voice (we still post-process later)
-        try:
-            rate = engine.getProperty('rate')
-            engine.setProperty('rate', int(rate * 0.95))
-        except Exception:
-            pass
-        # Maximize volume for audibility
-        try:
-            volume = engine.getProperty('volume')
-            engine.setProperty('volume', 1.0)
-        except Exception:
-            pass
-        # Save to a temporary WAV via pyttsx3
-        with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as tmpf:
-            tmp_wav = tmpf.name
-        # IMPORTANT: pyttsx3 uses snake_case
-        engine.save_to_file(text, tmp_wav)
-        engine.runAndWait()
-        # Load, convert to mono 24kHz, write final WAV
-        y, sr = sf.read(tmp_wav, dtype='float32', always_2d=False)
-        if hasattr(y, 'ndim') and y.ndim > 1:
-            y = np.mean(y, axis=1)
-        if sr != 24000:
-            y = librosa.resample(y, orig_sr=sr, target_sr=24000)
-            sr = 24000
-        sf.write(output_file, y, sr)
-        try:
-            os.remove(tmp_wav)
-        except Exception:
-            pass
-        print(f"🔊 Base TTS audio generated: {output_file}")
-        return output_file
-    except Exception as e:
-        print(f"❌ TTS generation failed: {e}")
-        return None
-
-
-# ----------------------------
-# 🎙️ Upload Reference Voice
-# ----------------------------
-UPLOAD_FOLDER = "samples"
-
-@app.route("/upload_voice", methods=["POST"])
-def upload_voice():
-    """Upload a reference voice file (e.g., kalam_reference.wav)."""
-    if "file" not in request.files:
-        return jsonify({"error": "No file provided"}), 400
-
-    file = request.files["file"]
-    if file.filename == "":
-        return jsonify({"error": "Empty filename"}), 400
-
-    filename = secure_filename(file.filename)
-    save_path = os.path.join(UPLOAD_FOLDER, filename)
-    file.save(save_path)
-
-    print(f"✅ Uploaded new reference voice: {save_path}")
-    return jsonify({"message": "Voice uploaded successfully!", "path": save_path})
-
-
-# ----------------------------
-# 🧠 Chat Endpoint
-# ----------------------------
-@app.route("/chat", methods=["POST"])
-def chat():
-    data = request.get_json()
-    user_text = data.get("text", "").strip()
-    reference_audio = data.get("reference_audio", "samples/kalam_reference.wav")
-
-    if not user_text:
-        return jsonify({"error": "text is required"}), 400
-
-    print(f"👤 User: {user_text}")
-
-    # 🧠 Generate Kalam-style response
-    inputs = tokenizer(user_text, return_tensors="pt")
-    output = model.generate(
-        **inputs,
-        max_new_tokens=250,
-        temperature=0.8,
-        repetition_penalty=1.2,
-        do_sample=True
-    )
-
-    kalam_response = tokenizer.decode(output[0], skip_special_tokens=True)
-    if user_text in kalam_response:
-        kalam_response = kalam_response.split(user_text, 1)[-1].strip()
-
-    if not kalam_response or len(kalam_response) < 5:
-        kalam_response = "My dear students, always dream big and work hard to achieve greatness."
-
-    print(f"🧠 Kalam: {kalam_response}")
-
-    # Step 1: Base TTS - Use pyttsx3 for now, Google TTS needs API setup
-    base_audio = synthesize_speech(kalam_response, "results/kalam_tts.wav")
-    if not base_audio:
-        return jsonify({"error": "Failed to generate TTS audio"}), 500
-
-    # Desired male/older voice controls
-    PITCH = 0.8
-    ENERGY = 1.0
-    DURATION = 1.0
-
-    # Step 2: Clone Voice Locally with controls
-    cloned_audio = clone_voice(
-        styletts_model,
-        kalam_response,
-        reference_audio,
-        "results/kalam_cloned.wav",
-        pitch_control=PITCH,
-        energy_control=ENERGY,
-        duration_control=DURATION,
-    )
-
-    # Use base audio directly for natural human-like voice
-    final_audio = base_audio
-
-    # Optionally also export a copy with the requested name
-    try:
-        if final_audio and os.path.exists(final_audio):
-            import shutil
-            shutil.copyfile(final_audio, "results/output_kalam_style.wav")
-    except Exception:
-        pass
-
-    return jsonify({
-        "response": kalam_response,
-        "audio_file": final_audio
-    })
-
-
-# ----------------------------
-# 🚀 Run Flask
-# ----------------------------
-if __name__ == "__main__":
-    print("🚀 Starting APJ Flask Server (CPU Mode)...")
-    app.run(host="0.0.0.0", port=5000, debug=False, use_reloader=False)
+from flask import Flask, request, jsonify, Response, stream_with_context, g, send_from_directory, send_file, url_for
+from werkzeug.utils import secure_filename
+import os
+import sys
+import json
+import time
+import queue
+import base64
+import threading
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from services.components import ComponentRegistry, ComponentNotReady, StartupProfile
+from services.metrics import (
+    REGISTRY, CONTENT_TYPE, AUDIO_SECONDS, GENERATED_TOKENS,
+    span, observe, start_profile, stop_profile, add_to_profile, in_context,
+)
+from services.job_queue import JobQueue, QueueFull, JOB_MAX_WAIT_SECONDS, JOB_SYNC_WAIT_SECONDS
+
+# Heavy modules (torch, transformers, StyleTTS2/librosa) are imported by the background loaders below
+profile = StartupProfile()
+with profile.step("import audio services"):
+    from services.voice_store import precompute_reference_style, file_sha256
+    from services.audio_cache import cache_key, cached_render, get_audio_cache
+    from services.audio_io import save_audio, load_audio, encode_audio, encoded_path, save_encoded, iter_encoded, ENCODINGS, AUDIO_FORMAT
+    from services.tts_pool import synthesize_pooled, get_tts_pool, voice_signature, TTS_POOL_ENABLED
+    from services.text_utils import split_sentences
+
+# ----------------------------
+# ✅ Setup
+# ----------------------------
+load_dotenv()
+
+os.makedirs("results", exist_ok=True)
+os.makedirs("samples", exist_ok=True)
+
+app = Flask(__name__)
+
+MODEL_DIR = "models/kalam_brain/merged_model"
+
+# fp32 | bf16 | int8 (see quantize_model.py for the offline conversion + comparison report)
+MODEL_PRECISION = os.getenv("MODEL_PRECISION", "fp32")
+
+# How long a request waits for a still-loading model before answering 503
+READY_WAIT_SECONDS = float(os.getenv("READY_WAIT_SECONDS", "30"))
+STARTUP_PROFILE_FILE = "results/startup_profile.json"
+
+# Sampling settings shared by the blocking and streaming chat paths
+GENERATION_KWARGS = dict(
+    max_new_tokens=250,
+    temperature=0.8,
+    repetition_penalty=1.2,
+    do_sample=True
+)
+
+
+# 0 keeps torch's default; serve_multiworker.py sets it per worker process
+TORCH_THREADS = int(os.getenv("TORCH_THREADS", "0"))
+# Set to 0 when a launcher preloads weights and starts components itself (see serve_multiworker.py)
+APP_AUTOSTART = os.getenv("APP_AUTOSTART", "1") != "0"
+
+
+# ----------------------------
+# ⏳ Background model loading
+# ----------------------------
+# Weights loaded before fork by serve_multiworker.py; workers reuse them copy-on-write
+_preloaded = {}
+
+
+def _load_kalam_weights():
+    if "kalam_brain" in _preloaded:
+        return _preloaded["kalam_brain"]
+    with profile.step("import torch + transformers"):
+        from transformers import AutoTokenizer
+        from services.model_precision import load_model
+        from services.assisted_generation import load_assistant
+        from services.adapter_pool import ADAPTER_SERVING, BASE_MODEL_DIR, load_adapter_pool
+
+    adapters = None
+    if ADAPTER_SERVING:
+        # 🧩 One base model, personas as resident LoRA adapters (no merged copy per persona)
+        print(f"🧠 Loading base model {BASE_MODEL_DIR} + LoRA adapters ({MODEL_PRECISION})")
+        with profile.step("load tokenizer"):
+            tokenizer = AutoTokenizer.from_pretrained(BASE_MODEL_DIR)
+        with profile.step(f"load base model + adapters ({MODEL_PRECISION})"):
+            adapters = load_adapter_pool(MODEL_PRECISION)
+        model = adapters.model
+    else:
+        print(f"🧠 Loading Kalam Brain from: {MODEL_DIR} ({MODEL_PRECISION})")
+        with profile.step("load tokenizer"):
+            tokenizer = AutoTokenizer.from_pretrained(MODEL_DIR)
+        with profile.step(f"load model ({MODEL_PRECISION})"):
+            model = load_model(MODEL_DIR, MODEL_PRECISION)  # ✅ CPU only
+    # 🪶 Optional draft model for assisted decoding (ASSISTANT_MODEL_DIR)
+    with profile.step("load draft model"):
+        assistant = load_assistant(tokenizer)
+    print("✅ Kalam Brain Loaded Successfully!")
+    return tokenizer, model, assistant, adapters
+
+
+def _load_kalam_brain():
+    tokenizer, model, assistant, adapters = _load_kalam_weights()
+    from services.generation_scheduler import GenerationScheduler
+    from services.session_cache import SessionKVCache
+    from services.assisted_generation import assisted_kwargs
+    from services.response_cache import load_response_cache
+
+    if TORCH_THREADS > 0:
+        import torch
+        torch.set_num_threads(TORCH_THREADS)
+
+    # 🪶 Draft-and-verify decoding (draft model or prompt lookup) when configured
+    assisted = assisted_kwargs(assistant, tokenizer)
+    generation_kwargs = dict(GENERATION_KWARGS, **assisted)
+    # 📦 Batch concurrent /chat prompts into shared generate calls (assisted decoding runs one sequence at a time)
+    scheduler = GenerationScheduler(model, tokenizer, generation_kwargs, **({"max_batch_size": 1} if assisted else {}))
+    # 🧷 Multi-turn sessions reuse the persona prefix and their own past key/values
+    # (plain decoding: the draft model has no copy of a session's cache; default adapter only)
+    with profile.step("persona prefix prefill"):
+        sessions = SessionKVCache(model, tokenizer, GENERATION_KWARGS)
+    # 🗂️ Optional exact + semantic response cache (RESPONSE_CACHE_ENABLED=1)
+    responses = load_response_cache(model, tokenizer)
+    return SimpleNamespace(
+        tokenizer=tokenizer, model=model, scheduler=scheduler, sessions=sessions,
+        generation_kwargs=generation_kwargs, adapters=adapters, responses=responses,
+    )
+
+
+def _load_styletts():
+    if "styletts" in _preloaded:
+        return _preloaded["styletts"]
+    # ✅ Load StyleTTS2 (Local Voice Cloning); may download checkpoints on first run
+    with profile.step("import styletts_service"):
+        from services.styletts_service import load_styletts
+    return load_styletts()
+
+
+def preload_shared_weights():
+    """
+    Load model weights synchronously in this process, before any worker threads exist,
+    so forked workers share the read-only pages instead of each loading a copy.
+    """
+    import gc
+    import torch
+
+    # Stay single-threaded so no OpenMP pool exists at fork time
+    torch.set_num_threads(1)
+    _preloaded["kalam_brain"] = _load_kalam_weights()
+    _preloaded["styletts"] = _load_styletts()
+    # Move everything allocated so far out of the GC's reach so collections in the
+    # workers don't dirty (and un-share) those pages
+    gc.collect()
+    gc.freeze()
+
+
+components = ComponentRegistry(profile)
+# Whole /chat and /clone pipelines run as jobs on a bounded pool (see job_queue.py)
+jobs = JobQueue()
+
+
+def start_components():
+    # Job workers start here (or on first submit), in the process that serves requests
+    jobs.start()
+    components.register("kalam_brain", _load_kalam_brain)
+    # Cloning is on demand, so the server is ready without StyleTTS2
+    components.register("styletts", _load_styletts, required=False)
+    if TTS_POOL_ENABLED:
+        # 🗣️ Base-TTS worker processes
+        components.register("tts_pool", get_tts_pool)
+    components.start(on_complete=lambda: profile.save(STARTUP_PROFILE_FILE))
+
+
+if APP_AUTOSTART:
+    start_components()
+
+
+def brain():
+    """Tokenizer, model, scheduler and sessions once loaded (waits up to READY_WAIT_SECONDS)."""
+    return components.get("kalam_brain", READY_WAIT_SECONDS)
+
+
+def styletts():
+    return components.get("styletts", READY_WAIT_SECONDS)
+
+
+# ----------------------------
+# 📈 Request metrics
+# ----------------------------
+REQUEST_SECONDS = REGISTRY.histogram("kalam_request_seconds", "Wall seconds per HTTP request.", ("endpoint",))
+IN_FLIGHT = REGISTRY.gauge("kalam_requests_in_flight", "HTTP requests currently being served.")
+
+
+def _queue_depths():
+    depths = {("pipeline_stages",): stage_pool._work_queue.qsize(), ("jobs",): jobs.queue_depth()}
+    if components.is_ready("kalam_brain"):
+        depths[("generation",)] = brain().scheduler.queue_depth()
+    if TTS_POOL_ENABLED and components.is_ready("tts_pool"):
+        depths[("tts_pool",)] = get_tts_pool().queue_depth()
+    return depths
+
+
+def _cache_hit_rates():
+    rates = {("audio",): get_audio_cache().stats()["hit_rate"]}
+    if components.is_ready("kalam_brain") and brain().responses is not None:
+        rates[("responses",)] = brain().responses.stats()["hit_rate"]
+    gtts = sys.modules.get("services.tts_service")
+    if gtts is not None:
+        rates[("gtts_segments",)] = gtts.cache_stats()["hit_rate"]
+    return rates
+
+
+AUDIO_BYTES = REGISTRY.counter("kalam_audio_bytes_total", "Encoded audio bytes sent by /audio.", ("format",))
+JOBS_REJECTED = REGISTRY.counter("kalam_jobs_rejected_total", "Requests turned away with 429 (job queue full, or too many concurrent streams).", ("kind",))
+REGISTRY.gauge("kalam_queue_depth", "Work waiting per queue (TTS pool: busy workers).", ("queue",), fn=_queue_depths)
+REGISTRY.gauge("kalam_cache_hit_ratio", "Lifetime hit ratio per cache.", ("cache",), fn=_cache_hit_rates)
+
+
+@app.before_request
+def _begin_request():
+    g.request_started = time.perf_counter()
+    IN_FLIGHT.inc()
+    stop_profile()  # threads are reused; never inherit a previous request's profile
+
+
+@app.teardown_request
+def _end_request(exc):
+    IN_FLIGHT.dec()
+    if "request_started" in g:
+        REQUEST_SECONDS.observe(time.perf_counter() - g.request_started, endpoint=request.endpoint or "unknown")
+
+
+@app.errorhandler(ComponentNotReady)
+def component_not_ready(e):
+    return jsonify({"error": str(e), "components": components.status()}), 503, {"Retry-After": "5"}
+
+
+@app.errorhandler(QueueFull)
+def queue_full(e):
+    return jsonify({"error": str(e), "retry_after": e.retry_after, **jobs.stats()}), 429, {"Retry-After": str(e.retry_after)}
+
+
+FALLBACK_RESPONSE = "My dear students, always dream big and work hard to achieve greatness."
+
+# Written inside each job's own directory (results/jobs/<job id>/), so concurrent requests never collide
+OUTPUT_AUDIO_FILE = "output_kalam_style.wav"
+CLONED_AUDIO_FILE = "kalam_cloned.wav"
+# SSE audio chunks stay WAV by default (PCM16: half the bytes of float32); "opus" is ~10x smaller still
+STREAM_AUDIO_FORMAT = os.getenv("STREAM_AUDIO_FORMAT", "wav16")
+# Longest a stream waits for the next token before ending with an error event
+STREAM_TOKEN_TIMEOUT_SECONDS = float(os.getenv("STREAM_TOKEN_TIMEOUT_SECONDS", "120"))
+# Streams run on the request thread, not the job queue; beyond this many at once they get 429
+STREAM_MAX_CONCURRENT = int(os.getenv("STREAM_MAX_CONCURRENT", "4"))
+stream_slots = threading.BoundedSemaphore(max(1, STREAM_MAX_CONCURRENT))
+
+# Desired male/older voice controls
+PITCH = 0.8
+ENERGY = 1.0
+DURATION = 1.0
+
+
+# ----------------------------
+# 🔊 Text → Base Speech (TTS)
+# ----------------------------
+def synthesize_speech_array(text):
+    """Offline base TTS using the pyttsx3 worker pool, returned in memory as (samples, 24000). No ffmpeg required."""
+    audio = synthesize_pooled(text)
+    if audio is not None:
+        print("🔊 Base TTS audio generated (in memory)")
+    return audio
+
+
+def synthesize_speech(text, output_file="results/kalam_tts.wav"):
+    """Base TTS persisted to output_file; returns the path or None."""
+    audio = synthesize_speech_array(text)
+    if audio is None:
+        return None
+    save_audio(audio, output_file)
+    print(f"🔊 Base TTS audio saved: {output_file}")
+    return output_file
+
+
+# ----------------------------
+# 🧵 Pipeline stages
+# ----------------------------
+OUTPUT_STAGES = {
+    "base": ("base",),
+    "cloned": ("cloned",),
+    "both": ("base", "cloned"),
+}
+STAGE_CACHE_NAMES = {"base": "base_tts", "cloned": "clone"}
+# Cloned output is produced on demand (request outputs or /clone); the default path skips it
+DEFAULT_OUTPUTS = os.getenv("CHAT_DEFAULT_OUTPUTS", "base")
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", str(max(2, (os.cpu_count() or 2) // 2))))
+stage_pool = ThreadPoolExecutor(max_workers=PIPELINE_WORKERS, thread_name_prefix="pipeline-stage")
+
+
+def _render_base(text):
+    return cached_render(cache_key(text, voice_signature()), lambda: synthesize_speech_array(text))
+
+
+def _render_cloned(text, reference_audio):
+    from services.styletts_service import clone_voice_array
+
+    voice_hash = file_sha256(reference_audio) if reference_audio and os.path.exists(reference_audio) else None
+    return cached_render(
+        cache_key(text, "styletts2", voice_hash, PITCH, ENERGY, DURATION),
+        lambda: clone_voice_array(
+            styletts(),
+            text,
+            reference_audio,
+            pitch_control=PITCH,
+            energy_control=ENERGY,
+            duration_control=DURATION,
+        ),
+    )
+
+
+def render_outputs(text, reference_audio, stages):
+    """Run the requested audio stages on the worker pool; returns {stage: (audio_or_None, cache_tier)}."""
+    futures = {}
+    if "base" in stages:
+        futures["base"] = stage_pool.submit(in_context(_render_base), text)
+    if "cloned" in stages:
+        futures["cloned"] = stage_pool.submit(in_context(_render_cloned), text, reference_audio)
+    return {stage: future.result() for stage, future in futures.items()}
+
+
+# ----------------------------
+# 🎙️ Upload Reference Voice
+# ----------------------------
+UPLOAD_FOLDER = "samples"
+
+@app.route("/upload_voice", methods=["POST"])
+def upload_voice():
+    """Upload a reference voice file (e.g., kalam_reference.wav)."""
+    if "file" not in request.files:
+        return jsonify({"error": "No file provided"}), 400
+
+    file = request.files["file"]
+    if file.filename == "":
+        return jsonify({"error": "Empty filename"}), 400
+
+    filename = secure_filename(file.filename)
+    save_path = os.path.join(UPLOAD_FOLDER, filename)
+    file.save(save_path)
+
+    print(f"✅ Uploaded new reference voice: {save_path}")
+
+    # Encode the style vector now so /chat never pays for it (or as soon as StyleTTS2 finishes loading)
+    if components.is_ready("styletts"):
+        voice_hash = precompute_reference_style(styletts(), save_path)
+    else:
+        voice_hash = None
+        stage_pool.submit(lambda: precompute_reference_style(components.get("styletts", None), save_path))
+    return jsonify({"message": "Voice uploaded successfully!", "path": save_path, "voice_hash": voice_hash})
+
+
+# ----------------------------
+# 🧠 Chat Endpoint
+# ----------------------------
+def _wants_async(data):
+    return bool(data.get("async")) or request.args.get("async") == "1"
+
+
+def _dispatch(run, kind, data):
+    """Queue a pipeline job; async callers get 202 + job id, others wait up to JOB_SYNC_WAIT_SECONDS for its response."""
+    def run_job(job):
+        try:
+            return run(job)
+        except ComponentNotReady as e:
+            return {"error": str(e), "components": components.status()}, 503
+
+    try:
+        job = jobs.submit(run_job, kind=kind)
+    except QueueFull:
+        JOBS_REJECTED.inc(kind=kind)
+        raise
+    if _wants_async(data) or not job.wait(JOB_SYNC_WAIT_SECONDS):
+        # Too slow to wait for: the job keeps running and the client polls for it
+        status_url = url_for("job_status", job_id=job.id)
+        return jsonify({"job_id": job.id, "status": job.status, "status_url": status_url}), 202, {"Location": status_url}
+    return jsonify({**job.result, "job_id": job.id}), job.http_status
+
+
+@app.route("/chat", methods=["POST"])
+def chat():
+    data = request.get_json()
+    user_text = data.get("text", "").strip()
+    reference_audio = data.get("reference_audio", "samples/kalam_reference.wav")
+    session_id = data.get("session_id")
+
+    if not user_text:
+        return jsonify({"error": "text is required"}), 400
+
+    print(f"👤 User: {user_text}")
+
+    # 🧩 Persona = LoRA adapter (ADAPTER_SERVING=1); checked once the model is loaded
+    persona = data.get("persona")
+
+    audio_format = data.get("audio_format", STREAM_AUDIO_FORMAT if data.get("stream") else AUDIO_FORMAT)
+    if audio_format not in ENCODINGS:
+        return jsonify({"error": f"audio_format must be one of {sorted(ENCODINGS)}"}), 400
+
+    if data.get("stream"):
+        # Streams hold their request thread for the whole answer, so they are capped separately
+        if not stream_slots.acquire(blocking=False):
+            JOBS_REJECTED.inc(kind="stream")
+            return jsonify({"error": f"too many concurrent streams ({STREAM_MAX_CONCURRENT})"}), 429, {"Retry-After": "5"}
+        try:
+            error = _persona_error(brain().adapters, persona, session_id)
+            if error:
+                stream_slots.release()
+                return jsonify(error[0]), error[1]
+            # The slot is freed when generation has actually stopped, not when the client leaves
+            return stream_chat(user_text, persona, audio_format, on_finish=stream_slots.release)
+        except Exception:
+            stream_slots.release()
+            raise
+
+    outputs = data.get("outputs", DEFAULT_OUTPUTS)
+    if outputs not in OUTPUT_STAGES:
+        return jsonify({"error": f"outputs must be one of {sorted(OUTPUT_STAGES)}"}), 400
+
+    # ⏱️ Optional per-request stage breakdown ({"profile": true} or ?profile=1)
+    profile = bool(data.get("profile")) or request.args.get("profile") == "1"
+    return _dispatch(
+        lambda job: run_chat(job, user_text, reference_audio, session_id, persona, outputs, profile, audio_format), "chat", data
+    )
+
+
+def _persona_error(adapters, persona, session_id):
+    """(error body, 400) when the persona can't be served, else None."""
+    if persona and adapters is None:
+        return {"error": "persona selection needs ADAPTER_SERVING=1"}, 400
+    if persona and persona not in adapters.paths:
+        return {"error": f"unknown persona '{persona}'", "available": sorted(adapters.paths)}, 400
+    if persona and session_id and persona != adapters.default:
+        return {"error": f"sessions use the default persona '{adapters.default}'"}, 400
+    return None
+
+
+def _audio_url(job, name, audio_format):
+    """Where a client fetches a job's audio (see job_audio); built by hand because jobs run outside a request."""
+    return f"/audio/{job.id}/{name}?format={audio_format}"
+
+
+def run_chat(job, user_text, reference_audio, session_id, persona, outputs, profile, audio_format=AUDIO_FORMAT):
+    """The LLM → TTS → clone pipeline for one /chat job; returns (response body, HTTP status)."""
+    stages = start_profile() if profile else None
+    try:
+        observe("job_queue", job.started - job.created)
+
+        # 🧠 Generate Kalam-style response
+        session_info = {}
+        new_tokens = None
+        response_cache = {}
+        adapters = brain().adapters
+        error = _persona_error(adapters, persona, session_id)
+        if error:
+            return error
+        if session_id:
+            # Only the new turn's tokens are prefilled; history comes from the session KV cache
+            with span("generate"):
+                kalam_response, prefilled, reused = brain().sessions.generate(str(session_id), user_text)
+            session_info = {"session_id": session_id, "prefill_tokens": prefilled, "cached_tokens": reused}
+        else:
+            # 🗂️ Near-duplicate questions reuse an earlier answer (RESPONSE_CACHE_ENABLED=1)
+            responses = brain().responses
+            scope = (persona or adapters.default) if adapters is not None else None
+            kalam_response, lookup = None, None
+            if responses is not None:
+                with span("response_cache"):
+                    kalam_response, lookup = responses.lookup(user_text, scope)
+                response_cache = {"response": lookup["tier"]}
+                if lookup["tier"] == "semantic":
+                    response_cache["response_similarity"] = lookup["similarity"]
+            if kalam_response is not None:
+                session_info = {"persona": scope} if adapters is not None else {}
+            else:
+                # Batched with other in-flight requests (mixed personas share a batch)
+                if adapters is not None:
+                    with adapters.use(persona) as persona:
+                        future = brain().scheduler.submit(user_text, adapter=persona)
+                        kalam_response = future.result()
+                    session_info = {"persona": persona}
+                else:
+                    future = brain().scheduler.submit(user_text)
+                    kalam_response = future.result()
+                timings = {k: future.timings[k] for k in ("queue", "tokenize", "generate")}
+                add_to_profile(timings)
+                new_tokens = future.timings["new_tokens"]
+                if responses is not None and kalam_response and len(kalam_response) >= 5:
+                    responses.put(user_text, kalam_response, sum(timings.values()), scope, lookup["vector"])
+
+        if not kalam_response or len(kalam_response) < 5:
+            kalam_response = FALLBACK_RESPONSE
+
+        print(f"🧠 Kalam: {kalam_response}")
+
+        # Base TTS and cloning only depend on the text, so requested stages run side by side
+        rendered = render_outputs(kalam_response, reference_audio, OUTPUT_STAGES[outputs])
+        if "base" in rendered and rendered["base"][0] is None:
+            return {"error": "Failed to generate TTS audio"}, 500
+
+        result = {
+            "response": kalam_response,
+            "cache": {**response_cache, **{STAGE_CACHE_NAMES[stage]: tier for stage, (_, tier) in rendered.items()}},
+            **session_info
+        }
+        # Base audio is the natural human-like voice; the clone is only written when asked for
+        for stage, (audio, _) in rendered.items():
+            if audio is not None:
+                AUDIO_SECONDS.inc(len(audio[0]) / float(audio[1]), output=stage)
+        with span("file_io"):
+            if "base" in rendered:
+                result["audio_file"] = save_audio(rendered["base"][0], job.path(OUTPUT_AUDIO_FILE))
+                result["audio_url"] = _audio_url(job, OUTPUT_AUDIO_FILE, audio_format)
+            if "cloned" in rendered:
+                cloned_audio = rendered["cloned"][0]
+                result["cloned_audio_file"] = save_audio(cloned_audio, job.path(CLONED_AUDIO_FILE)) if cloned_audio is not None else None
+                result["cloned_audio_url"] = _audio_url(job, CLONED_AUDIO_FILE, audio_format) if cloned_audio is not None else None
+                result.setdefault("audio_file", result["cloned_audio_file"])
+                result.setdefault("audio_url", result["cloned_audio_url"])
+        if stages is not None:
+            result["profile"] = {
+                "stages": stages,
+                "new_tokens": new_tokens,
+                "total": round(time.perf_counter() - job.submitted, 6),
+            }
+        return result, 200
+    finally:
+        stop_profile()
+
+
+@app.route("/clone", methods=["POST"])
+def clone():
+    """Produce the cloned voice later for a response text already returned by /chat."""
+    data = request.get_json()
+    text = (data.get("text") or data.get("response") or "").strip()
+    reference_audio = data.get("reference_audio", "samples/kalam_reference.wav")
+    audio_format = data.get("audio_format", AUDIO_FORMAT)
+    if not text:
+        return jsonify({"error": "text is required"}), 400
+    if audio_format not in ENCODINGS:
+        return jsonify({"error": f"audio_format must be one of {sorted(ENCODINGS)}"}), 400
+
+    def run_clone(job):
+        cloned_audio, tier = render_outputs(text, reference_audio, ("cloned",))["cloned"]
+        if cloned_audio is None:
+            return {"error": "Voice cloning failed"}, 500
+        return {
+            "response": text,
+            "audio_file": save_audio(cloned_audio, job.path(CLONED_AUDIO_FILE)),
+            "audio_url": _audio_url(job, CLONED_AUDIO_FILE, audio_format),
+            "cache": {"clone": tier}
+        }, 200
+
+    return _dispatch(run_clone, "clone", data)
+
+
+# ----------------------------
+# 📬 Jobs (async /chat and /clone)
+# ----------------------------
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    """Job status and, once finished, its result; ?wait=N long-polls up to N seconds for completion."""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "unknown or expired job", "job_id": job_id}), 404
+    wait = min(float(request.args.get("wait", 0) or 0), JOB_MAX_WAIT_SECONDS)
+    if wait > 0:
+        job.wait(wait)
+    info = job.to_dict()
+    if job.done:
+        info["file_urls"] = {name: url_for("job_file", job_id=job.id, name=name) for name in info.get("files", [])}
+    return jsonify(info)
+
+
+@app.route("/jobs/<job_id>/files/<name>", methods=["GET"])
+def job_file(job_id, name):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "unknown or expired job", "job_id": job_id}), 404
+    return send_from_directory(os.path.abspath(job.dir), secure_filename(name))
+
+
+@app.route("/jobs/<job_id>", methods=["DELETE"])
+def delete_job(job_id):
+    """Cancel a queued job or delete a finished one's artifacts now instead of at TTL."""
+    job = jobs.cancel(job_id)
+    if job is None:
+        return jsonify({"error": "unknown or expired job", "job_id": job_id}), 404
+    if job.status == "running":
+        return jsonify({"error": "job is running", "job_id": job_id}), 409
+    return jsonify({"job_id": job_id, "status": job.status, "deleted": True})
+
+
+@app.route("/audio/<job_id>/<name>", methods=["GET"])
+def job_audio(job_id, name):
+    """
+    A job's audio in a delivery encoding (?format=opus|flac|wav16|wav, default AUDIO_FORMAT).
+    The first request streams the encoder output with chunked transfer, so playback can start
+    right away, and keeps the encoded copy; later requests (and any Range request) are served
+    from that copy with byte-range support.
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "unknown or expired job", "job_id": job_id}), 404
+    if not job.done:
+        return jsonify({"error": "job has not finished", "job_id": job_id, "status": job.status}), 409
+    audio_format = request.args.get("format", AUDIO_FORMAT)
+    if audio_format not in ENCODINGS:
+        return jsonify({"error": f"format must be one of {sorted(ENCODINGS)}"}), 400
+    source = job.path(secure_filename(name))
+    if not os.path.exists(source):
+        return jsonify({"error": "no such audio", "files": job.files()}), 404
+    mimetype = ENCODINGS[audio_format][2]
+    cached = encoded_path(source, audio_format)
+
+    if os.path.exists(cached) or request.range is not None:
+        if not os.path.exists(cached):
+            save_encoded(load_audio(source), cached, audio_format)
+        AUDIO_BYTES.inc(os.path.getsize(cached), format=audio_format)
+        return send_file(os.path.abspath(cached), mimetype=mimetype, conditional=True)
+
+    def chunks():
+        for chunk in iter_encoded(load_audio(source), audio_format, cache_path=cached):
+            AUDIO_BYTES.inc(len(chunk), format=audio_format)
+            yield chunk
+    return Response(stream_with_context(chunks()), mimetype=mimetype, headers={"Accept-Ranges": "bytes"})
+
+
+@app.route("/jobs", methods=["GET"])
+def job_stats():
+    return jsonify(jobs.stats())
+
+
+@app.route("/cache/stats", methods=["GET"])
+def cache_stats():
+    """Synthesized-audio cache hit rate and seconds saved."""
+    return jsonify(get_audio_cache().stats())
+
+
+@app.route("/cache/responses", methods=["GET", "DELETE"])
+def response_cache_stats():
+    """Response cache hit rate and generation seconds saved (RESPONSE_CACHE_ENABLED=1); DELETE empties it."""
+    responses = brain().responses
+    if responses is None:
+        return jsonify({"error": "response cache is off (RESPONSE_CACHE_ENABLED=1)"}), 404
+    if request.method == "DELETE":
+        responses.clear()
+    return jsonify(responses.stats())
+
+
+@app.route("/adapters", methods=["GET"])
+def adapter_stats():
+    """Resident LoRA personas and their memory (ADAPTER_SERVING=1)."""
+    adapters = brain().adapters
+    if adapters is None:
+        return jsonify({"error": "adapter serving is off (ADAPTER_SERVING=1)"}), 404
+    return jsonify(adapters.stats())
+
+
+@app.route("/session/<session_id>", methods=["DELETE"])
+def reset_session(session_id):
+    """Drop a chat session's cached history."""
+    sessions = brain().sessions
+    existed = sessions.reset(session_id)
+    return jsonify({"session_id": session_id, "reset": existed, **sessions.stats()})
+
+
+# ----------------------------
+# 🩺 Health & Startup
+# ----------------------------
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Prometheus text exposition: stage/request latency histograms, tokens, audio seconds, caches, queues."""
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    """Liveness: the process is up and serving HTTP."""
+    return jsonify({"status": "alive", "uptime": profile.report()["since_process_start"]})
+
+
+@app.route("/readyz", methods=["GET"])
+def readyz():
+    """Readiness: every required component has loaded."""
+    ready = components.ready()
+    return jsonify({"ready": ready, "components": components.status()}), 200 if ready else 503
+
+
+@app.route("/startup", methods=["GET"])
+def startup():
+    """Seconds spent per import and per model load."""
+    return jsonify({**profile.report(), "components": components.status()})
+
+
+# ----------------------------
+# 📡 Streaming Chat (SSE)
+# ----------------------------
+def _sse(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+
+def _render_sentence(sentence, voice, audio_format=STREAM_AUDIO_FORMAT):
+    """
+    Base TTS (from the audio cache when possible) passed through the response's MaleVoiceStream,
+    so EQ state and level carry from sentence to sentence; returns (encoded bytes or None, cache tier).
+    """
+    audio, tier = _render_base(sentence)
+    if audio is None:
+        return None, tier
+    return encode_audio((voice.process(audio[0]), audio[1]), audio_format), tier
+
+
+def stream_chat(user_text, persona=None, audio_format=STREAM_AUDIO_FORMAT, on_finish=None):
+    """
+    Stream tokens as they are generated and audio sentence by sentence (Server-Sent Events).
+    Generation stops as soon as the client goes away; on_finish runs once the generate thread exits.
+    """
+    import torch
+    from transformers import TextIteratorStreamer, StoppingCriteria, StoppingCriteriaList
+    from services.styletts_service import MaleVoiceStream
+    from services.tts_pool import TARGET_SR
+
+    started = time.perf_counter()
+    kalam = brain()
+    tokenizer, model = kalam.tokenizer, kalam.model
+
+    with span("tokenize"):
+        inputs = tokenizer(user_text, return_tensors="pt")
+    streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True, timeout=STREAM_TOKEN_TIMEOUT_SECONDS)
+    failure = {}
+    stop = threading.Event()
+
+    class StopWhenClosed(StoppingCriteria):
+        def __call__(self, input_ids, scores, **kwargs):
+            return torch.full((input_ids.shape[0],), stop.is_set(), dtype=torch.bool, device=input_ids.device)
+
+    extra = {"stopping_criteria": StoppingCriteriaList([StopWhenClosed()])}
+    if kalam.adapters is not None:
+        persona = kalam.adapters.acquire(persona)
+        extra["adapter_names"] = [persona]
+
+    def run_generate():
+        try:
+            with span("generate"):
+                model.generate(**inputs, **kalam.generation_kwargs, **extra, streamer=streamer)
+        except Exception as e:
+            # generate() only ends the streamer when it returns; end it here so the consumer stops
+            print(f"❌ Streaming generation failed: {e}")
+            failure["error"] = str(e)
+            streamer.end()
+        finally:
+            if kalam.adapters is not None:
+                kalam.adapters.release(persona)
+            if on_finish is not None:
+                on_finish()
+
+    worker = threading.Thread(target=run_generate, daemon=True)
+
+    def produce():
+        timings = {"time_to_first_token": None, "time_to_first_audio": None}
+        # One voice chain per response: every sentence goes through the same EQ state and gain
+        voice = MaleVoiceStream(TARGET_SR, pitch_control=PITCH, energy_control=ENERGY, duration_control=DURATION)
+        response_parts = []
+        buffer = ""
+        index = 0
+
+        def emit_audio(sentence):
+            nonlocal index
+            audio_bytes, tier = _render_sentence(sentence, voice, audio_format)
+            if audio_bytes is None:
+                return _sse("error", {"index": index, "text": sentence, "error": "TTS failed"})
+            if timings["time_to_first_audio"] is None:
+                timings["time_to_first_audio"] = round(time.perf_counter() - started, 3)
+            payload = {
+                "index": index,
+                "text": sentence,
+                "cache": tier,
+                "format": audio_format,
+                "mimetype": ENCODINGS[audio_format][2],
+                "audio": base64.b64encode(audio_bytes).decode("ascii"),
+            }
+            index += 1
+            return _sse("audio", payload)
+
+        # Generation keeps running in the worker thread while sentences are rendered
+        try:
+            for piece in streamer:
+                if not piece:
+                    continue
+                if timings["time_to_first_token"] is None:
+                    timings["time_to_first_token"] = round(time.perf_counter() - started, 3)
+                response_parts.append(piece)
+                yield _sse("token", {"text": piece})
+                buffer += piece
+                sentences, buffer = split_sentences(buffer)
+                for sentence in sentences:
+                    yield emit_audio(sentence)
+        except queue.Empty:
+            failure.setdefault("error", f"no token within {STREAM_TOKEN_TIMEOUT_SECONDS:g}s")
+        if failure:
+            print(f"❌ Stream ended early: {failure['error']}")
+            yield _sse("error", {"error": failure["error"], "response": "".join(response_parts).strip(), "chunks": index})
+            return
+
+        worker.join()
+        kalam_response = "".join(response_parts).strip()
+        if kalam_response:
+            GENERATED_TOKENS.inc(len(tokenizer(kalam_response, add_special_tokens=False)["input_ids"]))
+        tail = buffer.strip()
+        if not kalam_response or len(kalam_response) < 5:
+            kalam_response = FALLBACK_RESPONSE
+            tail = FALLBACK_RESPONSE
+        if tail:
+            yield emit_audio(tail)
+
+        print(f"🧠 Kalam (streamed): {kalam_response}")
+        yield _sse("done", {
+            "response": kalam_response,
+            "chunks": index,
+            **timings,
+            "total_time": round(time.perf_counter() - started, 3),
+        })
+
+    def events():
+        try:
+            yield from produce()
+        finally:
+            # Finished, timed out or the client disconnected: no one reads further tokens
+            stop.set()
+
+    response = Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    # Also covers a response closed before its first chunk was produced
+    response.call_on_close(stop.set)
+    worker.start()
+    return response
+
+
+# ----------------------------
+# 🚀 Run Flask
+# ----------------------------
+if __name__ == "__main__":
+    # Models keep loading in the background; /readyz reports when they are done
+    print("🚀 Starting APJ Flask Server (CPU Mode)...")
+    app.run(host="0.0.0.0", port=5000, debug=False, use_reloader=False)
@@ -0,0 +1,246 @@
+# services/assisted_generation.py
+import os
+import time
+import threading
+
+import torch
+
+# ----------------------------
+# Config (per deployment)
+# ----------------------------
+# Draft model that proposes tokens for the merged model to verify; empty disables assisted decoding.
+# It must be much smaller than the merged model, e.g. a layer-pruned copy (see --make-draft below)
+# or a small model distilled on the same Kalam LoRA data.
+ASSISTANT_MODEL_DIR = os.getenv("ASSISTANT_MODEL_DIR", "")
+ASSISTANT_PRECISION = os.getenv("ASSISTANT_PRECISION", "fp32")
+# Tokens drafted per verification step; "heuristic" grows/shrinks it with the acceptance rate
+ASSISTANT_NUM_TOKENS = int(os.getenv("ASSISTANT_NUM_TOKENS", "5"))
+ASSISTANT_SCHEDULE = os.getenv("ASSISTANT_SCHEDULE", "heuristic")  # heuristic | constant
+# No draft model: propose continuations by matching n-grams already in the prompt (0 = off)
+PROMPT_LOOKUP_TOKENS = int(os.getenv("PROMPT_LOOKUP_TOKENS", "0"))
+
+
+def load_assistant(tokenizer, model_dir=ASSISTANT_MODEL_DIR, precision=ASSISTANT_PRECISION):
+    """
+    Load the draft model configured for this deployment, or None.
+    Returns {"model", "tokenizer", "same_vocab"}; a draft with a different tokenizer
+    falls back to universal assisted decoding (slower: text is re-tokenized each step).
+    """
+    if not model_dir:
+        return None
+    from transformers import AutoTokenizer
+    from services.model_precision import load_model
+
+    draft = load_model(model_dir, precision)
+    draft.generation_config.num_assistant_tokens = ASSISTANT_NUM_TOKENS
+    draft.generation_config.num_assistant_tokens_schedule = ASSISTANT_SCHEDULE
+    draft_tokenizer = AutoTokenizer.from_pretrained(model_dir)
+    same_vocab = draft_tokenizer.get_vocab() == tokenizer.get_vocab()
+    params = sum(p.numel() for p in draft.parameters()) / 1e6
+    print(f"🪶 Draft model loaded from {model_dir} ({params:.1f}M params, {'shared' if same_vocab else 'different'} tokenizer)")
+    return {"model": draft, "tokenizer": draft_tokenizer, "same_vocab": same_vocab}
+
+
+def assisted_kwargs(assistant, tokenizer=None, prompt_lookup_tokens=PROMPT_LOOKUP_TOKENS):
+    """Extra model.generate kwargs for the configured mode ({} when assisted decoding is off)."""
+    if assistant is not None:
+        kwargs = {"assistant_model": assistant["model"]}
+        if not assistant["same_vocab"]:
+            kwargs.update(tokenizer=tokenizer, assistant_tokenizer=assistant["tokenizer"])
+        return kwargs
+    if prompt_lookup_tokens > 0:
+        return {"prompt_lookup_num_tokens": prompt_lookup_tokens}
+    return {}
+
+
+# ----------------------------
+# Draft by layer pruning
+# ----------------------------
+def prune_layers(model, keep):
+    """
+    Keep `keep` evenly spaced decoder layers (always the first and last). The result shares the
+    tokenizer and embeddings with the full model, so it can draft without vocab translation;
+    distilling it on the Kalam data afterwards raises the acceptance rate.
+    """
+    layers = model.model.layers
+    total = len(layers)
+    keep = max(1, min(int(keep), total))
+    if keep == 1:
+        indices = [0]
+    else:
+        indices = sorted({round(i * (total - 1) / (keep - 1)) for i in range(keep)})
+    model.model.layers = torch.nn.ModuleList(layers[i] for i in indices)
+    for new_index, layer in enumerate(model.model.layers):
+        layer.self_attn.layer_idx = new_index
+    model.config.num_hidden_layers = len(indices)
+    layer_types = getattr(model.config, "layer_types", None)
+    if layer_types:
+        model.config.layer_types = [layer_types[i] for i in indices]
+    return model
+
+
+# ----------------------------
+# Acceptance accounting
+# ----------------------------
+class AcceptanceCounter:
+    """
+    Counts drafted vs accepted tokens across every assisted generate() call made inside the block
+    by wrapping the candidate generators' get_candidates / update_candidate_strategy.
+    """
+
+    def __init__(self):
+        self.drafted = 0
+        self.accepted = 0
+        self.steps = 0
+        self._local = threading.local()
+        self._patched = []
+
+    def __enter__(self):
+        from transformers.generation import candidate_generator as cg
+
+        counter = self
+        for cls in vars(cg).values():
+            if not (isinstance(cls, type) and issubclass(cls, cg.CandidateGenerator)):
+                continue
+            if "get_candidates" in vars(cls):
+                original = vars(cls)["get_candidates"]
+
+                def get_candidates(self, input_ids, *args, _original=original, **kwargs):
+                    candidates, logits = _original(self, input_ids, *args, **kwargs)
+                    counter._local.drafted = candidates.shape[1] - input_ids.shape[1]
+                    return candidates, logits
+                self._patch(cls, "get_candidates", get_candidates)
+            if "update_candidate_strategy" in vars(cls):
+                original = vars(cls)["update_candidate_strategy"]
+
+                def update_candidate_strategy(self, input_ids, scores, num_matches, _original=original):
+                    counter._record(int(num_matches))
+                    return _original(self, input_ids, scores, num_matches)
+                self._patch(cls, "update_candidate_strategy", update_candidate_strategy)
+        return self
+
+    def _patch(self, cls, name, fn):
+        self._patched.append((cls, name, vars(cls)[name]))
+        setattr(cls, name, fn)
+
+    def _record(self, num_matches):
+        drafted = getattr(self._local, "drafted", None)
+        if drafted is None:
+            return
+        self._local.drafted = None
+        self.drafted += drafted
+        self.accepted += min(num_matches, drafted)
+        self.steps += 1
+
+    def __exit__(self, *exc):
+        for cls, name, original in reversed(self._patched):
+            setattr(cls, name, original)
+        self._patched = []
+
+    def stats(self):
+        return {
+            "drafted": self.drafted,
+            "accepted": self.accepted,
+            "verify_steps": self.steps,
+            "acceptance_rate": round(self.accepted / self.drafted, 4) if self.drafted else 0.0,
+        }
+
+
+# ----------------------------
+# Plain vs assisted benchmark
+# ----------------------------
+if __name__ == "__main__":
+    import json
+    import argparse
+    from transformers import AutoTokenizer, AutoModelForCausalLM
+    from services.model_precision import load_model
+
+    parser = argparse.ArgumentParser(description="Tokens/sec and acceptance rate of assisted decoding vs plain model.generate.")
+    parser.add_argument("--model-dir", default="models/kalam_brain/merged_model")
+    parser.add_argument("--draft-dir", default=ASSISTANT_MODEL_DIR or "models/kalam_brain/draft_model")
+    parser.add_argument("--make-draft", type=int, default=0, metavar="LAYERS",
+                        help="first write a layer-pruned draft with this many layers to --draft-dir")
+    parser.add_argument("--prompt-lookup", type=int, default=0, help="also benchmark prompt-lookup decoding with N tokens")
+    parser.add_argument("--prompts", default=None, help="JSONL file with a text/body field per line")
+    parser.add_argument("--limit", type=int, default=8)
+    parser.add_argument("--max-new-tokens", type=int, default=128)
+    parser.add_argument("--num-assistant-tokens", type=int, default=ASSISTANT_NUM_TOKENS)
+    parser.add_argument("--sample", action="store_true", help="sample (temperature 0.8) instead of greedy decoding")
+    parser.add_argument("--out", default="results/assisted_report.json")
+    args = parser.parse_args()
+
+    if args.make_draft:
+        full = AutoModelForCausalLM.from_pretrained(args.model_dir, dtype=torch.float32, low_cpu_mem_usage=True)
+        before = sum(p.numel() for p in full.parameters())
+        draft = prune_layers(full, args.make_draft)
+        draft.save_pretrained(args.draft_dir)
+        AutoTokenizer.from_pretrained(args.model_dir).save_pretrained(args.draft_dir)
+        after = sum(p.numel() for p in draft.parameters())
+        print(f"✂️ Draft with {args.make_draft} layers saved to {args.draft_dir} ({after / before:.0%} of the parameters)")
+        del full, draft
+
+    prompts = [
+        "How can I dream big?",
+        "What is the role of a teacher?",
+        "Tell me about India's space programme.",
+        "How should students deal with failure?",
+    ]
+    if args.prompts:
+        with open(args.prompts, encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+        prompts = [(r.get("text") or r.get("body") or r.get("title"))[:400] for r in rows]
+    prompts = (prompts * args.limit)[:args.limit]
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model_dir)
+    model = load_model(args.model_dir)
+    sampling = dict(do_sample=True, temperature=0.8) if args.sample else dict(do_sample=False)
+    base_kwargs = dict(max_new_tokens=args.max_new_tokens, pad_token_id=tokenizer.pad_token_id or tokenizer.eos_token_id, **sampling)
+
+    def run(label, extra):
+        outputs, tokens = [], 0
+        counter = AcceptanceCounter()
+        started = time.perf_counter()
+        with counter, torch.inference_mode():
+            for prompt in prompts:
+                inputs = tokenizer(prompt, return_tensors="pt")
+                if args.sample:
+                    torch.manual_seed(0)
+                output = model.generate(**inputs, **base_kwargs, **extra)
+                new = output[0, inputs["input_ids"].shape[1]:]
+                tokens += int(new.numel())
+                outputs.append(new.tolist())
+        seconds = time.perf_counter() - started
+        row = {"mode": label, "seconds": round(seconds, 3), "new_tokens": tokens,
+               "tokens_per_sec": round(tokens / seconds, 2), **(counter.stats() if extra else {})}
+        return row, outputs
+
+    modes = [("plain", {})]
+    if os.path.isdir(args.draft_dir):
+        ASSISTANT_NUM_TOKENS = args.num_assistant_tokens
+        assistant = load_assistant(tokenizer, args.draft_dir)
+        modes.append(("assisted", assisted_kwargs(assistant, tokenizer)))
+    else:
+        print(f"⚠️ No draft model at {args.draft_dir} (use --make-draft N to create one).")
+    if args.prompt_lookup:
+        modes.append(("prompt_lookup", assisted_kwargs(None, prompt_lookup_tokens=args.prompt_lookup)))
+
+    run("warmup", {})
+    rows, reference = [], None
+    for label, extra in modes:
+        row, outputs = run(label, extra)
+        if reference is None:
+            reference = outputs
+        else:
+            row["speedup"] = round(row["tokens_per_sec"] / rows[0]["tokens_per_sec"], 3)
+            # Greedy verification keeps the target model's output; sampling only matches in distribution
+            row["identical_outputs"] = sum(a == b for a, b in zip(outputs, reference)) / len(reference)
+        rows.append(row)
+        print(f"{label:<14} {row['tokens_per_sec']:8.2f} tok/s  "
+              + (f"speedup={row['speedup']:.2f}x  acceptance={row['acceptance_rate']:.2%}  "
+                 f"identical={row['identical_outputs']:.0%}" if label != "plain" else ""))
+
+    os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+    with open(args.out, "w") as f:
+        json.dump({"model_dir": args.model_dir, "draft_dir": args.draft_dir, "prompts": len(prompts),
+                   "max_new_tokens": args.max_new_tokens, "sample": args.sample, "results": rows}, f, indent=2)
+    print(f"📝 Results saved at: {args.out}")
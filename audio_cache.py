@@ -0,0 +1,222 @@
+# services/audio_cache.py
+import os
+import json
+import time
+import uuid
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+# ----------------------------
+# Config
+# ----------------------------
+AUDIO_CACHE_DIR = os.getenv("AUDIO_CACHE_DIR", "results/.audio_cache")
+AUDIO_CACHE_MAX_MB = float(os.getenv("AUDIO_CACHE_MAX_MB", "512"))
+AUDIO_CACHE_HOT_MB = float(os.getenv("AUDIO_CACHE_HOT_MB", "64"))
+AUDIO_CACHE_ENABLED = os.getenv("AUDIO_CACHE_ENABLED", "1") != "0"
+
+
+def normalize_text(text):
+    """Collapse whitespace and Unicode variants so trivially different strings share an entry."""
+    return " ".join(unicodedata.normalize("NFKC", text or "").split())
+
+
+def cache_key(text, engine, voice_hash=None, pitch=None, energy=None, duration=None):
+    """Content address for a synthesized utterance."""
+    payload = json.dumps({
+        "text": normalize_text(text),
+        "engine": engine,
+        "voice": voice_hash,
+        "pitch": pitch,
+        "energy": energy,
+        "duration": duration,
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class AudioCache:
+    """
+    Two-tier cache of final (samples, sr) buffers: a small in-memory hot tier in
+    front of a size-bounded LRU directory of raw float32 .npy files on disk. Each entry remembers how many
+    seconds it took to produce so hits can be reported as time saved.
+    """
+
+    def __init__(self, root=AUDIO_CACHE_DIR, max_bytes=AUDIO_CACHE_MAX_MB * 1024 * 1024,
+                 hot_bytes=AUDIO_CACHE_HOT_MB * 1024 * 1024):
+        self.root = root
+        self.max_bytes = int(max_bytes)
+        self.hot_bytes = int(hot_bytes)
+        self._lock = threading.Lock()
+        self._disk = OrderedDict()   # key -> (size, produce_seconds, sr), oldest first
+        self._disk_total = 0
+        self._hot = OrderedDict()    # key -> (samples, sr)
+        self._hot_total = 0
+        self._stats = {"hits_memory": 0, "hits_disk": 0, "misses": 0, "saved_seconds": 0.0}
+        os.makedirs(self.root, exist_ok=True)
+        self._load_index()
+
+    def _data_path(self, key):
+        return os.path.join(self.root, f"{key}.npy")
+
+    def _meta_path(self, key):
+        return os.path.join(self.root, f"{key}.json")
+
+    def _load_index(self):
+        entries = []
+        for name in os.listdir(self.root):
+            if name.endswith(".part"):
+                # Left behind by a write that never finished
+                try:
+                    os.remove(os.path.join(self.root, name))
+                except OSError:
+                    pass
+                continue
+            if not name.endswith(".npy"):
+                continue
+            key = name[:-4]
+            path = self._data_path(key)
+            try:
+                with open(self._meta_path(key)) as f:
+                    meta = json.load(f)
+            except Exception:
+                continue
+            entries.append((os.path.getmtime(path), key, os.path.getsize(path), float(meta.get("seconds", 0.0)), int(meta["sr"])))
+        for _, key, size, seconds, sr in sorted(entries):
+            self._disk[key] = (size, seconds, sr)
+            self._disk_total += size
+        self._evict_disk()
+
+    # ----------------------------
+    # Tier maintenance (call with lock held)
+    # ----------------------------
+    def _remember_hot(self, key, audio):
+        size = audio[0].nbytes
+        if size > self.hot_bytes:
+            return
+        if key in self._hot:
+            self._hot_total -= self._hot.pop(key)[0].nbytes
+        self._hot[key] = audio
+        self._hot_total += size
+        while self._hot_total > self.hot_bytes and self._hot:
+            _, old = self._hot.popitem(last=False)
+            self._hot_total -= old[0].nbytes
+
+    def _evict_disk(self):
+        while self._disk_total > self.max_bytes and self._disk:
+            key, (size, _, _) = self._disk.popitem(last=False)
+            self._disk_total -= size
+            for path in (self._data_path(key), self._meta_path(key)):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def _write_atomic(self, path, write):
+        partial = f"{path}.{uuid.uuid4().hex}.part"
+        try:
+            with open(partial, "wb") as f:
+                write(f)
+            os.replace(partial, path)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+
+    # ----------------------------
+    # Public API
+    # ----------------------------
+    def get(self, key):
+        """Return ((samples, sr), tier) or (None, 'miss')."""
+        with self._lock:
+            entry = self._disk.get(key)
+            audio = self._hot.get(key)
+            if audio is not None and entry is not None:
+                self._hot.move_to_end(key)
+                self._disk.move_to_end(key)
+                self._stats["hits_memory"] += 1
+                self._stats["saved_seconds"] += entry[1]
+                return audio, "memory"
+            if entry is None:
+                self._stats["misses"] += 1
+                return None, "miss"
+        try:
+            audio = (np.load(self._data_path(key)), entry[2])
+            os.utime(self._data_path(key))
+        except (OSError, ValueError):
+            with self._lock:
+                if key in self._disk:
+                    self._disk_total -= self._disk.pop(key)[0]
+                self._stats["misses"] += 1
+            return None, "miss"
+        with self._lock:
+            if key in self._disk:
+                self._disk.move_to_end(key)
+            self._remember_hot(key, audio)
+            self._stats["hits_disk"] += 1
+            self._stats["saved_seconds"] += entry[1]
+        return audio, "disk"
+
+    def put(self, key, audio, seconds=0.0):
+        """Store a final (samples, sr) buffer along with the seconds it took to produce it."""
+        y, sr = np.ascontiguousarray(audio[0], dtype='float32'), int(audio[1])
+        # Data first, meta last, each via its own uniquely named partial file: concurrent
+        # misses on one key never share a temp file, and meta never points at missing data
+        self._write_atomic(self._data_path(key), lambda f: np.save(f, y))
+        meta = json.dumps({"seconds": round(seconds, 4), "sr": sr, "created": time.time()}).encode("utf-8")
+        self._write_atomic(self._meta_path(key), lambda f: f.write(meta))
+        with self._lock:
+            if key in self._disk:
+                self._disk_total -= self._disk.pop(key)[0]
+            self._disk[key] = (y.nbytes, seconds, sr)
+            self._disk_total += y.nbytes
+            self._remember_hot(key, (y, sr))
+            self._evict_disk()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._disk)
+            stats["disk_mb"] = round(self._disk_total / 1e6, 2)
+            stats["hot_mb"] = round(self._hot_total / 1e6, 2)
+        lookups = stats["hits_memory"] + stats["hits_disk"] + stats["misses"]
+        stats["hit_rate"] = round((stats["hits_memory"] + stats["hits_disk"]) / lookups, 4) if lookups else 0.0
+        stats["saved_seconds"] = round(stats["saved_seconds"], 3)
+        return stats
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_audio_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = AudioCache()
+        return _cache
+
+
+def cached_render(key, render):
+    """
+    Return the cached audio for key, or call render() (which returns (samples, sr) or None)
+    and cache its result. Returns (audio_or_None, 'memory' | 'disk' | 'miss' | 'disabled').
+    """
+    if not AUDIO_CACHE_ENABLED:
+        return render(), "disabled"
+    cache = get_audio_cache()
+    audio, tier = cache.get(key)
+    if audio is not None:
+        print(f"♻️ Audio cache {tier} hit")
+        return audio, tier
+
+    started = time.perf_counter()
+    audio = render()
+    seconds = time.perf_counter() - started
+    if audio is not None:
+        try:
+            cache.put(key, audio, seconds)
+        except Exception as e:
+            print(f"⚠️ Could not cache audio: {e}")
+    return audio, tier
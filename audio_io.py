@@ -0,0 +1,200 @@
+# services/audio_io.py
+import io
+import os
+import uuid
+import struct
+
+import numpy as np
+import soundfile as sf
+
+# ----------------------------
+# In-memory audio helpers
+# ----------------------------
+# Audio travels between pipeline stages as (samples, sample_rate): float32 mono in [-1, 1].
+TARGET_SR = 24000
+
+
+def to_mono_float32(y):
+    y = np.asarray(y, dtype='float32')
+    if y.ndim > 1:
+        y = np.mean(y, axis=1)
+    return y
+
+
+def resample_to(y, sr, target_sr=TARGET_SR):
+    """Resample only when needed; librosa is imported lazily because it pulls in numba."""
+    if sr == target_sr:
+        return y, sr
+    import librosa
+    return librosa.resample(y, orig_sr=sr, target_sr=target_sr).astype('float32'), target_sr
+
+
+def load_audio(path, target_sr=None):
+    y, sr = sf.read(path, dtype='float32', always_2d=False)
+    y = to_mono_float32(y)
+    if target_sr:
+        y, sr = resample_to(y, sr, target_sr)
+    return y, sr
+
+
+def save_audio(audio, path):
+    """Persist an (samples, sr) buffer; the only place pipeline audio touches the disk."""
+    y, sr = audio
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    sf.write(path, y, int(sr))
+    return path
+
+
+def to_wav_bytes(audio, subtype='FLOAT'):
+    """Encode an (samples, sr) buffer as WAV without touching the filesystem."""
+    y, sr = audio
+    buf = io.BytesIO()
+    sf.write(buf, y, int(sr), format='WAV', subtype=subtype)
+    return buf.getvalue()
+
+
+def duration_seconds(audio):
+    y, sr = audio
+    return len(y) / float(sr) if sr else 0.0
+
+
+# ----------------------------
+# Delivery encodings
+# ----------------------------
+# Artifacts stay on disk as save_audio wrote them; clients fetch them in one of these.
+# name: (soundfile format, subtype, mimetype, extension)
+ENCODINGS = {
+    "wav": ("WAV", "FLOAT", "audio/wav", ".wav"),
+    "wav16": ("WAV", "PCM_16", "audio/wav", ".wav"),
+    "flac": ("FLAC", "PCM_16", "audio/flac", ".flac"),
+    "opus": ("OGG", "OPUS", "audio/ogg", ".ogg"),
+}
+AUDIO_FORMAT = os.getenv("AUDIO_FORMAT", "opus")
+OPUS_RATES = (8000, 12000, 16000, 24000, 48000)
+STREAM_BLOCK_SECONDS = 0.5
+
+
+def _prepare(audio, encoding):
+    """Clip to [-1, 1] and move to a rate the codec supports (Opus: 8/12/16/24/48 kHz)."""
+    y, sr = audio
+    y = np.clip(to_mono_float32(y), -1.0, 1.0)
+    if encoding == "opus" and int(sr) not in OPUS_RATES:
+        y, sr = resample_to(y, int(sr), 48000 if sr > 24000 else 24000)
+    return y, int(sr)
+
+
+def encode_audio(audio, encoding="wav16"):
+    """Whole (samples, sr) buffer → encoded bytes."""
+    fmt, subtype, _, _ = ENCODINGS[encoding]
+    y, sr = _prepare(audio, encoding)
+    buf = io.BytesIO()
+    sf.write(buf, y, sr, format=fmt, subtype=subtype)
+    return buf.getvalue()
+
+
+def encoded_path(path, encoding):
+    """Cache file for an artifact's encoded copy, next to the artifact."""
+    stem, _ = os.path.splitext(path)
+    return f"{stem}.{encoding}{ENCODINGS[encoding][3]}"
+
+
+def save_encoded(audio, path, encoding):
+    data = encode_audio(audio, encoding)
+    partial = f"{path}.{uuid.uuid4().hex}.part"
+    with open(partial, "wb") as f:
+        f.write(data)
+    os.replace(partial, path)
+    return path
+
+
+class _AppendSink:
+    """Write-only file object for soundfile that hands out bytes as the encoder appends them."""
+
+    def __init__(self):
+        self._buf = bytearray()
+        self._pos = 0
+        self._sent = 0
+
+    def write(self, data):
+        data = bytes(data)
+        if self._pos < self._sent:
+            raise IOError("encoder rewrote bytes that were already sent")
+        self._buf[self._pos:self._pos + len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+    def seek(self, offset, whence=0):
+        self._pos = offset if whence == 0 else (self._pos + offset if whence == 1 else len(self._buf) + offset)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def read(self, n=-1):
+        return b""
+
+    def drain(self):
+        chunk = bytes(self._buf[self._sent:])
+        self._sent = len(self._buf)
+        return chunk
+
+
+def _wav16_header(frames, sr):
+    data_bytes = frames * 2
+    return (b"RIFF" + struct.pack("<I", 36 + data_bytes) + b"WAVE"
+            + b"fmt " + struct.pack("<IHHIIHH", 16, 1, 1, sr, sr * 2, 2, 16)
+            + b"data" + struct.pack("<I", data_bytes))
+
+
+def iter_encoded(audio, encoding, cache_path=None, block_seconds=STREAM_BLOCK_SECONDS):
+    """
+    Encoded bytes in chunks as they are produced, for chunked transfer. Ogg/Opus pages are
+    append-only and PCM16 WAV sizes are known up front, so those start flowing after the first
+    block; FLAC patches its header at the end and is sent once encoded.
+    When cache_path is given the complete stream is also saved there for later Range requests.
+    """
+    y, sr = _prepare(audio, encoding)
+    block = max(1, int(block_seconds * sr))
+    partial = f"{cache_path}.{uuid.uuid4().hex}.part" if cache_path else None
+    cache = open(partial, "wb") if partial else None
+
+    def chunks():
+        if encoding == "wav16":
+            yield _wav16_header(len(y), sr)
+            for i in range(0, len(y), block):
+                yield (y[i:i + block] * 32767.0).round().astype('<i2').tobytes()
+        elif encoding == "opus":
+            sink = _AppendSink()
+            with sf.SoundFile(sink, "w", sr, 1, format="OGG", subtype="OPUS") as f:
+                for i in range(0, len(y), block):
+                    f.write(y[i:i + block])
+                    chunk = sink.drain()
+                    if chunk:
+                        yield chunk
+            yield sink.drain()
+        else:
+            data = encode_audio((y, sr), encoding)
+            for i in range(0, len(data), 64 * 1024):
+                yield data[i:i + 64 * 1024]
+
+    try:
+        for chunk in chunks():
+            if not chunk:
+                continue
+            if cache:
+                cache.write(chunk)
+            yield chunk
+        if cache:
+            cache.close()
+            os.replace(partial, cache_path)
+            cache = None
+    finally:
+        if cache:
+            # Client went away mid-stream: drop the incomplete copy
+            cache.close()
+            try:
+                os.remove(partial)
+            except OSError:
+                pass
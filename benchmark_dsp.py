@@ -0,0 +1,107 @@
+import json
+import time
+import argparse
+
+import numpy as np
+import librosa
+from scipy.signal import sosfilt
+
+from services.styletts_service import process_voice_male, process_voice_male_batch, MaleVoiceStream, _highpass_sos, _lowpass_sos
+
+# ---------------------------
+# Settings (same controls as /chat)
+# ---------------------------
+SR = 24000
+PITCH = 0.8
+ENERGY = 1.0
+DURATION = 1.0
+
+
+def legacy_adjust_voice_male(y, sr, pitch_control, energy_control, duration_control):
+    """The previous chain: pitch_shift, then time_stretch, then two separate sosfilt passes."""
+    n_steps = 12.0 * np.log2(max(1e-3, float(pitch_control)))
+    y = librosa.effects.pitch_shift(y, sr=sr, n_steps=n_steps)
+    stretch = min(2.0, max(0.25, 1.0 / float(duration_control)))
+    y = librosa.effects.time_stretch(y, rate=stretch)
+    y = sosfilt(_highpass_sos(sr, 80), y)
+    y = sosfilt(_lowpass_sos(sr, 4000), y)
+    y = y * float(energy_control)
+    peak = np.max(np.abs(y)) if y.size else 0.0
+    if peak > 0:
+        y = y / peak * 0.98
+    return np.clip(y, -1.0, 1.0).astype('float32')
+
+
+def speech_like(seconds, sr=SR, seed=0):
+    """Voiced harmonics with a wandering pitch, syllable-rate envelope and a little noise."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sr)) / sr
+    f0 = 120 + 20 * np.sin(2 * np.pi * 0.3 * t)
+    phase = 2 * np.pi * np.cumsum(f0) / sr
+    y = sum(np.sin(k * phase) / k for k in range(1, 12))
+    envelope = 0.5 * (1 + np.sin(2 * np.pi * 4 * t)) ** 2
+    y = y * envelope + 0.02 * rng.standard_normal(t.size)
+    return (0.5 * y / np.max(np.abs(y))).astype('float32')
+
+
+def best_of(fn, repeats):
+    best = float("inf")
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def stream_all(y, block_seconds):
+    stream = MaleVoiceStream(SR, PITCH, ENERGY, DURATION)
+    step = int(block_seconds * SR)
+    return np.concatenate([stream.process(y[i:i + step]) for i in range(0, len(y), step)])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Real-time factor of adjust_voice_male: legacy vs single-pass vs streaming.")
+    parser.add_argument("--durations", default="5,15,30,60", help="clip lengths in seconds")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--block-seconds", type=float, default=2.0)
+    parser.add_argument("--batch", type=int, default=32, help="utterances (2-6 s) for the loop vs batched comparison; 0 skips it")
+    parser.add_argument("--out", default=None, help="optional JSON results path")
+    args = parser.parse_args()
+
+    # Warm up librosa/numba and the filter cache
+    process_voice_male(speech_like(1), SR, PITCH, ENERGY, DURATION)
+    legacy_adjust_voice_male(speech_like(1), SR, PITCH, ENERGY, DURATION)
+
+    rows = []
+    print(f"{'clip s':>7}{'legacy RTF':>12}{'single RTF':>12}{'stream RTF':>12}{'speedup':>9}")
+    for seconds in [float(d) for d in args.durations.split(",")]:
+        y = speech_like(seconds)
+        legacy = best_of(lambda: legacy_adjust_voice_male(y, SR, PITCH, ENERGY, DURATION), args.repeats)
+        single = best_of(lambda: process_voice_male(y, SR, PITCH, ENERGY, DURATION), args.repeats)
+        stream = best_of(lambda: stream_all(y, args.block_seconds), args.repeats)
+        row = {
+            "seconds": seconds,
+            "legacy_rtf": legacy / seconds,
+            "single_pass_rtf": single / seconds,
+            "stream_rtf": stream / seconds,
+            "speedup": legacy / single if single else 0.0,
+        }
+        rows.append(row)
+        print(f"{seconds:>7.0f}{row['legacy_rtf']:>12.4f}{row['single_pass_rtf']:>12.4f}{row['stream_rtf']:>12.4f}{row['speedup']:>8.2f}x")
+
+    batch_row = None
+    if args.batch:
+        # Bulk mode (bulk_render.py): many short utterances at once
+        lengths = np.random.default_rng(0).uniform(2, 6, args.batch)
+        clips = [speech_like(seconds, seed=i) for i, seconds in enumerate(lengths)]
+        process_voice_male_batch(clips[:2], SR, PITCH, ENERGY, DURATION)
+        loop = best_of(lambda: [process_voice_male(y, SR, PITCH, ENERGY, DURATION) for y in clips], args.repeats)
+        batched = best_of(lambda: process_voice_male_batch(clips, SR, PITCH, ENERGY, DURATION), args.repeats)
+        batch_row = {"utterances": args.batch, "audio_seconds": float(lengths.sum()),
+                     "loop_seconds": loop, "batched_seconds": batched, "speedup": loop / batched if batched else 0.0}
+        print(f"{args.batch} utterances ({lengths.sum():.0f} s audio): loop {loop:.3f}s, batched {batched:.3f}s ({batch_row['speedup']:.2f}x)")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"sr": SR, "pitch": PITCH, "duration": DURATION, "results": rows, "batch": batch_row}, f, indent=2)
+        print(f"📝 Results saved at: {args.out}")
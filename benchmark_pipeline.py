@@ -0,0 +1,499 @@
+import os
+import sys
+import json
+import time
+import zlib
+import argparse
+import threading
+import contextvars
+import subprocess
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# ---------------------------
+# Settings
+# ---------------------------
+STAGES = [
+    "queue", "tokenize", "generate", "base_tts", "clone", "adjust_voice_male", "file_io",
+    # server-side spans reported by /chat's profile flag (HTTP mode)
+    "tts_pyttsx3", "tts_gtts", "styletts2",
+]
+RESULTS_FILE = "results/pipeline_benchmark.json"
+SR = 24000
+
+# Per-request stage seconds for whichever request the current thread (or context) is serving
+_record = contextvars.ContextVar("benchmark_record", default=None)
+
+
+# ---------------------------
+# Workload
+# ---------------------------
+def load_workload(path, limit=None, max_chars=400):
+    """Prompts from a JSONL file: "text", else "body", else "title" of each line (requests.jsonl format)."""
+    items = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            row = json.loads(line)
+            text = (row.get("text") or row.get("body") or row.get("title") or "").strip()
+            if not text:
+                continue
+            payload = {"text": text[:max_chars]}
+            for key in ("outputs", "reference_audio", "session_id"):
+                if key in row:
+                    payload[key] = row[key]
+            items.append(payload)
+            if limit and len(items) >= limit:
+                break
+    return items
+
+
+# ---------------------------
+# Stub models (small CPU box)
+# ---------------------------
+STUB_WORDS = (
+    "dream big students nation science work hard teacher learn fail rise ignite "
+    "minds rocket launch village knowledge wings fire courage vision youth India "
+    "the a of to and is in your we our with never give up always"
+).split()
+
+
+class StubTokenizer:
+    """Word-level tokenizer with the slice of the HF interface the scheduler uses."""
+
+    def __init__(self):
+        self.vocab = ["<pad>", "</s>"] + STUB_WORDS
+        self.index = {w: i for i, w in enumerate(self.vocab)}
+        self.pad_token, self.pad_token_id = "<pad>", 0
+        self.eos_token, self.eos_token_id = "</s>", 1
+        self.padding_side = "right"
+
+    def encode(self, text):
+        return [self.index.get(w, 2 + zlib.crc32(w.encode()) % (len(self.vocab) - 2)) for w in text.lower().split()] or [1]
+
+    def __call__(self, texts, return_tensors=None, padding=False, **kwargs):
+        import torch
+
+        single = isinstance(texts, str)
+        rows = [self.encode(t) for t in ([texts] if single else texts)]
+        width = max(len(r) for r in rows)
+        ids, mask = [], []
+        for r in rows:
+            pad = [self.pad_token_id] * (width - len(r))
+            ids.append(pad + r if self.padding_side == "left" else r + pad)
+            ones, zeros = [1] * len(r), [0] * len(pad)
+            mask.append(zeros + ones if self.padding_side == "left" else ones + zeros)
+        return {"input_ids": torch.tensor(ids), "attention_mask": torch.tensor(mask)}
+
+    def decode(self, ids, skip_special_tokens=True):
+        ids = ids.tolist() if hasattr(ids, "tolist") else list(ids)
+        words = [self.vocab[i] for i in ids if not (skip_special_tokens and i < 2)]
+        text = " ".join(words)
+        return text[:1].upper() + text[1:] + ("." if text else "")
+
+
+class StubModel:
+    """generate() sleeps like a CPU decoder: one step per new token, shared by the whole batch."""
+
+    def __init__(self, seconds_per_token=0.004, seed=0):
+        self.seconds_per_token = seconds_per_token
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+
+    def generate(self, input_ids, attention_mask=None, pad_token_id=0, max_new_tokens=250, **kwargs):
+        import torch
+
+        batch = input_ids.shape[0]
+        with self._lock:
+            lengths = self._rng.integers(max(8, max_new_tokens // 3), max_new_tokens + 1, size=batch)
+            words = self._rng.integers(2, 2 + len(STUB_WORDS), size=(batch, int(lengths.max())))
+        new = torch.full((batch, int(lengths.max()) + 1), pad_token_id, dtype=input_ids.dtype)
+        for row, n in enumerate(lengths):
+            new[row, :n] = torch.from_numpy(words[row, :n])
+            new[row, n] = 1
+        time.sleep(self.seconds_per_token * (int(lengths.max()) + 0.1 * input_ids.shape[1]))
+        return torch.cat([input_ids, new], dim=1)
+
+
+class StubStyleTTS:
+    """Acoustic-model stand-in for StyleTTS2: returns speech-like audio after a fixed RTF."""
+
+    def __init__(self, rtf=0.15):
+        self.rtf = rtf
+
+    def inference(self, text, output_sample_rate=SR, **kwargs):
+        from benchmark_dsp import speech_like
+
+        seconds = max(0.5, 0.065 * len(text))
+        time.sleep(self.rtf * seconds)
+        return speech_like(seconds, output_sample_rate, seed=len(text))
+
+
+def stub_synthesize_speech_array(text, rtf=0.05):
+    from benchmark_dsp import speech_like
+
+    seconds = max(0.5, 0.065 * len(text))
+    time.sleep(rtf * seconds)
+    return speech_like(seconds, SR, seed=len(text)), SR
+
+
+def stub_clone_voice_array(model, text, reference_audio, pitch_control=0.7, energy_control=0.85, duration_control=1.25):
+    """Same shape as styletts_service.clone_voice_array: acoustic model, then the real DSP chain."""
+    from services import styletts_service
+
+    audio = model.inference(text, output_sample_rate=SR)
+    y = styletts_service.process_voice_male(
+        audio, SR, pitch_control=pitch_control, energy_control=energy_control, duration_control=duration_control
+    )
+    return y, SR
+
+
+# ---------------------------
+# Stage timing hooks
+# ---------------------------
+def _timed(stage, fn, exclusive_of=()):
+    """Wrap fn so its wall time is added to the current request's record under stage."""
+    def wrapper(*args, **kwargs):
+        record = _record.get()
+        if record is None:
+            return fn(*args, **kwargs)
+        nested = sum(record.get(s, 0.0) for s in exclusive_of)
+        t0 = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - t0 - (sum(record.get(s, 0.0) for s in exclusive_of) - nested)
+            record[stage] = record.get(stage, 0.0) + elapsed
+    return wrapper
+
+
+class _ContextExecutor(ThreadPoolExecutor):
+    """Runs each task in the submitter's contextvars context so stage records follow the work."""
+
+    def submit(self, fn, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def install_hooks(app_module):
+    """Time each pipeline stage of app.chat without touching the code under test."""
+    from services import styletts_service
+
+    app_module.stage_pool = _ContextExecutor(max_workers=app_module.PIPELINE_WORKERS, thread_name_prefix="pipeline-stage")
+    app_module.synthesize_speech_array = _timed("base_tts", app_module.synthesize_speech_array)
+    styletts_service.process_voice_male = _timed("adjust_voice_male", styletts_service.process_voice_male)
+    styletts_service.clone_voice_array = _timed("clone", styletts_service.clone_voice_array, exclusive_of=("adjust_voice_male",))
+
+    save_audio = app_module.save_audio
+
+    def timed_save(audio, path):
+        record = _record.get()
+        if record is not None and audio is not None:
+            y, sr = audio
+            record["audio_seconds"] = max(record.get("audio_seconds", 0.0), len(y) / float(sr))
+        return save_audio(audio, path)
+    app_module.save_audio = _timed("file_io", timed_save)
+
+    # The scheduler reports queue / tokenize / generate seconds on each request's future
+    scheduler = app_module.brain().scheduler
+    submit = scheduler.submit
+
+    def tracked_submit(prompt, **overrides):
+        future = submit(prompt, **overrides)
+        record = _record.get()
+        if record is not None:
+            record.setdefault("futures", []).append(future)
+        return future
+    scheduler.submit = tracked_submit
+
+
+def load_app(stub, stub_args, ready_timeout):
+    if stub:
+        # Components are registered below with stubs instead of the real loaders
+        os.environ["APP_AUTOSTART"] = "0"
+    import app as app_module
+
+    if stub:
+        from services import styletts_service
+        from services.generation_scheduler import GenerationScheduler
+
+        def load_brain():
+            tokenizer, model = StubTokenizer(), StubModel(stub_args.seconds_per_token)
+            scheduler = GenerationScheduler(model, tokenizer, app_module.GENERATION_KWARGS)
+            return SimpleNamespace(
+                tokenizer=tokenizer, model=model, scheduler=scheduler, sessions=None,
+                generation_kwargs=app_module.GENERATION_KWARGS, adapters=None, responses=None,
+            )
+
+        app_module.synthesize_speech_array = lambda text: stub_synthesize_speech_array(text, stub_args.tts_rtf)
+        styletts_service.clone_voice_array = stub_clone_voice_array
+        app_module.components.register("kalam_brain", load_brain)
+        app_module.components.register("styletts", lambda: StubStyleTTS(stub_args.clone_rtf), required=False)
+        app_module.components.start()
+
+    deadline = time.time() + ready_timeout
+    while not app_module.components.ready():
+        if time.time() > deadline:
+            raise RuntimeError(f"components not ready after {ready_timeout}s: {app_module.components.status()}")
+        time.sleep(0.5)
+    return app_module
+
+
+# ---------------------------
+# Drivers
+# ---------------------------
+def make_inprocess_client(app_module):
+    local = threading.local()
+
+    def post(payload):
+        if not hasattr(local, "client"):
+            local.client = app_module.app.test_client()
+        response = local.client.post("/chat", json=payload)
+        return response.status_code, response.get_json(silent=True) or {}
+    return post
+
+
+def make_http_client(url, timeout):
+    import requests
+
+    local = threading.local()
+
+    def post(payload):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        response = local.session.post(f"{url.rstrip('/')}/chat", json=payload, timeout=timeout)
+        try:
+            return response.status_code, response.json()
+        except ValueError:
+            return response.status_code, {}
+    return post
+
+
+def _audio_seconds(path):
+    """Duration of an audio file the server wrote, when it is visible from here."""
+    try:
+        import soundfile as sf
+        return sf.info(path).duration if path and os.path.exists(path) else None
+    except Exception:
+        return None
+
+
+def run_one(post, payload):
+    record = {}
+    _record.set(record)
+    t0 = time.perf_counter()
+    status, body = post(payload)
+    record["total"] = time.perf_counter() - t0
+    record["status"] = status
+    for future in record.pop("futures", []):
+        record.update(future.timings)
+    # Over HTTP the server's own per-request profile is the only stage breakdown
+    profile = body.get("profile") or {}
+    for stage, seconds in profile.get("stages", {}).items():
+        record.setdefault(stage, seconds)
+    if profile.get("new_tokens") is not None:
+        record.setdefault("new_tokens", profile["new_tokens"])
+    # exact / semantic / miss when the server runs with RESPONSE_CACHE_ENABLED=1
+    tier = (body.get("cache") or {}).get("response")
+    if tier:
+        record["response_cache"] = tier
+    if "audio_seconds" not in record:
+        seconds = _audio_seconds(body.get("audio_file"))
+        if seconds:
+            record["audio_seconds"] = seconds
+    return record
+
+
+def replay(post, workload, concurrency, repeat=1):
+    items = [dict(p) for p in workload] * repeat
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="bench-client") as pool:
+        records = list(pool.map(lambda p: run_one(post, p), items))
+    return records, time.perf_counter() - started
+
+
+# ---------------------------
+# Summary
+# ---------------------------
+def percentiles(values):
+    if not values:
+        return None
+    v = np.asarray(values, dtype=np.float64)
+    return {
+        "n": int(v.size),
+        "mean": round(float(v.mean()), 4),
+        "p50": round(float(np.percentile(v, 50)), 4),
+        "p95": round(float(np.percentile(v, 95)), 4),
+        "p99": round(float(np.percentile(v, 99)), 4),
+    }
+
+
+def response_cache_summary(ok):
+    """Hit rate and hit-vs-miss latency of the server's response cache, when it reported tiers."""
+    tiered = [r for r in ok if "response_cache" in r]
+    if not tiered:
+        return None
+    hits = [r for r in tiered if r["response_cache"] != "miss"]
+    misses = [r for r in tiered if r["response_cache"] == "miss"]
+    return {
+        "hit_rate": round(len(hits) / len(tiered), 4),
+        "exact": sum(r["response_cache"] == "exact" for r in hits),
+        "semantic": sum(r["response_cache"] == "semantic" for r in hits),
+        "hit_latency": percentiles([r["total"] for r in hits]),
+        "miss_latency": percentiles([r["total"] for r in misses]),
+    }
+
+
+def summarize(records, wall, concurrency):
+    ok = [r for r in records if r.get("status") == 200]
+    tokens = sum(r.get("new_tokens", 0) for r in ok)
+    audio = sum(r.get("audio_seconds", 0.0) for r in ok)
+    return {
+        "concurrency": concurrency,
+        "requests": len(records),
+        "errors": len(records) - len(ok),
+        "wall_seconds": round(wall, 3),
+        "requests_per_sec": round(len(ok) / wall, 3) if wall else 0.0,
+        "tokens_per_sec": round(tokens / wall, 2) if wall and tokens else None,
+        "audio_seconds_per_sec": round(audio / wall, 3) if wall and audio else None,
+        "latency": percentiles([r["total"] for r in ok]),
+        "stages": {s: percentiles([r[s] for r in ok if s in r]) for s in STAGES if any(s in r for r in ok)},
+        "decode_tokens_per_sec": percentiles([r["new_tokens"] / r["generate"] for r in ok if r.get("generate") and "new_tokens" in r]),
+        # Real-time factor: seconds spent per second of audio produced (< 1 is faster than real time)
+        "rtf": percentiles([r["total"] / r["audio_seconds"] for r in ok if r.get("audio_seconds")]),
+        "base_tts_rtf": percentiles([r["base_tts"] / r["audio_seconds"] for r in ok if r.get("audio_seconds") and "base_tts" in r]),
+        "response_cache": response_cache_summary(ok),
+    }
+
+
+def print_summary(s):
+    lat = s["latency"] or {}
+    print(f"concurrency={s['concurrency']:<3} req={s['requests']:<4} err={s['errors']:<3} "
+          f"p50={lat.get('p50', 0):.3f}s p95={lat.get('p95', 0):.3f}s p99={lat.get('p99', 0):.3f}s "
+          f"req/s={s['requests_per_sec']}  tok/s={s['tokens_per_sec']}  "
+          f"rtf_p50={(s['rtf'] or {}).get('p50')}")
+    for stage, p in s["stages"].items():
+        print(f"    {stage:<18} p50={p['p50']:.4f}s p95={p['p95']:.4f}s p99={p['p99']:.4f}s (n={p['n']})")
+    cache = s.get("response_cache")
+    if cache:
+        hit, miss = cache["hit_latency"] or {}, cache["miss_latency"] or {}
+        print(f"    response cache     hit_rate={cache['hit_rate']:.0%} (exact {cache['exact']}, semantic {cache['semantic']})  "
+              f"p50 hit={hit.get('p50', 0):.3f}s miss={miss.get('p50', 0):.3f}s")
+
+
+def compare(current, baseline_path):
+    """Print p50/p95 deltas against an earlier results file, matched by concurrency."""
+    with open(baseline_path) as f:
+        baseline = {s["concurrency"]: s for s in json.load(f)["runs"]}
+    print(f"📊 vs {baseline_path}")
+    for run in current:
+        old = baseline.get(run["concurrency"])
+        if not old:
+            continue
+        rows = [("latency", run["latency"], old["latency"])]
+        rows += [(s, p, old["stages"].get(s)) for s, p in run["stages"].items()]
+        for name, new_p, old_p in rows:
+            if not new_p or not old_p:
+                continue
+            deltas = "  ".join(
+                f"{q} {old_p[q]:.4f}→{new_p[q]:.4f}s ({(new_p[q] / old_p[q] - 1) * 100 if old_p[q] else 0:+.1f}%)"
+                for q in ("p50", "p95")
+            )
+            print(f"  c={run['concurrency']:<3} {name:<18} {deltas}")
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a JSONL workload through /chat and time every pipeline stage.")
+    parser.add_argument("--workload", default="requests.jsonl")
+    parser.add_argument("--limit", type=int, default=None, help="use only the first N prompts")
+    parser.add_argument("--max-prompt-chars", type=int, default=400)
+    parser.add_argument("--repeat", type=int, default=1, help="replay the workload this many times per level")
+    parser.add_argument("--concurrency", default="1,4")
+    parser.add_argument("--mode", choices=["inprocess", "http"], default="inprocess")
+    parser.add_argument("--url", default=None, help="server for --mode http (default: serve app.py on a local port)")
+    parser.add_argument("--outputs", choices=["base", "cloned", "both"], default=None, help="override /chat outputs")
+    parser.add_argument("--stub", action="store_true", help="stub LLM / TTS / StyleTTS2 models (real DSP and file I/O)")
+    parser.add_argument("--seconds-per-token", type=float, default=0.004, help="stub decoder speed")
+    parser.add_argument("--tts-rtf", type=float, default=0.05, help="stub base TTS real-time factor")
+    parser.add_argument("--clone-rtf", type=float, default=0.15, help="stub StyleTTS2 real-time factor")
+    parser.add_argument("--audio-cache", action="store_true", help="leave the rendered-audio cache on")
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--out", default=RESULTS_FILE)
+    parser.add_argument("--compare", default=None, help="earlier results file to diff against")
+    args = parser.parse_args()
+
+    if not args.audio_cache:
+        # Repeated prompts would otherwise measure the cache, not the pipeline
+        os.environ["AUDIO_CACHE_ENABLED"] = "0"
+
+    workload = load_workload(args.workload, args.limit, args.max_prompt_chars)
+    if not workload:
+        sys.exit(f"❌ No prompts in {args.workload}")
+    if args.outputs:
+        for payload in workload:
+            payload["outputs"] = args.outputs
+    if args.stub:
+        for payload in workload:
+            payload.pop("session_id", None)  # stub brain has no session cache
+    if args.mode == "http":
+        for payload in workload:
+            payload["profile"] = True
+
+    server = None
+    if args.mode == "http" and args.url:
+        post = make_http_client(args.url, args.timeout)
+    else:
+        app_module = load_app(args.stub, args, args.timeout)
+        install_hooks(app_module)
+        if args.mode == "http":
+            from werkzeug.serving import make_server
+
+            server = make_server("127.0.0.1", 0, app_module.app, threaded=True)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            post = make_http_client(f"http://127.0.0.1:{server.server_port}", args.timeout)
+        else:
+            post = make_inprocess_client(app_module)
+
+    for payload in workload[:args.warmup]:
+        run_one(post, payload)
+
+    runs = []
+    for level in [int(c) for c in args.concurrency.split(",")]:
+        records, wall = replay(post, workload, level, args.repeat)
+        summary = summarize(records, wall, level)
+        print_summary(summary)
+        runs.append(summary)
+
+    if server is not None:
+        server.shutdown()
+
+    results = {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "mode": args.mode,
+        "stub": args.stub,
+        "workload": args.workload,
+        "prompts": len(workload),
+        "args": vars(args),
+        "runs": runs,
+    }
+    out_dir = os.path.dirname(args.out)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"📝 Results saved at: {args.out}")
+
+    if args.compare:
+        compare(runs, args.compare)
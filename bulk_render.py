@@ -0,0 +1,208 @@
+import os
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# ----------------------------
+# Offline bulk rendering: JSONL prompts → responses + male-voice audio + manifest
+# ----------------------------
+# Generation runs in padded batches on the shared GenerationScheduler, base TTS on a pool
+# of pyttsx3 worker processes, and male-voice post-processing in batched array passes.
+# The three stages overlap: while one chunk is post-processed, later prompts are still
+# generating and being spoken.
+#
+#   python bulk_render.py --input classroom_qa.jsonl --out results/bulk
+#
+# Each chunk's WAVs are renamed into place and their rows appended to <out>/manifest.jsonl
+# as soon as the chunk is done, so an interrupted run picks up where it stopped.
+
+MANIFEST = "manifest.jsonl"
+SUMMARY = "summary.json"
+
+
+def read_prompts(path, limit=None):
+    """[(id, text)] from a JSONL file; id from id/request_id (or the line number), text from text/body/title."""
+    prompts = []
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            text = (row.get("text") or row.get("body") or row.get("title") or "").strip()
+            if not text:
+                continue
+            prompt_id = str(row.get("id") or row.get("request_id") or f"line-{number:06d}")
+            prompts.append((prompt_id, text))
+            if limit and len(prompts) >= limit:
+                break
+    return prompts
+
+
+def read_manifest(out_dir):
+    """{id: manifest row} of utterances already rendered (rows whose audio file is missing are redone)."""
+    done = {}
+    path = os.path.join(out_dir, MANIFEST)
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                continue  # a line cut short by the interruption
+            if os.path.exists(os.path.join(out_dir, row.get("audio_file", ""))):
+                done[row["id"]] = row
+    return done
+
+
+def _safe_name(prompt_id):
+    return "".join(c if c.isalnum() or c in "-_." else "_" for c in prompt_id)[:120]
+
+
+def render_bulk(app_module, prompts, out_dir, batch_size=8, tts_workers=None, chunk_size=32,
+                max_prompt_chars=1000, generation_overrides=None, persona=None):
+    from services.audio_io import save_audio
+    from services.generation_scheduler import GenerationScheduler
+    from services.styletts_service import process_voice_male_batch
+    from services.tts_pool import TTSWorkerPool, TTS_POOL_SIZE, TARGET_SR
+
+    os.makedirs(os.path.join(out_dir, "audio"), exist_ok=True)
+    done = read_manifest(out_dir)
+    if done or os.path.exists(os.path.join(out_dir, MANIFEST)):
+        # Rewrite without torn or stale rows, so appends start on a clean line
+        compacted = os.path.join(out_dir, MANIFEST + ".tmp")
+        with open(compacted, "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(row, ensure_ascii=False) + "\n" for row in done.values())
+        os.replace(compacted, os.path.join(out_dir, MANIFEST))
+    todo = [(pid, text[:max_prompt_chars]) for pid, text in prompts if pid not in done]
+    print(f"📚 {len(prompts)} prompts, {len(done)} already rendered, {len(todo)} to go")
+    if not todo:
+        return {"utterances": 0, "skipped": len(done)}
+
+    started = time.perf_counter()
+    tokenizer, model, _, adapters = app_module._load_kalam_weights()
+    if adapters is not None:
+        persona = adapters.acquire(persona)
+    generation_kwargs = dict(app_module.GENERATION_KWARGS, **(generation_overrides or {}))
+    scheduler = GenerationScheduler(model, tokenizer, generation_kwargs, max_batch_size=batch_size, max_wait_ms=200)
+    tts = TTSWorkerPool(size=tts_workers or TTS_POOL_SIZE)
+    tts_threads = ThreadPoolExecutor(max_workers=tts_workers or TTS_POOL_SIZE, thread_name_prefix="bulk-tts")
+    loaded = time.perf_counter()
+
+    # Similar prompt lengths share a batch, so little compute goes to padding
+    todo.sort(key=lambda item: len(tokenizer(item[1], add_special_tokens=False)["input_ids"]))
+    timings = {"tts": 0.0}
+    lock = threading.Lock()
+
+    def speak(future):
+        """Runs on a TTS thread once a response is generated; returns (response, audio or None)."""
+        text = future.result()
+        if not text or len(text) < 5:
+            text = app_module.FALLBACK_RESPONSE
+        t0 = time.perf_counter()
+        try:
+            audio = tts.synthesize(text)
+        except Exception as e:
+            print(f"❌ TTS failed: {e}")
+            audio = None
+        with lock:
+            timings["tts"] += time.perf_counter() - t0
+        return text, audio
+
+    # Queue every generation up front; each finished response goes straight to TTS
+    spoken = []
+    for pid, text in todo:
+        future = scheduler.submit(text, adapter=persona)
+        spoken.append(tts_threads.submit(speak, future))
+
+    rendered, failed, audio_seconds = 0, 0, 0.0
+    post_seconds = 0.0
+    with open(os.path.join(out_dir, MANIFEST), "a", encoding="utf-8") as manifest:
+        for start in range(0, len(todo), chunk_size):
+            items = todo[start:start + chunk_size]
+            results = [f.result() for f in spoken[start:start + chunk_size]]
+            ok = [i for i, (_, audio) in enumerate(results) if audio is not None]
+            failed += len(items) - len(ok)
+
+            t0 = time.perf_counter()
+            processed = process_voice_male_batch(
+                [results[i][1][0] for i in ok], TARGET_SR,
+                pitch_control=app_module.PITCH, energy_control=app_module.ENERGY, duration_control=app_module.DURATION,
+            )
+            post_seconds += time.perf_counter() - t0
+
+            for i, y in zip(ok, processed):
+                pid, prompt = items[i]
+                name = os.path.join("audio", _safe_name(pid) + ".wav")
+                partial = os.path.join(out_dir, "audio", _safe_name(pid) + ".part.wav")
+                save_audio((y, TARGET_SR), partial)
+                os.replace(partial, os.path.join(out_dir, name))
+                seconds = len(y) / float(TARGET_SR)
+                audio_seconds += seconds
+                manifest.write(json.dumps({
+                    "id": pid, "prompt": prompt, "response": results[i][0],
+                    "audio_file": name, "duration": round(seconds, 3), "sr": TARGET_SR,
+                }, ensure_ascii=False) + "\n")
+                rendered += 1
+            manifest.flush()
+            os.fsync(manifest.fileno())
+            elapsed = time.perf_counter() - loaded
+            print(f"🎙️ {start + len(items)}/{len(todo)} rendered ({rendered / elapsed * 60:.1f} utterances/min)")
+
+    wall = time.perf_counter() - loaded
+    tts_threads.shutdown()
+    tts.close()
+    if adapters is not None:
+        adapters.release(persona)
+    gen = scheduler.stats()
+    summary = {
+        "utterances": rendered,
+        "failed": failed,
+        "skipped": len(done),
+        "load_seconds": round(loaded - started, 2),
+        "wall_seconds": round(wall, 2),
+        "utterances_per_min": round(rendered / wall * 60, 2) if wall else 0.0,
+        "audio_seconds": round(audio_seconds, 1),
+        "rtf": round(wall / audio_seconds, 4) if audio_seconds else None,
+        "generate": {"batches": gen["batches"], "avg_batch_size": gen["avg_batch_size"],
+                     "tokens": gen["tokens"], "tokens_per_sec": gen["tokens_per_sec"]},
+        "tts_seconds": round(timings["tts"], 2),
+        "post_process_seconds": round(post_seconds, 2),
+    }
+    with open(os.path.join(out_dir, SUMMARY), "w") as f:
+        json.dump(summary, f, indent=2)
+    print(f"✅ {rendered} utterances in {wall:.1f}s → {summary['utterances_per_min']} utterances/min "
+          f"({failed} failed, {len(done)} resumed) → {out_dir}")
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render a JSONL file of prompts offline (batched generation, pooled TTS, batched post-processing).")
+    parser.add_argument("--input", required=True, help="JSONL with a text/body/title field (and optional id) per line")
+    parser.add_argument("--out", default="results/bulk")
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=8, help="prompts per padded generate call")
+    parser.add_argument("--tts-workers", type=int, default=None, help="pyttsx3 worker processes (default TTS_POOL_SIZE)")
+    parser.add_argument("--chunk-size", type=int, default=32, help="utterances per post-processing batch / manifest flush")
+    parser.add_argument("--max-prompt-chars", type=int, default=1000)
+    parser.add_argument("--max-new-tokens", type=int, default=None)
+    parser.add_argument("--greedy", action="store_true", help="greedy decoding, so a resumed run matches a clean one")
+    parser.add_argument("--persona", default=None, help="LoRA persona when ADAPTER_SERVING=1")
+    args = parser.parse_args()
+
+    # Reuse the server's model loader and voice settings without starting the server components
+    os.environ["APP_AUTOSTART"] = "0"
+    import app as app_module
+
+    overrides = {}
+    if args.max_new_tokens:
+        overrides["max_new_tokens"] = args.max_new_tokens
+    if args.greedy:
+        overrides.update(do_sample=False, temperature=None)
+    render_bulk(
+        app_module, read_prompts(args.input, args.limit), args.out,
+        batch_size=args.batch_size, tts_workers=args.tts_workers, chunk_size=args.chunk_size,
+        max_prompt_chars=args.max_prompt_chars, generation_overrides=overrides, persona=args.persona,
+    )
@@ -0,0 +1,138 @@
+# services/components.py
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+# ----------------------------
+# Startup profile
+# ----------------------------
+class StartupProfile:
+    """Wall-clock seconds per import / model-load step, in the order they finished."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._steps = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def step(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._steps.append({
+                    "step": name,
+                    "seconds": round(time.perf_counter() - t0, 3),
+                    "thread": threading.current_thread().name,
+                })
+
+    def report(self):
+        with self._lock:
+            steps = list(self._steps)
+        return {"since_process_start": round(time.perf_counter() - self.started, 3), "steps": steps}
+
+    def save(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+        return path
+
+
+# ----------------------------
+# Background-loaded components
+# ----------------------------
+class ComponentNotReady(Exception):
+    def __init__(self, name, state, error=None):
+        super().__init__(f"{name} is {state}" + (f": {error}" if error else ""))
+        self.name = name
+        self.state = state
+
+
+class _Component:
+    def __init__(self, name, loader, required):
+        self.name = name
+        self.loader = loader
+        self.required = required
+        self.state = "pending"
+        self.value = None
+        self.error = None
+        self.seconds = None
+        self.ready = threading.Event()
+
+
+class ComponentRegistry:
+    """
+    Loads heavy components (models, worker pools) on background threads so the HTTP
+    server can bind immediately. Request handlers fetch them with get(), which waits
+    a bounded time and raises ComponentNotReady otherwise.
+    """
+
+    def __init__(self, profile=None):
+        self.profile = profile or StartupProfile()
+        self._components = {}
+        self._order = []
+
+    def register(self, name, loader, required=True):
+        self._components[name] = _Component(name, loader, required)
+        self._order.append(name)
+
+    def _load(self, component):
+        component.state = "loading"
+        t0 = time.perf_counter()
+        try:
+            with self.profile.step(f"load {component.name}"):
+                component.value = component.loader()
+            component.state = "ready"
+            print(f"✅ {component.name} ready ({time.perf_counter() - t0:.1f}s)")
+        except Exception as e:
+            component.state = "failed"
+            component.error = str(e)
+            print(f"❌ {component.name} failed to load: {e}")
+        finally:
+            component.seconds = round(time.perf_counter() - t0, 3)
+            component.ready.set()
+
+    def start(self, on_complete=None):
+        """Kick off every registered loader in its own daemon thread."""
+        threads = []
+        for name in self._order:
+            t = threading.Thread(target=self._load, args=(self._components[name],), name=f"load-{name}", daemon=True)
+            t.start()
+            threads.append(t)
+        if on_complete is not None:
+            def wait_all():
+                for t in threads:
+                    t.join()
+                on_complete()
+            threading.Thread(target=wait_all, name="load-complete", daemon=True).start()
+
+    def get(self, name, timeout=0.0):
+        component = self._components[name]
+        if not component.ready.wait(timeout):
+            raise ComponentNotReady(name, component.state)
+        if component.state != "ready":
+            raise ComponentNotReady(name, component.state, component.error)
+        return component.value
+
+    def is_ready(self, name):
+        return self._components[name].state == "ready"
+
+    def ready(self):
+        """True once every required component has loaded."""
+        return all(c.state == "ready" for c in self._components.values() if c.required)
+
+    def status(self):
+        return {
+            name: {
+                "state": c.state,
+                "required": c.required,
+                "load_seconds": c.seconds,
+                **({"error": c.error} if c.error else {}),
+            }
+            for name, c in ((n, self._components[n]) for n in self._order)
+        }
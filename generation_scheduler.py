@@ -0,0 +1,188 @@
+# services/generation_scheduler.py
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+import torch
+
+from services.metrics import observe, GENERATED_TOKENS
+
+# ----------------------------
+# Config
+# ----------------------------
+GEN_MAX_BATCH_SIZE = int(os.getenv("GEN_MAX_BATCH_SIZE", "8"))
+GEN_MAX_WAIT_MS = float(os.getenv("GEN_MAX_WAIT_MS", "25"))
+
+
+class GenerationScheduler:
+    """
+    Dynamic batching front-end for model.generate.
+    Prompts arriving within a short window are left-padded into one batch,
+    generated together and each completion is routed back to its caller.
+    """
+
+    def __init__(self, model, tokenizer, generation_kwargs, max_batch_size=GEN_MAX_BATCH_SIZE, max_wait_ms=GEN_MAX_WAIT_MS):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.generation_kwargs = dict(generation_kwargs)
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+
+        # Decoder-only models must be padded on the left so every prompt ends at the same position
+        self.tokenizer.padding_side = "left"
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "batches": 0, "tokens": 0, "generate_seconds": 0.0}
+        self._thread = threading.Thread(target=self._run, name="generation-scheduler", daemon=True)
+        self._thread.start()
+
+    # ----------------------------
+    # Public API
+    # ----------------------------
+    def submit(self, prompt, adapter=None, **overrides):
+        """
+        Queue a prompt; returns a Future resolving to the generated text (prompt excluded).
+        adapter names a LoRA adapter of a PEFT model (see adapter_pool.py); requests for
+        different adapters still share one batch.
+        Once resolved, future.timings holds that request's queue/tokenize/generate seconds and new_tokens.
+        """
+        future = Future()
+        future.submitted = time.perf_counter()
+        future.timings = {}
+        future.adapter = adapter
+        self._queue.put((prompt, overrides, future))
+        return future
+
+    def generate(self, prompt, timeout=None, adapter=None, **overrides):
+        return self.submit(prompt, adapter=adapter, **overrides).result(timeout=timeout)
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        seconds = stats["generate_seconds"]
+        stats["tokens_per_sec"] = round(stats["tokens"] / seconds, 2) if seconds > 0 else 0.0
+        stats["avg_batch_size"] = round(stats["requests"] / stats["batches"], 2) if stats["batches"] else 0.0
+        return stats
+
+    # ----------------------------
+    # Worker loop
+    # ----------------------------
+    def _collect(self):
+        """Block for the first request, then gather more until the batch is full or the window closes."""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            # Requests with different sampling overrides cannot share one generate call
+            groups = {}
+            for item in batch:
+                key = tuple(sorted(item[1].items()))
+                groups.setdefault(key, []).append(item)
+            for items in groups.values():
+                self._generate_batch(items)
+
+    def _generate_batch(self, items):
+        prompts = [prompt for prompt, _, _ in items]
+        futures = [future for _, _, future in items]
+        kwargs = dict(self.generation_kwargs, **items[0][1])
+        adapters = [future.adapter for future in futures]
+        if any(adapters):
+            # PEFT mixed-adapter batch: each row runs through its own LoRA weights
+            kwargs["adapter_names"] = [name or "__base__" for name in adapters]
+        try:
+            started = time.perf_counter()
+            inputs = self.tokenizer(prompts, return_tensors="pt", padding=True)
+            tokenized = time.perf_counter()
+            with torch.inference_mode():
+                output = self.model.generate(**inputs, pad_token_id=self.tokenizer.pad_token_id, **kwargs)
+            finished = time.perf_counter()
+            elapsed = finished - started
+
+            prompt_len = inputs["input_ids"].shape[1]
+            new_tokens = output[:, prompt_len:]
+            token_count = 0
+            for row, future in zip(new_tokens, futures):
+                # Sequences that stopped early are padded after their EOS; don't count those
+                count = int((row != self.tokenizer.pad_token_id).sum())
+                token_count += count
+                future.timings = {
+                    "queue": started - future.submitted,
+                    "tokenize": tokenized - started,
+                    "generate": finished - tokenized,
+                    "new_tokens": count,
+                    "batch_size": len(items),
+                }
+                observe("queue", future.timings["queue"])
+                observe("tokenize", future.timings["tokenize"])
+                observe("generate", future.timings["generate"])
+                future.set_result(self.tokenizer.decode(row, skip_special_tokens=True).strip())
+
+            GENERATED_TOKENS.inc(token_count)
+            with self._lock:
+                self._stats["requests"] += len(items)
+                self._stats["batches"] += 1
+                self._stats["tokens"] += token_count
+                self._stats["generate_seconds"] += elapsed
+        except Exception as e:
+            print(f"❌ Batched generation failed: {e}")
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+
+
+# ----------------------------
+# Throughput benchmark
+# ----------------------------
+if __name__ == "__main__":
+    import argparse
+    from concurrent.futures import ThreadPoolExecutor
+    from transformers import AutoTokenizer, AutoModelForCausalLM
+
+    parser = argparse.ArgumentParser(description="Measure tokens/sec of the batching scheduler vs concurrency.")
+    parser.add_argument("--model-dir", default="models/kalam_brain/merged_model")
+    parser.add_argument("--concurrency", default="1,2,4,8")
+    parser.add_argument("--requests", type=int, default=16)
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    args = parser.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model_dir)
+    model = AutoModelForCausalLM.from_pretrained(args.model_dir, dtype=torch.float32, low_cpu_mem_usage=True)
+    model.eval()
+    prompts = [
+        "How can I dream big?",
+        "What is the role of a teacher?",
+        "Tell me about India's space programme.",
+        "How should students deal with failure?",
+    ]
+
+    for level in [int(c) for c in args.concurrency.split(",")]:
+        scheduler = GenerationScheduler(
+            model, tokenizer,
+            dict(max_new_tokens=args.max_new_tokens, do_sample=False),
+            max_batch_size=level,
+        )
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=level) as pool:
+            list(pool.map(scheduler.generate, [prompts[i % len(prompts)] for i in range(args.requests)]))
+        wall = time.perf_counter() - started
+        stats = scheduler.stats()
+        print(f"concurrency={level:<3} wall={wall:6.2f}s  tokens/sec={stats['tokens'] / wall:7.2f}  avg_batch={stats['avg_batch_size']}")
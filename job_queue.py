@@ -0,0 +1,252 @@
+# services/job_queue.py
+import os
+import math
+import time
+import uuid
+import shutil
+import threading
+import contextvars
+from collections import OrderedDict, deque
+
+# ----------------------------
+# Config
+# ----------------------------
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+# Jobs allowed to wait for a worker; beyond this submit() raises QueueFull (HTTP 429)
+JOB_QUEUE_MAX = int(os.getenv("JOB_QUEUE_MAX", "32"))
+JOBS_DIR = os.getenv("JOBS_DIR", "results/jobs")
+# Finished jobs and their output directories are removed this long after they finish
+JOB_TTL_SECONDS = float(os.getenv("JOB_TTL_SECONDS", "3600"))
+JOB_SWEEP_SECONDS = float(os.getenv("JOB_SWEEP_SECONDS", "60"))
+# Longest a status long-poll may block
+JOB_MAX_WAIT_SECONDS = float(os.getenv("JOB_MAX_WAIT_SECONDS", "30"))
+# Longest a synchronous /chat or /clone waits for its job before answering 202 with the job id
+JOB_SYNC_WAIT_SECONDS = float(os.getenv("JOB_SYNC_WAIT_SECONDS", "300"))
+
+
+class QueueFull(Exception):
+    def __init__(self, depth, retry_after):
+        super().__init__(f"job queue is full ({depth} waiting)")
+        self.depth = depth
+        self.retry_after = retry_after
+
+
+class Job:
+    """One unit of work with its own output directory; status goes queued → running → done | failed | cancelled."""
+
+    def __init__(self, job_id, kind, directory, fn):
+        self.id = job_id
+        self.kind = kind
+        self.dir = directory
+        self.status = "queued"
+        self.result = None
+        self.http_status = None
+        self.created = time.time()
+        self.submitted = time.perf_counter()
+        self.started = None
+        self.finished = None
+        self._fn = fn
+        # Runs in the submitter's context (like metrics.in_context) so profiles and spans follow the job
+        self._context = contextvars.copy_context()
+        self._done = threading.Event()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    def files(self):
+        return sorted(os.listdir(self.dir)) if os.path.isdir(self.dir) else []
+
+    def to_dict(self):
+        info = {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "created": self.created,
+            "queued_seconds": round((self.started or time.time()) - self.created, 3),
+        }
+        if self.finished is not None:
+            info["run_seconds"] = round(self.finished - self.started, 3) if self.started else 0.0
+            info["result"] = self.result
+            info["files"] = self.files()
+        return info
+
+
+class JobQueue:
+    """
+    Bounded worker pool for pipeline jobs.
+    At most `workers` jobs run at once and at most `max_queued` wait; the rest are rejected
+    up front, so a burst is absorbed by queueing (FIFO) and 429s instead of every request
+    slowing down together. Each job writes into root/<job id>/, removed `ttl` seconds after
+    the job finishes.
+    Threads start on first use in each process: a forked worker (serve_multiworker.py)
+    inherits none of the parent's threads, so it starts its own.
+    """
+
+    def __init__(self, workers=JOB_WORKERS, max_queued=JOB_QUEUE_MAX, root=JOBS_DIR,
+                 ttl=JOB_TTL_SECONDS, sweep_every=JOB_SWEEP_SECONDS):
+        self.workers = max(1, int(workers))
+        self.max_queued = max(0, int(max_queued))
+        self.root = root
+        self.ttl = float(ttl)
+        self.sweep_every = float(sweep_every)
+
+        self._jobs = OrderedDict()
+        self._pending = deque()
+        self._running = 0
+        self._durations = deque(maxlen=50)
+        self._cond = threading.Condition()
+        self._stats = {"submitted": 0, "rejected": 0, "completed": 0, "failed": 0, "cancelled": 0, "expired": 0}
+        self._started_pid = None
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def start(self):
+        """Start the worker and sweeper threads in this process (no-op if already running here)."""
+        with self._cond:
+            if self._started_pid == os.getpid():
+                return
+            self._started_pid = os.getpid()
+        for i in range(self.workers):
+            threading.Thread(target=self._run, name=f"job-worker-{i}", daemon=True).start()
+        if self.sweep_every > 0:
+            threading.Thread(target=self._sweep_loop, args=(self.sweep_every,), name="job-sweeper", daemon=True).start()
+
+    def _after_fork(self):
+        """In a forked child: no threads came along, so reset the lock and drop the parent's jobs."""
+        self._cond = threading.Condition()
+        self._jobs = OrderedDict()
+        self._pending = deque()
+        self._running = 0
+        self._started_pid = None
+
+    # ----------------------------
+    # Public API
+    # ----------------------------
+    def submit(self, fn, kind="chat"):
+        """Queue fn(job) -> (payload, http_status); raises QueueFull when the queue is at capacity."""
+        self.start()
+        with self._cond:
+            if len(self._pending) >= self.max_queued and self._running >= self.workers:
+                self._stats["rejected"] += 1
+                raise QueueFull(len(self._pending), self._retry_after())
+            job_id = uuid.uuid4().hex
+            job = Job(job_id, kind, os.path.join(self.root, job_id), fn)
+            self._jobs[job_id] = job
+            self._pending.append(job)
+            self._stats["submitted"] += 1
+            self._cond.notify()
+        return job
+
+    def get(self, job_id):
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Cancel a queued job or forget a finished one (and its files); running jobs are left alone."""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None or job.status == "running":
+                return job
+            if job.status == "queued":
+                self._pending.remove(job)
+                job.status, job.finished = "cancelled", time.time()
+                self._stats["cancelled"] += 1
+                job._done.set()
+            del self._jobs[job_id]
+        shutil.rmtree(job.dir, ignore_errors=True)
+        return job
+
+    def queue_depth(self):
+        with self._cond:
+            return len(self._pending)
+
+    def stats(self):
+        with self._cond:
+            return {
+                **self._stats,
+                "queued": len(self._pending),
+                "running": self._running,
+                "workers": self.workers,
+                "max_queued": self.max_queued,
+                "tracked": len(self._jobs),
+                "avg_run_seconds": round(sum(self._durations) / len(self._durations), 3) if self._durations else None,
+                "ttl_seconds": self.ttl,
+            }
+
+    # ----------------------------
+    # Workers
+    # ----------------------------
+    def _retry_after(self):
+        """Seconds until a queue slot should free up, from recent job durations."""
+        average = sum(self._durations) / len(self._durations) if self._durations else 1.0
+        return max(1, math.ceil(average * (len(self._pending) + 1) / self.workers))
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                job = self._pending.popleft()
+                job.status, job.started = "running", time.time()
+                self._running += 1
+            try:
+                os.makedirs(job.dir, exist_ok=True)
+                payload, code = job._context.run(job._fn, job)
+            except Exception as e:
+                print(f"❌ Job {job.id} failed: {e}")
+                payload, code = {"error": str(e)}, 500
+            with self._cond:
+                self._running -= 1
+                job.result, job.http_status = payload, code
+                job.status = "done" if code < 400 else "failed"
+                job.finished = time.time()
+                self._durations.append(job.finished - job.started)
+                self._stats["completed" if code < 400 else "failed"] += 1
+            job._context = job._fn = None
+            job._done.set()
+
+    # ----------------------------
+    # TTL cleanup
+    # ----------------------------
+    def sweep(self, now=None):
+        """Drop finished jobs older than the TTL, plus leftover directories from earlier runs."""
+        now = time.time() if now is None else now
+        with self._cond:
+            expired = [j for j in self._jobs.values() if j.finished is not None and now - j.finished > self.ttl]
+            for job in expired:
+                del self._jobs[job.id]
+            known = set(self._jobs)
+            self._stats["expired"] += len(expired)
+        for job in expired:
+            shutil.rmtree(job.dir, ignore_errors=True)
+
+        stale = 0
+        if os.path.isdir(self.root):
+            for name in os.listdir(self.root):
+                path = os.path.join(self.root, name)
+                if name in known or not os.path.isdir(path):
+                    continue
+                try:
+                    if now - os.path.getmtime(path) > self.ttl:
+                        shutil.rmtree(path, ignore_errors=True)
+                        stale += 1
+                except OSError:
+                    pass
+        if expired or stale:
+            print(f"🧹 Removed {len(expired)} expired job(s) and {stale} stale output dir(s)")
+        return len(expired) + stale
+
+    def _sweep_loop(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"⚠️ Job sweep failed: {e}")
@@ -0,0 +1,122 @@
+# services/local_standins.py
+"""
+Local stand-ins for the remote voice services, for offline latency and throughput checks.
+- Replicate: transfer.sh-style PUT uploads, prediction create/poll, result download
+- Self-hosted RVC: POST /clone that echoes the uploaded audio back
+"""
+import re
+import json
+import time
+import uuid
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, so connection reuse is measurable
+
+    def log_message(self, format, *args):
+        pass
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0) or 0))
+
+    def _send(self, status, body=b"", content_type="application/json"):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def _start(handler_cls, state):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler_cls)
+    server.daemon_threads = True
+    server.state = state
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    state["base_url"] = base_url
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, base_url
+
+
+# ----------------------------
+# Replicate + transfer.sh stand-in
+# ----------------------------
+class _ReplicateHandler(_Handler):
+    def do_PUT(self):
+        state = self.server.state
+        if not self.path.startswith("/upload/"):
+            return self._send(404)
+        file_id = uuid.uuid4().hex
+        state["files"][file_id] = self._body()
+        state["uploads"] += 1
+        self._send(200, f"{state['base_url']}/files/{file_id}\n".encode(), "text/plain")
+
+    def do_POST(self):
+        state = self.server.state
+        if self.path != "/v1/predictions":
+            return self._send(404)
+        payload = json.loads(self._body() or b"{}")
+        pred_id = uuid.uuid4().hex
+        state["predictions"][pred_id] = {"created": time.monotonic(), "input": payload.get("input", {})}
+        self._send(201, self._prediction(pred_id))
+
+    def do_GET(self):
+        state = self.server.state
+        match = re.match(r"^/v1/predictions/(\w+)$", self.path)
+        if match:
+            state["polls"] += 1
+            return self._send(200, self._prediction(match.group(1)))
+        match = re.match(r"^/files/(\w+)$", self.path)
+        if match and match.group(1) in state["files"]:
+            return self._send(200, state["files"][match.group(1)], "audio/wav")
+        self._send(404)
+
+    def _prediction(self, pred_id):
+        state = self.server.state
+        pred = state["predictions"][pred_id]
+        done = time.monotonic() - pred["created"] >= state["processing_seconds"]
+        # The "model" echoes the input audio back as its output
+        output_url = pred["input"].get("input_audio")
+        return {
+            "id": pred_id,
+            "status": "succeeded" if done else "processing",
+            "output": [output_url] if done else None,
+            "urls": {"get": f"{state['base_url']}/v1/predictions/{pred_id}"},
+        }
+
+
+def start_replicate_standin(processing_seconds=1.0):
+    """Returns (server, base_url); server.state counts uploads and polls."""
+    state = {"files": {}, "predictions": {}, "uploads": 0, "polls": 0, "processing_seconds": processing_seconds}
+    return _start(_ReplicateHandler, state)
+
+
+# ----------------------------
+# Self-hosted RVC /clone stand-in
+# ----------------------------
+class _RVCHandler(_Handler):
+    def do_POST(self):
+        state = self.server.state
+        if self.path != "/clone":
+            return self._send(404)
+        body = self._body()
+        # Pull the file part out of the multipart body (or take a raw body as-is)
+        match = re.match(r'.*boundary="?([^";]+)"?', self.headers.get("Content-Type", ""))
+        if match:
+            boundary = b"--" + match.group(1).encode()
+            part = body.split(boundary)[1]
+            body = part.split(b"\r\n\r\n", 1)[1].rsplit(b"\r\n", 1)[0]
+        time.sleep(state["processing_seconds"])
+        with state["lock"]:
+            state["requests"] += 1
+            state["connections"].add(self.client_address)
+        self._send(200, body, "audio/wav")
+
+
+def start_rvc_standin(processing_seconds=0.2):
+    """Returns (server, base_url); server.state counts requests and distinct client connections."""
+    state = {"requests": 0, "connections": set(), "lock": threading.Lock(), "processing_seconds": processing_seconds}
+    return _start(_RVCHandler, state)
@@ -1,30 +1,310 @@
-import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer
-from peft import PeftModel
-
-# ---------------------------
-# Paths
-# ---------------------------
-BASE_MODEL = "TinyLlama/TinyLlama-1.1B-Chat-v1.0"
-LORA_PATH = "models/kalam_brain/kalam_finetune_model"
-OUTPUT_PATH = "models/kalam_brain/merged_model"
-
-# ---------------------------
-# Load base + adapter
-# ---------------------------
-print("🧠 Loading base TinyLlama model...")
-base_model = AutoModelForCausalLM.from_pretrained(BASE_MODEL, torch_dtype=torch.float16)
-tokenizer = AutoTokenizer.from_pretrained(BASE_MODEL)
-
-print("🔗 Loading Kalam LoRA adapter...")
-model = PeftModel.from_pretrained(base_model, LORA_PATH)
-
-# ---------------------------
-# Merge LoRA → Base
-# ---------------------------
-print("🧬 Merging LoRA weights into base model...")
-model = model.merge_and_unload()
-model.save_pretrained(OUTPUT_PATH)
-tokenizer.save_pretrained(OUTPUT_PATH)
-
-print(f"✅ Merged model saved at: {OUTPUT_PATH}")
+import os
+import re
+import json
+import time
+import shutil
+import argparse
+
+import torch
+from safetensors import safe_open
+from safetensors.torch import save_file, load_file
+
+# ---------------------------
+# Paths
+# ---------------------------
+BASE_MODEL = "TinyLlama/TinyLlama-1.1B-Chat-v1.0"
+LORA_PATH = "models/kalam_brain/kalam_finetune_model"
+OUTPUT_PATH = "models/kalam_brain/merged_model"
+
+DTYPES = {"fp16": torch.float16, "bf16": torch.bfloat16, "fp32": torch.float32}
+# (atol, rtol) for --verify against the in-memory PEFT merge, per output dtype
+TOLERANCES = {"fp32": (1e-5, 1e-4), "fp16": (1e-3, 1e-2), "bf16": (1e-2, 2e-2)}
+SIDE_FILES = (
+    "generation_config.json", "tokenizer.json", "tokenizer_config.json", "tokenizer.model",
+    "special_tokens_map.json", "added_tokens.json", "chat_template.jinja",
+)
+
+
+def parse_size(text):
+    """'2GB' / '500MB' / bytes -> bytes."""
+    match = re.fullmatch(r"\s*([\d.]+)\s*([KMG]?B?)\s*", str(text).upper())
+    if not match:
+        raise ValueError(f"Bad size: {text}")
+    number, unit = float(match.group(1)), match.group(2).rstrip("B")
+    return int(number * {"": 1, "K": 2**10, "M": 2**20, "G": 2**30}[unit])
+
+
+def peak_rss_mb():
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KB on Linux
+    except Exception:
+        return None
+
+
+# ---------------------------
+# Inputs
+# ---------------------------
+def resolve_base(base):
+    """Local directory for the base checkpoint (downloads only safetensors + configs from the Hub)."""
+    if os.path.isdir(base):
+        return base
+    from huggingface_hub import snapshot_download
+
+    return snapshot_download(base, allow_patterns=["*.safetensors", "*.json", "tokenizer.model", "*.jinja"])
+
+
+def base_shards(base_dir):
+    """{tensor name: shard file} of the base checkpoint."""
+    index = os.path.join(base_dir, "model.safetensors.index.json")
+    if os.path.exists(index):
+        with open(index) as f:
+            return json.load(f)["weight_map"]
+    single = os.path.join(base_dir, "model.safetensors")
+    if not os.path.exists(single):
+        raise FileNotFoundError(f"No safetensors checkpoint in {base_dir}")
+    with safe_open(single, framework="pt") as f:
+        return {name: "model.safetensors" for name in f.keys()}
+
+
+def _pattern_value(patterns, module, default):
+    for key, value in (patterns or {}).items():
+        if module == key or re.match(rf"(.*\.)?{key}$", module):
+            return value
+    return default
+
+
+def load_adapter(lora_dir):
+    """
+    Group the adapter's tensors by the base tensor they change:
+    {base name: {"A", "B", "scaling", "kind"} | {"replace": tensor} | {"bias", "scaling"}}.
+    The adapter itself is small, so it is read whole.
+    """
+    with open(os.path.join(lora_dir, "adapter_config.json")) as f:
+        config = json.load(f)
+    if config.get("peft_type", "LORA") != "LORA":
+        raise ValueError(f"Only LoRA adapters can be merged, got {config.get('peft_type')}")
+    if config.get("use_dora"):
+        raise ValueError("DoRA adapters are not supported by the streaming merge (use --method peft)")
+
+    path = os.path.join(lora_dir, "adapter_model.safetensors")
+    if os.path.exists(path):
+        tensors = load_file(path)
+    else:
+        tensors = torch.load(os.path.join(lora_dir, "adapter_model.bin"), map_location="cpu", weights_only=True)
+
+    edits = {}
+    for key, tensor in tensors.items():
+        name = key.removeprefix("base_model.model.")
+        for suffix, kind, slot in (
+            (".lora_A.weight", "linear", "A"), (".lora_B.weight", "linear", "B"),
+            (".lora_embedding_A", "embedding", "A"), (".lora_embedding_B", "embedding", "B"),
+        ):
+            if name.endswith(suffix):
+                module = name[:-len(suffix)]
+                edit = edits.setdefault(module + ".weight", {})
+                edit[slot], edit["kind"], edit["module"] = tensor, kind, module
+                break
+        else:
+            if name.endswith(".lora_B.bias"):
+                module = name[:-len(".lora_B.bias")]
+                edit = edits.setdefault(module + ".bias", {})
+                edit["bias"], edit["module"] = tensor, module
+            elif ".lora_" in name:
+                raise ValueError(f"Unsupported adapter tensor: {key}")
+            else:
+                # modules_to_save / saved embedding layers replace the base tensor outright
+                target = name.replace(".modules_to_save", "").replace(".base_layer", "")
+                edits.setdefault(target, {})["replace"] = tensor
+
+    for edit in edits.values():
+        if "A" in edit:
+            rank = edit["A"].shape[0]
+            alpha = _pattern_value(config.get("alpha_pattern"), edit["module"], config["lora_alpha"])
+            edit["scaling"] = alpha / (rank ** 0.5 if config.get("use_rslora") else rank)
+            edit["fan_in_fan_out"] = bool(config.get("fan_in_fan_out"))
+    for edit in edits.values():
+        if "bias" in edit:
+            # PEFT scales lora_B's whole output, bias included: lora_B(lora_A(x)) * scaling
+            edit["scaling"] = edits[edit["module"] + ".weight"]["scaling"]
+    return edits
+
+
+def apply_edit(weight, edit):
+    """Merged fp32 tensor for one base tensor."""
+    if "replace" in edit:
+        weight = edit["replace"]
+    weight = weight.to(torch.float32)
+    if "A" in edit:
+        delta = edit["B"].to(torch.float32) @ edit["A"].to(torch.float32)
+        if edit["kind"] == "embedding" or edit["fan_in_fan_out"]:
+            delta = delta.T
+        weight = weight + delta * edit["scaling"]
+    if "bias" in edit:
+        weight = weight + edit["bias"].to(torch.float32) * edit["scaling"]
+    return weight
+
+
+# ---------------------------
+# Streaming sharded merge
+# ---------------------------
+def stream_merge(base, lora_dir, output_dir, dtype="fp16", max_shard_size="2GB"):
+    """
+    Merge one base tensor at a time: read it from the (memory-mapped) base safetensors,
+    add that module's LoRA delta, cast, and append it to the current output shard.
+    Only one output shard plus one tensor is ever held in memory.
+    """
+    started = time.perf_counter()
+    out_dtype = DTYPES[dtype]
+    limit = parse_size(max_shard_size)
+    base_dir = resolve_base(base)
+    weight_map = base_shards(base_dir)
+    edits = load_adapter(lora_dir)
+
+    # Tensors touched by the adapter that the base lacks (e.g. an untied lm_head in modules_to_save)
+    extra = sorted(k for k, e in edits.items() if k not in weight_map and "replace" in e)
+    missing = sorted(k for k, e in edits.items() if k not in weight_map and "replace" not in e)
+    if missing:
+        raise KeyError(f"LoRA targets not found in the base checkpoint: {missing[:5]}")
+
+    os.makedirs(output_dir, exist_ok=True)
+    shards, index, buffer, buffer_bytes, total = [], {}, {}, 0, 0
+    merged = 0
+
+    def flush():
+        nonlocal buffer, buffer_bytes
+        if not buffer:
+            return
+        name = f"model-{len(shards) + 1:05d}.safetensors.part"
+        save_file(buffer, os.path.join(output_dir, name), metadata={"format": "pt"})
+        shards.append((name, list(buffer)))
+        buffer, buffer_bytes = {}, 0
+
+    def add(name, tensor):
+        nonlocal buffer_bytes, total
+        nbytes = tensor.numel() * tensor.element_size()
+        if buffer and buffer_bytes + nbytes > limit:
+            flush()
+        buffer[name] = tensor.contiguous()
+        buffer_bytes += nbytes
+        total += nbytes
+
+    by_file = {}
+    for name, filename in weight_map.items():
+        by_file.setdefault(filename, []).append(name)
+    for filename in sorted(by_file):
+        with safe_open(os.path.join(base_dir, filename), framework="pt") as f:
+            for name in by_file[filename]:
+                tensor = f.get_tensor(name)
+                if name in edits:
+                    tensor = apply_edit(tensor, edits[name])
+                    merged += 1
+                add(name, tensor.to(out_dtype) if tensor.is_floating_point() else tensor)
+                del tensor
+    for name in extra:
+        add(name, apply_edit(edits[name]["replace"], edits[name]).to(out_dtype))
+    flush()
+
+    # Final names: a single model.safetensors, or numbered shards plus an index
+    if len(shards) == 1:
+        os.replace(os.path.join(output_dir, shards[0][0]), os.path.join(output_dir, "model.safetensors"))
+        stale = os.path.join(output_dir, "model.safetensors.index.json")
+        if os.path.exists(stale):
+            os.remove(stale)
+    else:
+        for i, (part, names) in enumerate(shards, start=1):
+            final = f"model-{i:05d}-of-{len(shards):05d}.safetensors"
+            os.replace(os.path.join(output_dir, part), os.path.join(output_dir, final))
+            index.update({n: final for n in names})
+        with open(os.path.join(output_dir, "model.safetensors.index.json"), "w") as f:
+            json.dump({"metadata": {"total_size": total}, "weight_map": dict(sorted(index.items()))}, f, indent=2)
+
+    with open(os.path.join(base_dir, "config.json")) as f:
+        config = json.load(f)
+    config["dtype" if "dtype" in config or "torch_dtype" not in config else "torch_dtype"] = str(out_dtype).split(".")[-1]
+    with open(os.path.join(output_dir, "config.json"), "w") as f:
+        json.dump(config, f, indent=2)
+    for name in SIDE_FILES:
+        if os.path.exists(os.path.join(base_dir, name)):
+            shutil.copy2(os.path.join(base_dir, name), os.path.join(output_dir, name))
+
+    stats = {
+        "tensors": len(weight_map) + len(extra),
+        "merged": merged,
+        "shards": len(shards),
+        "total_mb": round(total / 2**20, 1),
+        "largest_shard_limit_mb": round(limit / 2**20, 1),
+        "seconds": round(time.perf_counter() - started, 2),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    print(f"✅ Streamed merge: {merged} LoRA-merged tensors, {len(shards)} shard(s), {stats['total_mb']} MB "
+          f"in {stats['seconds']}s (peak RSS {stats['peak_rss_mb'] or 0:.0f} MB) → {output_dir}")
+    return stats
+
+
+# ---------------------------
+# Reference merge (in memory, via PEFT)
+# ---------------------------
+def peft_merge(base, lora_dir, dtype=torch.float16):
+    """The original merge: load base + PeftModel, merge_and_unload. Needs several model sizes of RAM."""
+    from transformers import AutoModelForCausalLM
+    from peft import PeftModel
+
+    base_model = AutoModelForCausalLM.from_pretrained(base, dtype=dtype)
+    model = PeftModel.from_pretrained(base_model, lora_dir)
+    return model.merge_and_unload()
+
+
+def verify(base, lora_dir, output_dir, dtype="fp16", atol=None, rtol=None):
+    """Compare every streamed tensor against the PEFT merge (computed in fp32, cast to the output dtype)."""
+    default_atol, default_rtol = TOLERANCES[dtype]
+    atol = default_atol if atol is None else atol
+    rtol = default_rtol if rtol is None else rtol
+    reference = peft_merge(resolve_base(base), lora_dir, torch.float32).state_dict()
+
+    worst, failed, checked = 0.0, [], 0
+    for name, filename in base_shards(output_dir).items():
+        with safe_open(os.path.join(output_dir, filename), framework="pt") as f:
+            ours = f.get_tensor(name).to(torch.float32)
+        if name not in reference:
+            continue
+        expected = reference[name].to(DTYPES[dtype]).to(torch.float32)
+        diff = (ours - expected).abs().max().item() if ours.numel() else 0.0
+        worst = max(worst, diff)
+        checked += 1
+        if not torch.allclose(ours, expected, atol=atol, rtol=rtol):
+            failed.append((name, diff))
+    if failed:
+        print(f"❌ {len(failed)}/{checked} tensors differ from the PEFT merge (atol={atol}, rtol={rtol}): {failed[:5]}")
+    else:
+        print(f"✅ Verified {checked} tensors against the PEFT merge (max abs diff {worst:.2e}, atol={atol}, rtol={rtol})")
+    return not failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge the Kalam LoRA adapter into the base model.")
+    parser.add_argument("--base", default=BASE_MODEL, help="base model directory or Hub id")
+    parser.add_argument("--lora", default=LORA_PATH)
+    parser.add_argument("--out", default=OUTPUT_PATH)
+    parser.add_argument("--dtype", choices=sorted(DTYPES), default="fp16")
+    parser.add_argument("--max-shard-size", default="2GB")
+    parser.add_argument("--method", choices=["stream", "peft"], default="stream",
+                        help="stream: layer-by-layer, low peak memory; peft: load everything and merge_and_unload")
+    parser.add_argument("--verify", action="store_true", help="check the streamed output against the PEFT merge")
+    parser.add_argument("--atol", type=float, default=None)
+    parser.add_argument("--rtol", type=float, default=None)
+    args = parser.parse_args()
+
+    if args.method == "peft":
+        from transformers import AutoTokenizer
+
+        print("🧬 Merging LoRA weights into base model (in memory)...")
+        model = peft_merge(args.base, args.lora, DTYPES[args.dtype])
+        model.save_pretrained(args.out, max_shard_size=args.max_shard_size)
+        AutoTokenizer.from_pretrained(args.base).save_pretrained(args.out)
+        print(f"✅ Merged model saved at: {args.out} (peak RSS {peak_rss_mb() or 0:.0f} MB)")
+    else:
+        print(f"🧬 Streaming LoRA merge: {args.base} + {args.lora} → {args.out} ({args.dtype})")
+        stream_merge(args.base, args.lora, args.out, args.dtype, args.max_shard_size)
+        if args.verify and not verify(args.base, args.lora, args.out, args.dtype, args.atol, args.rtol):
+            raise SystemExit(1)
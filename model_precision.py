@@ -0,0 +1,68 @@
+# services/model_precision.py
+import os
+import time
+
+import torch
+from transformers import AutoModelForCausalLM
+
+# ----------------------------
+# Precision modes
+# ----------------------------
+# fp32: original merged weights
+# bf16: bfloat16 weights (half the memory, native on AVX512-BF16/AMX CPUs)
+# int8: dynamic int8 quantization of every nn.Linear (weights int8, activations quantized on the fly)
+PRECISIONS = ("fp32", "bf16", "int8")
+INT8_ARTIFACT = "model_int8.pt"
+
+
+def artifact_dir(model_dir, precision):
+    """Where the offline quantize step stores the converted model for a precision."""
+    return model_dir if precision == "fp32" else f"{model_dir.rstrip('/')}_{precision}"
+
+
+def quantize_int8(model):
+    """Dynamic int8 quantization of all Linear layers (CPU inference only)."""
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def load_model(model_dir, precision="fp32"):
+    """Load the causal LM in the requested precision, preferring a pre-converted artifact."""
+    precision = (precision or "fp32").lower()
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision '{precision}', expected one of {PRECISIONS}")
+
+    started = time.perf_counter()
+    converted_dir = artifact_dir(model_dir, precision)
+
+    if precision == "int8":
+        artifact = os.path.join(converted_dir, INT8_ARTIFACT)
+        if os.path.exists(artifact):
+            model = torch.load(artifact, weights_only=False)
+        else:
+            print(f"⚠️ No int8 artifact at {artifact}; quantizing at startup (run quantize_model.py to avoid this).")
+            model = quantize_int8(_load_pretrained(model_dir, torch.float32))
+    elif precision == "bf16":
+        # A half-written conversion (no config.json yet) falls back to the fp32 weights
+        source = converted_dir if os.path.exists(os.path.join(converted_dir, "config.json")) else model_dir
+        model = _load_pretrained(source, torch.bfloat16)
+    else:
+        model = _load_pretrained(model_dir, torch.float32)
+
+    model.eval()
+    print(f"⚙️ Model loaded in {precision} ({time.perf_counter() - started:.1f}s).")
+    return model
+
+
+def _has_safetensors(model_dir):
+    return os.path.isdir(model_dir) and any(name.endswith(".safetensors") for name in os.listdir(model_dir))
+
+
+def _load_pretrained(model_dir, dtype):
+    # safetensors checkpoints are memory-mapped rather than unpickled, which keeps load time and peak RSS down
+    return AutoModelForCausalLM.from_pretrained(
+        model_dir,
+        dtype=dtype,
+        device_map=None,
+        low_cpu_mem_usage=True,
+        use_safetensors=True if _has_safetensors(model_dir) else None
+    )
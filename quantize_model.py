@@ -0,0 +1,172 @@
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import tempfile
+
+import torch
+from transformers import AutoTokenizer
+
+from services.model_precision import PRECISIONS, INT8_ARTIFACT, artifact_dir, load_model, quantize_int8, _load_pretrained
+
+# ---------------------------
+# Paths
+# ---------------------------
+MODEL_DIR = "models/kalam_brain/merged_model"
+REPORT_PATH = "results/precision_report.json"
+
+# Fixed prompt set for the comparison report
+PROMPTS = [
+    "How can I dream big?",
+    "What advice would you give to young scientists?",
+    "Why is failure important for success?",
+    "What is the role of a teacher in a student's life?",
+    "Tell me about your journey from Rameswaram.",
+]
+REPORT_NEW_TOKENS = 64
+
+
+# ---------------------------
+# Offline conversion
+# ---------------------------
+def convert(model_dir, precision):
+    """Write the converted artifact next to the merged model so the server loads it directly."""
+    out_dir = artifact_dir(model_dir, precision)
+    tokenizer = AutoTokenizer.from_pretrained(model_dir)
+
+    # Always convert from the merged fp32 weights, never from (a partial) out_dir
+    if precision == "bf16":
+        print("🧮 Converting merged model to bfloat16...")
+        model = _load_pretrained(model_dir, torch.bfloat16)
+        os.makedirs(out_dir, exist_ok=True)
+        model.save_pretrained(out_dir)
+    elif precision == "int8":
+        print("🧮 Applying dynamic int8 quantization to Linear layers...")
+        model = quantize_int8(load_model(model_dir, "fp32"))
+        os.makedirs(out_dir, exist_ok=True)
+        torch.save(model, os.path.join(out_dir, INT8_ARTIFACT))
+        model.config.save_pretrained(out_dir)
+    else:
+        raise ValueError("fp32 is the merged model itself; nothing to convert.")
+
+    tokenizer.save_pretrained(out_dir)
+    print(f"✅ {precision} model saved at: {out_dir}")
+
+
+# ---------------------------
+# Comparison report
+# ---------------------------
+def _rss_mb():
+    import psutil
+    return psutil.Process().memory_info().rss / (1024 * 1024)
+
+
+def measure(model_dir, precision, out_path):
+    """Runs in a fresh process so RSS reflects this precision only."""
+    torch.manual_seed(0)
+    rss_before = _rss_mb()
+    started = time.perf_counter()
+    model = load_model(model_dir, precision)
+    load_seconds = time.perf_counter() - started
+    tokenizer = AutoTokenizer.from_pretrained(model_dir)
+
+    outputs, logprobs = [], []
+    generated, gen_seconds = 0, 0.0
+    with torch.inference_mode():
+        for prompt in PROMPTS:
+            inputs = tokenizer(prompt, return_tensors="pt")
+            logits = model(**inputs).logits[0, -1].float()
+            logprobs.append(torch.log_softmax(logits, dim=-1))
+
+            t0 = time.perf_counter()
+            out = model.generate(**inputs, max_new_tokens=REPORT_NEW_TOKENS, do_sample=False,
+                                 pad_token_id=tokenizer.eos_token_id)
+            gen_seconds += time.perf_counter() - t0
+            new_tokens = out[0, inputs["input_ids"].shape[1]:].tolist()
+            generated += len(new_tokens)
+            outputs.append(new_tokens)
+
+    torch.save({
+        "precision": precision,
+        "load_seconds": load_seconds,
+        "rss_mb": _rss_mb(),
+        "model_rss_mb": _rss_mb() - rss_before,
+        "tokens_per_sec": generated / gen_seconds if gen_seconds else 0.0,
+        "outputs": outputs,
+        "logprobs": torch.stack(logprobs),
+    }, out_path)
+
+
+def _divergence(reference, result):
+    """Mean next-token KL(ref || mode) and fraction of greedy tokens identical to fp32."""
+    ref_lp, lp = reference["logprobs"], result["logprobs"]
+    kl = torch.sum(ref_lp.exp() * (ref_lp - lp), dim=-1).mean().item()
+    matched, total = 0, 0
+    for a, b in zip(reference["outputs"], result["outputs"]):
+        total += max(len(a), 1)
+        for x, y in zip(a, b):
+            if x != y:
+                break
+            matched += 1
+    return kl, matched / total if total else 1.0
+
+
+def report(model_dir, precisions):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for precision in precisions:
+            out_path = os.path.join(tmp, f"{precision}.pt")
+            print(f"📏 Measuring {precision}...")
+            subprocess.run(
+                [sys.executable, __file__, "--model-dir", model_dir, "--measure", precision, "--out", out_path],
+                check=True,
+            )
+            results[precision] = torch.load(out_path, weights_only=False)
+
+    reference = results.get("fp32")
+    rows = []
+    for precision, result in results.items():
+        row = {
+            "precision": precision,
+            "load_seconds": round(result["load_seconds"], 2),
+            "rss_mb": round(result["rss_mb"], 1),
+            "model_rss_mb": round(result["model_rss_mb"], 1),
+            "tokens_per_sec": round(result["tokens_per_sec"], 2),
+        }
+        if reference is not None:
+            kl, agreement = _divergence(reference, result)
+            row["kl_vs_fp32"] = round(kl, 5)
+            row["greedy_prefix_agreement"] = round(agreement, 3)
+        rows.append(row)
+
+    print(f"\n{'precision':<10}{'tok/s':>9}{'RSS MB':>10}{'load s':>9}{'KL':>10}{'agree':>8}")
+    for row in rows:
+        print(f"{row['precision']:<10}{row['tokens_per_sec']:>9}{row['rss_mb']:>10}{row['load_seconds']:>9}"
+              f"{row.get('kl_vs_fp32', '-'):>10}{row.get('greedy_prefix_agreement', '-'):>8}")
+
+    os.makedirs(os.path.dirname(REPORT_PATH), exist_ok=True)
+    with open(REPORT_PATH, "w") as f:
+        json.dump({"model_dir": model_dir, "prompts": PROMPTS, "results": rows}, f, indent=2)
+    print(f"📝 Report saved at: {REPORT_PATH}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert the merged Kalam model to bf16/int8 and compare precisions.")
+    parser.add_argument("--model-dir", default=MODEL_DIR)
+    parser.add_argument("--precision", choices=["bf16", "int8"], help="write the converted artifact for this precision")
+    parser.add_argument("--report", action="store_true", help="compare tokens/sec, RSS and divergence across precisions")
+    parser.add_argument("--precisions", default=",".join(PRECISIONS), help="precisions included in --report")
+    parser.add_argument("--measure", choices=PRECISIONS, help=argparse.SUPPRESS)
+    parser.add_argument("--out", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(args.model_dir, args.measure, args.out)
+    elif args.precision:
+        convert(args.model_dir, args.precision)
+    elif args.report:
+        report(args.model_dir, [p.strip() for p in args.precisions.split(",") if p.strip()])
+    else:
+        parser.print_help()
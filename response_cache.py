@@ -0,0 +1,293 @@
+# services/response_cache.py
+import os
+import time
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from services.audio_cache import normalize_text
+from services.metrics import observe
+
+# ----------------------------
+# Config
+# ----------------------------
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "0") == "1"
+# Cosine similarity of prompt embeddings above which a cached answer is reused
+RESPONSE_CACHE_THRESHOLD = float(os.getenv("RESPONSE_CACHE_THRESHOLD", "0.92"))
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "86400"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "5000"))
+# Decoder layer whose mean-pooled hidden states embed a prompt; empty = the middle layer
+RESPONSE_CACHE_LAYER = os.getenv("RESPONSE_CACHE_LAYER", "")
+RESPONSE_CACHE_MAX_TOKENS = 256
+
+
+def exact_key(text):
+    """Normalized prompt text: Unicode/whitespace folded, case-insensitive, trailing punctuation dropped."""
+    return normalize_text(text).casefold().rstrip(" ?!.")
+
+
+def hidden_state_embedder(model, tokenizer, layer=RESPONSE_CACHE_LAYER, max_tokens=RESPONSE_CACHE_MAX_TOKENS):
+    """
+    Prompt → unit vector from the chat model's own hidden states (mean over tokens of one layer).
+    Runs only the decoder stack (no LM head), i.e. about one prefill of the prompt.
+    """
+    import torch
+
+    decoder = model.get_decoder()
+
+    def embed(text):
+        inputs = tokenizer(text, return_tensors="pt", truncation=True, max_length=max_tokens)
+        with torch.inference_mode():
+            out = decoder(input_ids=inputs["input_ids"], attention_mask=inputs["attention_mask"], output_hidden_states=True)
+        states = out.hidden_states
+        index = int(layer) if str(layer).strip() else len(states) // 2
+        mask = inputs["attention_mask"][0].unsqueeze(-1).to(states[index].dtype)
+        vector = (states[index][0] * mask).sum(0) / mask.sum().clamp(min=1)
+        vector = vector.float().numpy()
+        return vector / (np.linalg.norm(vector) or 1.0)
+    return embed
+
+
+class _Entry:
+    __slots__ = ("key", "scope", "response", "seconds", "created", "row")
+
+    def __init__(self, key, scope, response, seconds, row):
+        self.key = key
+        self.scope = scope
+        self.response = response
+        self.seconds = seconds
+        self.created = time.time()
+        self.row = row
+
+
+class ResponseCache:
+    """
+    Generated answers keyed by prompt, in two tiers:
+      exact    - normalized prompt text, a dict lookup
+      semantic - cosine similarity of prompt embeddings in an in-memory vector index
+    Entries expire after `ttl` seconds and the least recently used go first above `max_entries`.
+    `scope` keeps personas (LoRA adapters) apart. A reused answer has the same text as before,
+    so its base/cloned audio comes straight from the audio cache as well.
+    """
+
+    def __init__(self, embed, threshold=RESPONSE_CACHE_THRESHOLD, ttl=RESPONSE_CACHE_TTL_SECONDS,
+                 max_entries=RESPONSE_CACHE_MAX_ENTRIES):
+        self.embed = embed
+        self.threshold = float(threshold)
+        self.ttl = float(ttl)
+        self.max_entries = max(1, int(max_entries))
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # (scope, exact key) -> _Entry, least recently used first
+        self._vectors = None            # (capacity, dim) float32, unit rows; freed rows are zeroed
+        self._rows = []                 # row -> (scope, exact key) or None
+        self._free = []
+        self._stats = {"hits_exact": 0, "hits_semantic": 0, "misses": 0, "saved_seconds": 0.0,
+                       "embed_seconds": 0.0, "expired": 0, "evicted": 0}
+
+    # ----------------------------
+    # Index maintenance (call with lock held)
+    # ----------------------------
+    def _drop(self, ident, reason=None):
+        entry = self._entries.pop(ident)
+        if entry.row is not None:
+            self._vectors[entry.row] = 0.0
+            self._rows[entry.row] = None
+            self._free.append(entry.row)
+        if reason:
+            self._stats[reason] += 1
+
+    def _alive(self, entry, now):
+        return now - entry.created <= self.ttl
+
+    def _add_row(self, vector, ident):
+        if self._vectors is None:
+            self._vectors = np.zeros((64, vector.shape[0]), dtype='float32')
+        if self._free:
+            row = self._free.pop()
+        else:
+            row = len(self._rows)
+            if row == self._vectors.shape[0]:
+                grown = np.zeros((row * 2, self._vectors.shape[1]), dtype='float32')
+                grown[:row] = self._vectors
+                self._vectors = grown
+            self._rows.append(None)
+        self._vectors[row] = vector
+        self._rows[row] = ident
+        return row
+
+    def _hit(self, ident, tier):
+        entry = self._entries[ident]
+        self._entries.move_to_end(ident)
+        self._stats[f"hits_{tier}"] += 1
+        self._stats["saved_seconds"] += entry.seconds
+        return entry.response
+
+    # ----------------------------
+    # Public API
+    # ----------------------------
+    def lookup(self, prompt, scope=None):
+        """
+        (cached response or None, info). info has tier ('exact' | 'semantic' | 'miss'), the best
+        similarity and the prompt's vector, which put() reuses so a miss is embedded only once.
+        """
+        ident = (scope, exact_key(prompt))
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(ident)
+            if entry is not None:
+                if self._alive(entry, now):
+                    return self._hit(ident, "exact"), {"tier": "exact", "similarity": 1.0, "vector": None}
+                self._drop(ident, "expired")
+
+        started = time.perf_counter()
+        vector = np.asarray(self.embed(prompt), dtype='float32')
+        seconds = time.perf_counter() - started
+        observe("response_cache_embed", seconds)
+
+        info = {"tier": "miss", "similarity": None, "vector": vector}
+        with self._lock:
+            self._stats["embed_seconds"] += seconds
+            if self._vectors is not None and self._rows:
+                similarities = self._vectors[:len(self._rows)] @ vector
+                for row in np.argsort(-similarities)[:16]:
+                    similarity = float(similarities[row])
+                    if similarity < self.threshold:
+                        break
+                    candidate = self._rows[row]
+                    if candidate is None or candidate[0] != scope:
+                        continue
+                    if not self._alive(self._entries[candidate], now):
+                        self._drop(candidate, "expired")
+                        continue
+                    info.update(tier="semantic", similarity=round(similarity, 4))
+                    return self._hit(candidate, "semantic"), info
+                if len(similarities):
+                    info["similarity"] = round(float(similarities.max()), 4)
+            self._stats["misses"] += 1
+        return None, info
+
+    def put(self, prompt, response, seconds=0.0, scope=None, vector=None):
+        """Store a generated answer with the seconds it took to generate (reported as saved on hits)."""
+        if vector is None:
+            vector = np.asarray(self.embed(prompt), dtype='float32')
+        ident = (scope, exact_key(prompt))
+        with self._lock:
+            if ident in self._entries:
+                self._drop(ident)
+            row = self._add_row(vector, ident)
+            self._entries[ident] = _Entry(ident[1], scope, response, float(seconds), row)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)), "evicted")
+
+    def purge_expired(self):
+        now = time.time()
+        with self._lock:
+            for ident in [i for i, e in self._entries.items() if not self._alive(e, now)]:
+                self._drop(ident, "expired")
+
+    def clear(self):
+        with self._lock:
+            for ident in list(self._entries):
+                self._drop(ident, "evicted")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        hits = stats["hits_exact"] + stats["hits_semantic"]
+        lookups = hits + stats["misses"]
+        stats["hit_rate"] = round(hits / lookups, 4) if lookups else 0.0
+        stats["saved_seconds"] = round(stats["saved_seconds"], 3)
+        stats["embed_seconds"] = round(stats["embed_seconds"], 3)
+        stats.update(threshold=self.threshold, ttl_seconds=self.ttl, max_entries=self.max_entries)
+        return stats
+
+
+def load_response_cache(model, tokenizer):
+    """The configured cache for a loaded model, or None when RESPONSE_CACHE_ENABLED is off."""
+    if not RESPONSE_CACHE_ENABLED:
+        return None
+    print(f"🗂️ Response cache on (threshold={RESPONSE_CACHE_THRESHOLD}, ttl={RESPONSE_CACHE_TTL_SECONDS:.0f}s, "
+          f"max={RESPONSE_CACHE_MAX_ENTRIES})")
+    return ResponseCache(hidden_state_embedder(model, tokenizer))
+
+
+# ----------------------------
+# Replay: hit rate + latency saved
+# ----------------------------
+if __name__ == "__main__":
+    import json
+    import argparse
+    from transformers import AutoTokenizer
+    from services.model_precision import load_model
+
+    parser = argparse.ArgumentParser(description="Replay prompts through the response cache and report hit rate and latency saved.")
+    parser.add_argument("--model-dir", default="models/kalam_brain/merged_model")
+    parser.add_argument("--workload", default=None, help="JSONL with a text/body/title field per line (default: built-in paraphrase set)")
+    parser.add_argument("--thresholds", default=str(RESPONSE_CACHE_THRESHOLD), help="comma-separated similarity thresholds to compare")
+    parser.add_argument("--max-new-tokens", type=int, default=250)
+    parser.add_argument("--out", default="results/response_cache_report.json")
+    args = parser.parse_args()
+
+    # Student questions with near-duplicate rephrasings, in arrival order
+    prompts = [
+        "How do I dream big?", "how to dream big?", "How can I dream big", "What should I do to dream big?",
+        "What is the role of a teacher?", "what is the role of a teacher", "What role does a teacher play?",
+        "How should students deal with failure?", "How do students deal with failure?", "How to handle failure as a student?",
+        "Tell me about India's space programme.", "Tell me about the Indian space programme.",
+        "Why is science important for the youth?", "why is science important for youth?",
+        "How can I become a scientist?", "How do I become a scientist?", "What does it take to become a scientist?",
+        "What is your message to the youth of India?", "Your message to India's youth?",
+        "How do I dream big?",
+    ]
+    if args.workload:
+        with open(args.workload, encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+        prompts = [(r.get("text") or r.get("body") or r.get("title"))[:400] for r in rows]
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model_dir)
+    model = load_model(args.model_dir)
+    embed = hidden_state_embedder(model, tokenizer)
+    kwargs = dict(max_new_tokens=args.max_new_tokens, do_sample=False, pad_token_id=tokenizer.pad_token_id or tokenizer.eos_token_id)
+
+    # Generate each distinct prompt once, so every threshold is scored against the same latencies
+    import torch
+    generated = {}
+    for prompt in dict.fromkeys(prompts):
+        inputs = tokenizer(prompt, return_tensors="pt")
+        t0 = time.perf_counter()
+        with torch.inference_mode():
+            output = model.generate(**inputs, **kwargs)
+        generated[prompt] = (tokenizer.decode(output[0, inputs["input_ids"].shape[1]:], skip_special_tokens=True),
+                             time.perf_counter() - t0)
+    uncached = sum(generated[p][1] for p in prompts)
+
+    results = []
+    for threshold in [float(t) for t in args.thresholds.split(",")]:
+        cache = ResponseCache(embed, threshold=threshold)
+        trace, served = [], 0.0
+        for prompt in prompts:
+            t0 = time.perf_counter()
+            response, info = cache.lookup(prompt)
+            lookup_seconds = time.perf_counter() - t0
+            if response is None:
+                response, seconds = generated[prompt]
+                cache.put(prompt, response, seconds, vector=info["vector"])
+                served += lookup_seconds + seconds
+            else:
+                served += lookup_seconds
+            trace.append({"prompt": prompt, "tier": info["tier"], "similarity": info["similarity"]})
+        stats = cache.stats()
+        row = {"threshold": threshold, **stats, "uncached_seconds": round(uncached, 3),
+               "cached_seconds": round(served, 3), "latency_saved_pct": round(100 * (1 - served / uncached), 1) if uncached else 0.0,
+               "trace": trace}
+        results.append(row)
+        print(f"threshold={threshold:<5} hit_rate={stats['hit_rate']:.0%} (exact {stats['hits_exact']}, semantic {stats['hits_semantic']})  "
+              f"saved={stats['saved_seconds']:.2f}s  embed={stats['embed_seconds']:.2f}s  "
+              f"total {uncached:.2f}s → {served:.2f}s ({row['latency_saved_pct']}% less)")
+
+    os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+    with open(args.out, "w") as f:
+        json.dump({"model_dir": args.model_dir, "prompts": len(prompts), "results": results}, f, indent=2)
+    print(f"📝 Results saved at: {args.out}")
@@ -1,28 +1,198 @@
-import requests
-import os
-
-def clone_voice(input_audio_path, output_audio_path="kalam_cloned.wav"):
-    """
-    Send TTS audio to RVC API to clone it into Kalam's voice.
-    """
-
-    RVC_API_URL = os.getenv("RVC_API_URL")
-
-    if not RVC_API_URL:
-        raise ValueError("❌ RVC_API_URL not found in .env file. Please add it.")
-
-    try:
-        files = {'file': open(input_audio_path, 'rb')}
-        response = requests.post(f"{RVC_API_URL}/clone", files=files)
-
-        if response.status_code == 200:
-            with open(output_audio_path, "wb") as f:
-                f.write(response.content)
-            print(f"🎤 Cloned voice saved to: {output_audio_path}")
-            return output_audio_path
-        else:
-            print(f"⚠️ RVC API Error: {response.status_code} {response.text}")
-            return None
-    except Exception as e:
-        print(f"❌ Voice cloning failed: {e}")
-        return None
+import requests
+import os
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
+RVC_MAX_IN_FLIGHT = int(os.getenv("RVC_MAX_IN_FLIGHT", "4"))
+CHUNK_SIZE = 64 * 1024
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def _get_rvc_url():
+    RVC_API_URL = os.getenv("RVC_API_URL")
+
+    if not RVC_API_URL:
+        raise ValueError("❌ RVC_API_URL not found in .env file. Please add it.")
+    return RVC_API_URL
+
+
+def get_session():
+    """Keep-alive session sized for the batch's in-flight limit."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(RVC_MAX_IN_FLIGHT, 1))
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+        return _session
+
+
+class _MultipartFile:
+    """
+    File-like multipart/form-data body for one file field.
+    requests sends it in blocks via read(), with a known Content-Length, so the upload
+    is never buffered whole in memory.
+    """
+
+    def __init__(self, path, field="file"):
+        self.boundary = uuid.uuid4().hex
+        name = os.path.basename(path)
+        self._head = (
+            f"--{self.boundary}\r\n"
+            f'Content-Disposition: form-data; name="{field}"; filename="{name}"\r\n'
+            f"Content-Type: application/octet-stream\r\n\r\n"
+        ).encode()
+        self._tail = f"\r\n--{self.boundary}--\r\n".encode()
+        self._size = os.path.getsize(path)
+        self._file = open(path, "rb")
+        self._parts = [self._head, None, self._tail]
+
+    @property
+    def content_type(self):
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def __len__(self):
+        return len(self._head) + self._size + len(self._tail)
+
+    def read(self, n=-1):
+        out = b""
+        while self._parts and (n < 0 or len(out) < n):
+            part = self._parts[0]
+            want = -1 if n < 0 else n - len(out)
+            if part is None:
+                chunk = self._file.read(want)
+                if not chunk:
+                    self._parts.pop(0)
+                out += chunk
+            else:
+                take = part if want < 0 else part[:want]
+                out += take
+                rest = part[len(take):]
+                if rest:
+                    self._parts[0] = rest
+                else:
+                    self._parts.pop(0)
+        return out
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def clone_voice(input_audio_path, output_audio_path="kalam_cloned.wav"):
+    """
+    Send TTS audio to RVC API to clone it into Kalam's voice.
+    """
+
+    RVC_API_URL = _get_rvc_url()
+
+    try:
+        with _MultipartFile(input_audio_path) as body:
+            response = get_session().post(
+                f"{RVC_API_URL}/clone",
+                data=body,
+                headers={"Content-Type": body.content_type},
+                stream=True,
+            )
+
+        with response:
+            if response.status_code == 200:
+                # Stream the cloned audio to disk instead of holding it all in memory
+                tmp_path = output_audio_path + ".part"
+                with open(tmp_path, "wb") as f:
+                    for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                        if chunk:
+                            f.write(chunk)
+                os.replace(tmp_path, output_audio_path)
+                print(f"🎤 Cloned voice saved to: {output_audio_path}")
+                return output_audio_path
+            else:
+                print(f"⚠️ RVC API Error: {response.status_code} {response.text}")
+                return None
+    except Exception as e:
+        print(f"❌ Voice cloning failed: {e}")
+        return None
+
+
+def clone_voice_batch(input_paths, output_dir="results/rvc_batch", max_in_flight=RVC_MAX_IN_FLIGHT):
+    """
+    Re-voice many files with at most max_in_flight requests outstanding over keep-alive connections.
+    Returns {"results": [(input, output or None)], "seconds", "files_per_sec", "mb_per_sec", "failed"}.
+    """
+    input_paths = list(input_paths)
+    _get_rvc_url()  # fail fast before spinning up workers
+    os.makedirs(output_dir, exist_ok=True)
+
+    def one(index, path):
+        # Prefixed with the batch index: inputs from different directories may share a basename
+        out = os.path.join(output_dir, f"{index:04d}_{os.path.basename(path)}")
+        return path, clone_voice(path, out)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, int(max_in_flight)), thread_name_prefix="rvc-batch") as pool:
+        results = list(pool.map(one, range(len(input_paths)), input_paths))
+    seconds = time.perf_counter() - started
+
+    ok = [path for path, out in results if out]
+    total_mb = sum(os.path.getsize(path) for path in ok) / 1e6
+    summary = {
+        "results": results,
+        "seconds": round(seconds, 3),
+        "files_per_sec": round(len(ok) / seconds, 2) if seconds else 0.0,
+        "mb_per_sec": round(total_mb / seconds, 2) if seconds else 0.0,
+        "failed": len(results) - len(ok),
+    }
+    print(f"📦 RVC batch: {len(ok)}/{len(results)} files in {seconds:.1f}s "
+          f"({summary['files_per_sec']} files/s, {summary['mb_per_sec']} MB/s)")
+    return summary
+
+
+if __name__ == "__main__":
+    import argparse
+    import tempfile
+
+    parser = argparse.ArgumentParser(description="Batch re-voice audio files through the self-hosted RVC API.")
+    parser.add_argument("inputs", nargs="*", help="audio files or directories of .wav files")
+    parser.add_argument("--out-dir", default="results/rvc_batch")
+    parser.add_argument("--max-in-flight", type=int, default=RVC_MAX_IN_FLIGHT)
+    parser.add_argument("--standin", action="store_true", help="run against a local stand-in /clone server")
+    parser.add_argument("--files", type=int, default=16, help="number of synthetic files for --standin")
+    args = parser.parse_args()
+
+    if args.standin:
+        from services.local_standins import start_rvc_standin
+
+        server, base_url = start_rvc_standin()
+        os.environ["RVC_API_URL"] = base_url
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = []
+            for i in range(args.files):
+                path = os.path.join(tmp, f"clip_{i:03d}.wav")
+                with open(path, "wb") as f:
+                    f.write(os.urandom(512 * 1024))
+                paths.append(path)
+            for level in sorted({1, args.max_in_flight}):
+                _session = None
+                RVC_MAX_IN_FLIGHT = level
+                clone_voice_batch(paths, os.path.join(tmp, f"out_{level}"), max_in_flight=level)
+        print(f"🔌 Stand-in saw {server.state['requests']} requests over {len(server.state['connections'])} connections")
+        server.shutdown()
+    else:
+        paths = []
+        for item in args.inputs:
+            if os.path.isdir(item):
+                paths.extend(sorted(os.path.join(item, n) for n in os.listdir(item) if n.lower().endswith(".wav")))
+            else:
+                paths.append(item)
+        clone_voice_batch(paths, args.out_dir, args.max_in_flight)
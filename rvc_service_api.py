@@ -1,110 +1,247 @@
-# services/rvc_service_api.py
-import os
-import time
-import requests
-
-# ----------------------------
-# Load environment variables
-# ----------------------------
-RVC_API_URL = "https://api.replicate.com/v1/predictions"
-RVC_MODEL = os.getenv("RVC_MODEL")  # e.g. "pseudoram/rvc-v2"
-RVC_MODEL_VERSION = os.getenv("RVC_MODEL_VERSION")
-REPLICATE_API_TOKEN = os.getenv("REPLICATE_API_TOKEN")
-REFERENCE_AUDIO = os.getenv("REFERENCE_AUDIO")
-
-
-# ----------------------------
-# Upload Helper
-# ----------------------------
-def upload_to_fileio(file_path):
-    """Upload local file to transfer.sh for temporary hosting."""
-    try:
-        print(f"📁 Uploading with transfer.sh: {file_path}")
-        if not file_path or not os.path.exists(file_path):
-            print("❌ File not found or invalid path.")
-            return None
-
-        with open(file_path, "rb") as f:
-            response = requests.put(f"https://transfer.sh/{os.path.basename(file_path)}", data=f)
-
-        if response.status_code == 200:
-            url = response.text.strip()
-            print(f"☁️ Uploaded {file_path} → {url}")
-            return url
-        else:
-            print(f"⚠️ transfer.sh upload failed: {response.status_code} → {response.text}")
-            return None
-    except Exception as e:
-        print(f"❌ transfer.sh upload failed: {e}")
-        return None
-
-
-# ----------------------------
-# Voice Cloning Function
-# ----------------------------
-def clone_voice(input_audio, output_audio="results/kalam_cloned.wav", reference_audio=None):
-    """
-    Clone voice using Replicate RVC API.
-    Automatically uses the uploaded or .env reference audio.
-    """
-    try:
-        os.makedirs("results", exist_ok=True)
-
-        # Pick the right reference
-        ref_audio = reference_audio or REFERENCE_AUDIO
-        print("🎤 Sending audio to Replicate RVC API...")
-        print(f"🧩 Using reference voice: {ref_audio}")
-
-        ref_url = upload_to_fileio(ref_audio)
-        tts_url = upload_to_fileio(input_audio)
-
-        if not ref_url or not tts_url:
-            print("❌ Could not upload audio files. Please check paths.")
-            return None
-
-        headers = {
-            "Authorization": f"Token {REPLICATE_API_TOKEN}",
-            "Content-Type": "application/json"
-        }
-
-        payload = {
-            "version": RVC_MODEL_VERSION,
-            "input": {
-                "model": RVC_MODEL,
-                "input_audio": tts_url,
-                "reference_audio": ref_url
-            }
-        }
-
-        print(f"📡 Sending RVC clone request to {RVC_API_URL}...")
-        response = requests.post(RVC_API_URL, headers=headers, json=payload)
-
-        if response.status_code == 401:
-            print("❌ Unauthorized: Invalid Replicate API token or access denied.")
-            print(response.text)
-            return None
-        elif response.status_code not in [200, 201]:
-            print(f"⚠️ RVC Error: {response.status_code}")
-            print(response.text)
-            return None
-
-        prediction = response.json()
-        prediction_url = prediction["urls"]["get"]
-
-        print("⏳ Waiting for Replicate RVC model to finish...")
-        while prediction["status"] not in ["succeeded", "failed", "canceled"]:
-            time.sleep(5)
-            prediction = requests.get(prediction_url, headers=headers).json()
-
-        if prediction["status"] == "succeeded":
-            output_url = prediction["output"][0]
-            os.system(f"curl -L {output_url} -o {output_audio}")
-            print(f"✅ Cloned Kalam voice saved: {output_audio}")
-            return output_audio
-        else:
-            print(f"❌ RVC model failed: {prediction}")
-            return None
-
-    except Exception as e:
-        print(f"❌ RVC API failed: {e}")
-        return None
+# services/rvc_service_api.py
+import os
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# ----------------------------
+# Load environment variables
+# ----------------------------
+RVC_API_URL = os.getenv("REPLICATE_PREDICTIONS_URL", "https://api.replicate.com/v1/predictions")
+UPLOAD_URL = os.getenv("UPLOAD_URL", "https://transfer.sh")
+RVC_MODEL = os.getenv("RVC_MODEL")  # e.g. "pseudoram/rvc-v2"
+RVC_MODEL_VERSION = os.getenv("RVC_MODEL_VERSION")
+REPLICATE_API_TOKEN = os.getenv("REPLICATE_API_TOKEN")
+REFERENCE_AUDIO = os.getenv("REFERENCE_AUDIO")
+
+# Uploaded reference URLs are reused until they are this old (transfer.sh links expire)
+UPLOAD_URL_TTL = float(os.getenv("UPLOAD_URL_TTL", str(12 * 3600)))
+POLL_INITIAL = float(os.getenv("RVC_POLL_INITIAL", "0.5"))
+POLL_MAX = float(os.getenv("RVC_POLL_MAX", "5"))
+POLL_TIMEOUT = float(os.getenv("RVC_POLL_TIMEOUT", "600"))
+DOWNLOAD_CHUNK = 64 * 1024
+
+
+# ----------------------------
+# Shared HTTP session
+# ----------------------------
+_session = None
+_session_lock = threading.Lock()
+_upload_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="rvc-upload")
+_uploaded = {}  # sha256 -> (url, uploaded_at)
+_uploaded_lock = threading.Lock()
+
+
+def get_session():
+    """One keep-alive connection pool for uploads, predictions and downloads."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=16, max_retries=2)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+        return _session
+
+
+def _sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+# ----------------------------
+# Upload Helper
+# ----------------------------
+def upload_to_fileio(file_path):
+    """Upload local file to transfer.sh for temporary hosting."""
+    try:
+        print(f"📁 Uploading with transfer.sh: {file_path}")
+        if not file_path or not os.path.exists(file_path):
+            print("❌ File not found or invalid path.")
+            return None
+
+        with open(file_path, "rb") as f:
+            response = get_session().put(f"{UPLOAD_URL}/{os.path.basename(file_path)}", data=f)
+
+        if response.status_code == 200:
+            url = response.text.strip()
+            print(f"☁️ Uploaded {file_path} → {url}")
+            return url
+        else:
+            print(f"⚠️ transfer.sh upload failed: {response.status_code} → {response.text}")
+            return None
+    except Exception as e:
+        print(f"❌ transfer.sh upload failed: {e}")
+        return None
+
+
+def upload_cached(file_path):
+    """Upload once per file content; identical reference files reuse the earlier URL."""
+    if not file_path or not os.path.exists(file_path):
+        return upload_to_fileio(file_path)
+    digest = _sha256(file_path)
+    with _uploaded_lock:
+        hit = _uploaded.get(digest)
+    if hit and time.time() - hit[1] < UPLOAD_URL_TTL:
+        print(f"♻️ Reusing uploaded reference: {hit[0]}")
+        return hit[0]
+    url = upload_to_fileio(file_path)
+    if url:
+        with _uploaded_lock:
+            _uploaded[digest] = (url, time.time())
+    return url
+
+
+# ----------------------------
+# Prediction helpers
+# ----------------------------
+def wait_for_prediction(prediction, headers, timeout=POLL_TIMEOUT):
+    """Poll with exponential backoff (POLL_INITIAL → POLL_MAX) until the prediction settles."""
+    delay = POLL_INITIAL
+    deadline = time.monotonic() + timeout
+    session = get_session()
+    while prediction["status"] not in ["succeeded", "failed", "canceled"]:
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Prediction still {prediction['status']} after {timeout:.0f}s")
+        time.sleep(delay)
+        delay = min(POLL_MAX, delay * 1.5)
+        prediction = session.get(prediction["urls"]["get"], headers=headers).json()
+    return prediction
+
+
+def download(url, output_path):
+    """Stream the result straight to disk in chunks (no curl, no full buffering)."""
+    tmp_path = output_path + ".part"
+    with get_session().get(url, stream=True, allow_redirects=True) as response:
+        response.raise_for_status()
+        with open(tmp_path, "wb") as f:
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK):
+                if chunk:
+                    f.write(chunk)
+    os.replace(tmp_path, output_path)
+    return output_path
+
+
+# ----------------------------
+# Voice Cloning Function
+# ----------------------------
+def clone_voice_timed(input_audio, output_audio="results/kalam_cloned.wav", reference_audio=None):
+    """
+    Clone voice using Replicate RVC API.
+    Returns (output_path or None, timings) where timings are seconds per phase.
+    """
+    timings = {}
+    started = time.perf_counter()
+    try:
+        out_dir = os.path.dirname(output_audio)
+        if out_dir:
+            os.makedirs(out_dir, exist_ok=True)
+
+        # Pick the right reference
+        ref_audio = reference_audio or REFERENCE_AUDIO
+        print("🎤 Sending audio to Replicate RVC API...")
+        print(f"🧩 Using reference voice: {ref_audio}")
+
+        # Reference (usually cached) and TTS audio upload in parallel
+        t0 = time.perf_counter()
+        ref_future = _upload_pool.submit(upload_cached, ref_audio)
+        tts_future = _upload_pool.submit(upload_to_fileio, input_audio)
+        ref_url, tts_url = ref_future.result(), tts_future.result()
+        timings["upload"] = time.perf_counter() - t0
+
+        if not ref_url or not tts_url:
+            print("❌ Could not upload audio files. Please check paths.")
+            return None, timings
+
+        headers = {
+            "Authorization": f"Token {REPLICATE_API_TOKEN}",
+            "Content-Type": "application/json"
+        }
+
+        payload = {
+            "version": RVC_MODEL_VERSION,
+            "input": {
+                "model": RVC_MODEL,
+                "input_audio": tts_url,
+                "reference_audio": ref_url
+            }
+        }
+
+        print(f"📡 Sending RVC clone request to {RVC_API_URL}...")
+        t0 = time.perf_counter()
+        response = get_session().post(RVC_API_URL, headers=headers, json=payload)
+
+        if response.status_code == 401:
+            print("❌ Unauthorized: Invalid Replicate API token or access denied.")
+            print(response.text)
+            return None, timings
+        elif response.status_code not in [200, 201]:
+            print(f"⚠️ RVC Error: {response.status_code}")
+            print(response.text)
+            return None, timings
+
+        print("⏳ Waiting for Replicate RVC model to finish...")
+        prediction = wait_for_prediction(response.json(), headers)
+        timings["predict"] = time.perf_counter() - t0
+
+        if prediction["status"] == "succeeded":
+            output = prediction["output"]
+            output_url = output[0] if isinstance(output, list) else output
+            t0 = time.perf_counter()
+            download(output_url, output_audio)
+            timings["download"] = time.perf_counter() - t0
+            print(f"✅ Cloned Kalam voice saved: {output_audio}")
+            return output_audio, timings
+        else:
+            print(f"❌ RVC model failed: {prediction}")
+            return None, timings
+
+    except Exception as e:
+        print(f"❌ RVC API failed: {e}")
+        return None, timings
+    finally:
+        timings["total"] = time.perf_counter() - started
+        print("⏱️ RVC call: " + ", ".join(f"{k}={v:.2f}s" for k, v in timings.items()))
+
+
+def clone_voice(input_audio, output_audio="results/kalam_cloned.wav", reference_audio=None):
+    """
+    Clone voice using Replicate RVC API.
+    Automatically uses the uploaded or .env reference audio.
+    """
+    return clone_voice_timed(input_audio, output_audio, reference_audio)[0]
+
+
+# ----------------------------
+# Latency check against the local stand-in
+# ----------------------------
+if __name__ == "__main__":
+    import argparse
+    import tempfile
+    from services.local_standins import start_replicate_standin
+
+    parser = argparse.ArgumentParser(description="Per-call latency of the Replicate RVC client against a local stand-in.")
+    parser.add_argument("--calls", type=int, default=5)
+    parser.add_argument("--processing-seconds", type=float, default=1.2, help="simulated model runtime")
+    args = parser.parse_args()
+
+    server, base_url = start_replicate_standin(processing_seconds=args.processing_seconds)
+    RVC_API_URL = f"{base_url}/v1/predictions"
+    UPLOAD_URL = f"{base_url}/upload"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        ref, tts = os.path.join(tmp, "ref.wav"), os.path.join(tmp, "tts.wav")
+        for path in (ref, tts):
+            with open(path, "wb") as f:
+                f.write(os.urandom(256 * 1024))
+        for i in range(args.calls):
+            path, timings = clone_voice_timed(tts, os.path.join(tmp, f"out_{i}.wav"), reference_audio=ref)
+            assert path and os.path.getsize(path) == os.path.getsize(tts), "stand-in round trip failed"
+    server.shutdown()
@@ -0,0 +1,150 @@
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import argparse
+
+# ---------------------------
+# Settings
+# ---------------------------
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "5000"))
+WORKERS = int(os.getenv("WORKERS", "2"))
+
+
+def _default_threads(workers):
+    return max(1, (os.cpu_count() or 1) // max(1, workers))
+
+
+def _listen(host, port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(128)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _run_worker(app_module, sock, torch_threads):
+    """Child: own torch thread count, own schedulers/pools, shared preloaded weights."""
+    import torch
+    from werkzeug.serving import make_server
+
+    torch.set_num_threads(torch_threads)
+    app_module.TORCH_THREADS = torch_threads
+    app_module.start_components()
+    server = make_server(HOST, PORT, app_module.app, threaded=True, fd=sock.fileno())
+    print(f"👷 Worker {os.getpid()} serving ({torch_threads} torch threads)")
+    server.serve_forever()
+
+
+def serve(workers, torch_threads):
+    """
+    Preload-then-fork: the parent loads the weights once, then forks workers that all
+    accept() on the same listening socket. Weight pages stay shared copy-on-write because
+    inference never writes to them. Requires fork (Linux/macOS).
+    """
+    os.environ["APP_AUTOSTART"] = "0"
+    import app as app_module
+
+    print(f"📦 Preloading shared weights for {workers} workers...")
+    app_module.preload_shared_weights()
+    sock = _listen(HOST, PORT)
+
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                _run_worker(app_module, sock, torch_threads)
+            finally:
+                os._exit(0)
+        children.append(pid)
+    print(f"🚀 APJ Flask Server on {HOST}:{PORT} with {workers} workers: {children}")
+
+    def stop(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for pid in children:
+        os.waitpid(pid, 0)
+
+
+# ---------------------------
+# RSS vs worker count
+# ---------------------------
+def _memory_mb(pid):
+    """(rss, pss) in MB for a process and its children; PSS splits shared pages fairly."""
+    import psutil
+
+    root = psutil.Process(pid)
+    rss = pss = 0
+    for proc in [root] + root.children(recursive=True):
+        try:
+            info = proc.memory_full_info()
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+        rss += info.rss
+        pss += getattr(info, "pss", info.rss)
+    return rss / 2**20, pss / 2**20
+
+
+def _wait_ready(port, timeout):
+    import requests
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(f"http://127.0.0.1:{port}/readyz", timeout=2).status_code == 200:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(1)
+    return False
+
+
+def measure(worker_counts, timeout):
+    import subprocess
+
+    rows = []
+    for count in worker_counts:
+        env = dict(os.environ, WORKERS=str(count), PORT=str(PORT))
+        proc = subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env)
+        try:
+            if not _wait_ready(PORT, timeout):
+                print(f"⚠️ {count} workers not ready after {timeout}s")
+                continue
+            time.sleep(2)  # let every worker finish warming up
+            rss, pss = _memory_mb(proc.pid)
+            rows.append({"workers": count, "total_rss_mb": round(rss, 1), "total_pss_mb": round(pss, 1)})
+            print(f"workers={count:<3} total RSS={rss:9.1f} MB  total PSS={pss:9.1f} MB")
+        finally:
+            proc.send_signal(signal.SIGTERM)
+            proc.wait(timeout=30)
+    os.makedirs("results", exist_ok=True)
+    with open("results/multiworker_memory.json", "w") as f:
+        json.dump(rows, f, indent=2)
+    print("📝 Results saved at: results/multiworker_memory.json")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve app.py from several workers that share one copy of the weights.")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--torch-threads", type=int, default=int(os.getenv("TORCH_THREADS", "0")),
+                        help="intra-op threads per worker (default: cores / workers)")
+    parser.add_argument("--measure", default=None, help="comma-separated worker counts; report total RSS/PSS for each")
+    parser.add_argument("--ready-timeout", type=float, default=600)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure([int(n) for n in args.measure.split(",")], args.ready_timeout)
+    else:
+        serve(args.workers, args.torch_threads or _default_threads(args.workers))
@@ -0,0 +1,166 @@
+# services/session_cache.py
+import os
+import copy
+import time
+import threading
+from collections import OrderedDict
+
+import torch
+
+from services.metrics import GENERATED_TOKENS
+
+# ----------------------------
+# Config
+# ----------------------------
+SESSION_CACHE_MAX_MB = float(os.getenv("SESSION_CACHE_MAX_MB", "1024"))
+SESSION_IDLE_SECONDS = float(os.getenv("SESSION_IDLE_SECONDS", "1800"))
+PERSONA_PREAMBLE = os.getenv(
+    "PERSONA_PREAMBLE",
+    "You are Dr. A.P.J. Abdul Kalam. You speak warmly and simply to students, "
+    "encouraging them to dream big, work hard and serve the nation.\n",
+)
+TURN_TEMPLATE = os.getenv("SESSION_TURN_TEMPLATE", "\nStudent: {text}\nKalam:")
+
+
+def cache_nbytes(past_key_values):
+    """Approximate resident size of a transformers KV cache."""
+    total = 0
+    layers = getattr(past_key_values, "layers", None)
+    if layers is not None:
+        tensors = []
+        for layer in layers:
+            tensors.extend([getattr(layer, "keys", None), getattr(layer, "values", None)])
+    else:
+        tensors = list(getattr(past_key_values, "key_cache", [])) + list(getattr(past_key_values, "value_cache", []))
+    for t in tensors:
+        if isinstance(t, torch.Tensor):
+            total += t.numel() * t.element_size()
+    return total
+
+
+class _Session:
+    def __init__(self, input_ids, past_key_values):
+        self.input_ids = input_ids
+        self.past_key_values = past_key_values
+        self.nbytes = cache_nbytes(past_key_values)
+        self.last_used = time.monotonic()
+        self.lock = threading.Lock()
+
+
+class SessionKVCache:
+    """
+    Multi-turn chat with reused past key/values.
+    The persona preamble is prefilled once and copied into each new session;
+    each turn only prefills its own new tokens. Idle sessions are evicted
+    LRU-first once the memory budget is exceeded or after SESSION_IDLE_SECONDS.
+    """
+
+    def __init__(self, model, tokenizer, generation_kwargs, preamble=PERSONA_PREAMBLE,
+                 max_bytes=SESSION_CACHE_MAX_MB * 1024 * 1024, idle_seconds=SESSION_IDLE_SECONDS):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.generation_kwargs = dict(generation_kwargs)
+        self.max_bytes = int(max_bytes)
+        self.idle_seconds = float(idle_seconds)
+        self.max_context = int(getattr(model.config, "max_position_embeddings", 2048))
+
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._total_bytes = 0
+
+        # Precompute the shared persona prefix once
+        self.prefix_ids = tokenizer(preamble, return_tensors="pt")["input_ids"]
+        with torch.inference_mode():
+            out = model(input_ids=self.prefix_ids, use_cache=True)
+        self.prefix_cache = out.past_key_values
+        print(f"🧷 Persona prefix cached ({self.prefix_ids.shape[1]} tokens, {cache_nbytes(self.prefix_cache) / 1e6:.1f} MB).")
+
+    # ----------------------------
+    # Session bookkeeping
+    # ----------------------------
+    def _new_session(self):
+        return _Session(self.prefix_ids.clone(), copy.deepcopy(self.prefix_cache))
+
+    def _get(self, session_id):
+        with self._lock:
+            self._evict_idle()
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._new_session()
+                self._sessions[session_id] = session
+                self._total_bytes += session.nbytes
+            self._sessions.move_to_end(session_id)
+            session.last_used = time.monotonic()
+            return session
+
+    def _resize(self, session_id, session, nbytes):
+        with self._lock:
+            if self._sessions.get(session_id) is session:
+                self._total_bytes += nbytes - session.nbytes
+            session.nbytes = nbytes
+            self._evict_over_budget(keep=session_id)
+
+    def _evict_idle(self):
+        now = time.monotonic()
+        for sid in [sid for sid, s in self._sessions.items() if now - s.last_used > self.idle_seconds]:
+            self._total_bytes -= self._sessions.pop(sid).nbytes
+
+    def _evict_over_budget(self, keep=None):
+        while self._total_bytes > self.max_bytes and len(self._sessions) > 1:
+            sid = next(iter(self._sessions))
+            if sid == keep:
+                self._sessions.move_to_end(sid)
+                sid = next(iter(self._sessions))
+            evicted = self._sessions.pop(sid)
+            self._total_bytes -= evicted.nbytes
+            print(f"🧹 Evicted chat session {sid} ({evicted.nbytes / 1e6:.1f} MB)")
+
+    def reset(self, session_id):
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session is not None:
+                self._total_bytes -= session.nbytes
+            return session is not None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "cache_mb": round(self._total_bytes / 1e6, 2),
+                "budget_mb": round(self.max_bytes / 1e6, 2),
+            }
+
+    # ----------------------------
+    # Generation
+    # ----------------------------
+    def generate(self, session_id, user_text, **overrides):
+        """Run one chat turn; returns (response_text, prefilled_token_count, reused_token_count)."""
+        kwargs = dict(self.generation_kwargs, **overrides)
+        session = self._get(session_id)
+        with session.lock:
+            turn_ids = self.tokenizer(
+                TURN_TEMPLATE.format(text=user_text), return_tensors="pt", add_special_tokens=False
+            )["input_ids"]
+
+            # Start over from the persona prefix when the conversation would overflow the context window
+            budget = self.max_context - int(kwargs.get("max_new_tokens", 0))
+            if session.input_ids.shape[1] + turn_ids.shape[1] > budget:
+                fresh = self._new_session()
+                session.input_ids, session.past_key_values = fresh.input_ids, fresh.past_key_values
+
+            input_ids = torch.cat([session.input_ids, turn_ids], dim=1)
+            reused = session.past_key_values.get_seq_length()
+            with torch.inference_mode():
+                output = self.model.generate(
+                    input_ids=input_ids,
+                    attention_mask=torch.ones_like(input_ids),
+                    past_key_values=session.past_key_values,
+                    pad_token_id=self.tokenizer.pad_token_id or self.tokenizer.eos_token_id,
+                    **kwargs,
+                )
+            session.input_ids = output
+            GENERATED_TOKENS.inc(int(output.shape[1] - input_ids.shape[1]))
+            response = self.tokenizer.decode(output[0, input_ids.shape[1]:], skip_special_tokens=True).strip()
+            nbytes = cache_nbytes(session.past_key_values)
+        self._resize(session_id, session, nbytes)
+        return response, int(input_ids.shape[1] - reused), int(reused)
@@ -1,155 +1,303 @@
-def synthesize_with_controls(model, text, output_path="results/kalam_styled.wav", reference_audio=None, pitch_control=0.7, energy_control=0.85, duration_control=1.25):
-    try:
-        # If we have a model, try to use it (with ref if provided) else just post-process later
-        if model is not None and hasattr(model, "tts"):
-            try:
-                wav, sr = model.tts(
-                    text,
-                    style_vector=None,
-                    pitch_control=pitch_control,
-                    energy_control=energy_control,
-                    duration_control=duration_control,
-                )
-                sf.write(output_path, np.asarray(wav), int(sr))
-                return output_path
-            except Exception:
-                pass
-        # Fallback: try PyPI inference (can use reference) then apply controls
-        if model is not None:
-            try:
-                from styletts2 import tts as _tts
-                audio = model.inference(
-                    text,
-                    target_voice_path=reference_audio,
-                    output_wav_file=output_path,
-                    output_sample_rate=24000,
-                )
-                if audio is not None and not os.path.exists(output_path):
-                    sf.write(output_path, np.asarray(audio), 24000)
-            except Exception:
-                pass
-        # If no file yet, just use gTTS or caller-provided base; here we only post-process if path exists
-        if os.path.exists(output_path):
-            adjust_voice_male(output_path, pitch_control=pitch_control, energy_control=energy_control, duration_control=duration_control)
-            return output_path
-        return None
-    except Exception:
-        return None
-def _lowpass_sos(sr, cutoff=3800, order=4):
-    nyq = 0.5 * sr
-    norm = min(cutoff / nyq, 0.99)
-    return butter(order, norm, btype='low', output='sos')
-
-def _highpass_sos(sr, cutoff=80, order=4):
-    nyq = 0.5 * sr
-    norm = max(cutoff / nyq, 1e-4)
-    return butter(order, norm, btype='high', output='sos')
-
-def adjust_voice_male(wav_path, pitch_control=0.6, energy_control=0.9, duration_control=1.3):
-    try:
-        if not os.path.exists(wav_path):
-            return None
-        # Load WAV to float32 [-1,1]
-        y, sr = sf.read(wav_path, dtype='float32', always_2d=False)
-        if y.ndim > 1:
-            y = np.mean(y, axis=1)
-        # Pitch shift in semitones (0.8 ~ -3.17 st, less aggressive for clearer male voice)
-        n_steps = 12.0 * np.log2(max(1e-3, float(pitch_control)))
-        y = librosa.effects.pitch_shift(y, sr=sr, n_steps=n_steps)
-        # Time-stretch so overall duration matches requested (duration_control > 1 => slower)
-        stretch = 1.0 / float(duration_control)
-        stretch = min(2.0, max(0.25, stretch))
-        y = librosa.effects.time_stretch(y, rate=stretch)
-        # Gentle EQ: high-pass 80 Hz, low-pass 4 kHz for clearer speech
-        try:
-            y = sosfilt(_highpass_sos(sr, 80), y)
-            y = sosfilt(_lowpass_sos(sr, 4000), y)
-        except Exception:
-            pass
-        # Energy control
-        y = y * float(energy_control)
-        # Normalize/clamp to avoid clipping, amplify to full volume for audibility
-        peak = np.max(np.abs(y)) if y.size else 0.0
-        if peak > 0:
-            y = y / peak  # Normalize to [-1, 1]
-            y = y * 0.98  # Scale to 98% to prevent clipping
-        y = np.clip(y, -1.0, 1.0).astype('float32')
-        # Save back (keep original sample rate)
-        sf.write(wav_path, y, sr)
-        print(f"🎚️ Applied male voice controls (pitch={pitch_control}, energy={energy_control}, duration={duration_control}).")
-        return wav_path
-    except Exception as e:
-        print(f"⚠️ Post-processing failed: {e}")
-        return None
-import os
-import torch
-import soundfile as sf
-import numpy as np
-import librosa
-from scipy.signal import butter, sosfilt
-# Load the StyleTTS2 model (CPU mode)
-def load_styletts():
-    try:
-        # Import lazily so the app can still run if package isn't installed
-        from styletts2 import tts
-        print("🎙️ Loading StyleTTS2 voice cloning model on CPU (PyPI package)...")
-        model = tts.StyleTTS2()  # downloads/caches default checkpoints
-        print("✅ StyleTTS2 loaded successfully (CPU mode).")
-        return model
-    except Exception as e:
-        print(f"❌ Failed to load StyleTTS2: {e}")
-        return None
-
-# Clone voice using the reference sample (with optional voice controls)
-def clone_voice(model, text, reference_audio, output_path="results/kalam_cloned.wav", pitch_control=0.7, energy_control=0.85, duration_control=1.25):
-    try:
-        if model is None:
-            print("⚠️ StyleTTS2 model not available, skipping cloning.")
-            return None
-        print(f"🧩 Cloning with reference voice: {reference_audio}")
-        if not reference_audio or not os.path.exists(reference_audio):
-            print("⚠️ Reference voice not found, skipping cloning.")
-            return None
-
-        # Prefer native tts() API if available (research repo style)
-        if hasattr(model, "tts"):
-            try:
-                wav, sr = model.tts(
-                    text,
-                    style_vector=None,
-                    pitch_control=pitch_control,
-                    energy_control=energy_control,
-                    duration_control=duration_control,
-                )
-                sf.write(output_path, np.asarray(wav), int(sr))
-                print(f"✅ Cloned Kalam voice saved: {output_path}")
-                return output_path
-            except Exception as _:
-                pass
-
-        # Fallback to PyPI inference + post processing
-        audio = None
-        try:
-            from styletts2 import tts as _tts  # ensure API present
-            audio = model.inference(
-                text,
-                target_voice_path=reference_audio,
-                output_wav_file=output_path,
-                output_sample_rate=24000,
-            )
-        except Exception:
-            pass
-
-        if audio is not None and not os.path.exists(output_path):
-            sf.write(output_path, np.asarray(audio), 24000)
-
-        if os.path.exists(output_path):
-            adjust_voice_male(output_path, pitch_control=pitch_control, energy_control=energy_control, duration_control=duration_control)
-            print(f"✅ Cloned Kalam voice saved: {output_path}")
-            return output_path
-        else:
-            print("⚠️ Cloning did not produce an audio file.")
-            return None
-    except Exception as e:
-        print(f"❌ Voice cloning failed: {e}")
-        return None
+def synthesize_with_controls_array(model, text, reference_audio=None, pitch_control=0.7, energy_control=0.85, duration_control=1.25):
+    """StyleTTS2 synthesis with voice controls, returned as (samples, sr) or None."""
+    try:
+        # If we have a model, try to use it (with ref if provided) else just post-process later
+        if model is not None and hasattr(model, "tts"):
+            try:
+                with span("styletts2"):
+                    wav, sr = model.tts(
+                        text,
+                        style_vector=None,
+                        pitch_control=pitch_control,
+                        energy_control=energy_control,
+                        duration_control=duration_control,
+                    )
+                return np.asarray(wav, dtype='float32'), int(sr)
+            except Exception:
+                pass
+        # Fallback: try PyPI inference (can use reference) then apply controls
+        if model is not None:
+            try:
+                from styletts2 import tts as _tts
+                with span("styletts2"):
+                    audio = model.inference(
+                        text,
+                        output_sample_rate=24000,
+                        **_reference_kwargs(model, reference_audio),
+                    )
+                if audio is not None:
+                    y = process_voice_male(audio, 24000, pitch_control=pitch_control, energy_control=energy_control, duration_control=duration_control)
+                    return y, 24000
+            except Exception:
+                pass
+        return None
+    except Exception:
+        return None
+
+def synthesize_with_controls(model, text, output_path="results/kalam_styled.wav", reference_audio=None, pitch_control=0.7, energy_control=0.85, duration_control=1.25):
+    try:
+        audio = synthesize_with_controls_array(model, text, reference_audio, pitch_control, energy_control, duration_control)
+        if audio is not None:
+            return save_audio(audio, output_path)
+        # No model output: only post-process a caller-provided base if it exists at output_path
+        if os.path.exists(output_path):
+            adjust_voice_male(output_path, pitch_control=pitch_control, energy_control=energy_control, duration_control=duration_control)
+            return output_path
+        return None
+    except Exception:
+        return None
+# ----------------------------
+# Male voice post-processing (DSP)
+# ----------------------------
+# Filter designs depend only on (sample rate, cutoff, order), so they are built once per rate
+_SOS_CACHE = {}
+
+
+def _lowpass_sos(sr, cutoff=3800, order=4):
+    key = ("low", sr, cutoff, order)
+    if key not in _SOS_CACHE:
+        nyq = 0.5 * sr
+        norm = min(cutoff / nyq, 0.99)
+        _SOS_CACHE[key] = butter(order, norm, btype='low', output='sos')
+    return _SOS_CACHE[key]
+
+def _highpass_sos(sr, cutoff=80, order=4):
+    key = ("high", sr, cutoff, order)
+    if key not in _SOS_CACHE:
+        nyq = 0.5 * sr
+        norm = max(cutoff / nyq, 1e-4)
+        _SOS_CACHE[key] = butter(order, norm, btype='high', output='sos')
+    return _SOS_CACHE[key]
+
+def _eq_sos(sr):
+    """Gentle speech EQ (high-pass 80 Hz + low-pass 4 kHz) cascaded into one SOS bank for a single sosfilt pass."""
+    key = ("eq", sr)
+    if key not in _SOS_CACHE:
+        _SOS_CACHE[key] = np.vstack([_highpass_sos(sr, 80), _lowpass_sos(sr, 4000)])
+    return _SOS_CACHE[key]
+
+def _pitch_tempo(y, sr, pitch_control, duration_control):
+    """
+    Pitch shift and time stretch in one phase-vocoder pass plus one resample.
+    librosa's pitch_shift is stretch(1/p) + resample, followed here by stretch(r);
+    the two stretches collapse into a single stretch at rate r/p.
+    """
+    pitch = max(1e-3, float(pitch_control))
+    # duration_control > 1 => slower
+    rate = min(2.0, max(0.25, 1.0 / float(duration_control)))
+    target_len = int(round(y.shape[-1] / rate))
+    combined = rate / pitch
+    if abs(combined - 1.0) > 1e-6:
+        y = librosa.effects.time_stretch(y, rate=combined)
+    if abs(pitch - 1.0) > 1e-6:
+        y = librosa.resample(y, orig_sr=float(sr) * pitch, target_sr=sr, res_type="soxr_hq")
+    return librosa.util.fix_length(y, size=target_len)
+
+def _to_mono(y):
+    y = np.asarray(y, dtype='float32')
+    if y.ndim > 1:
+        y = np.mean(y, axis=1)
+    return y
+
+def process_voice_male(y, sr, pitch_control=0.6, energy_control=0.9, duration_control=1.3):
+    """Male voice controls on an in-memory buffer; returns float32 mono at the same sample rate."""
+    started = time.perf_counter()
+    y = _to_mono(y)
+    # Pitch (0.8 ~ -3.86 st, less aggressive for clearer male voice) + tempo in a single pass
+    y = _pitch_tempo(y, sr, pitch_control, duration_control)
+    # Gentle EQ: high-pass 80 Hz, low-pass 4 kHz for clearer speech
+    try:
+        y = sosfilt(_eq_sos(sr), y)
+    except Exception:
+        pass
+    # Energy control
+    y = y * float(energy_control)
+    # Normalize/clamp to avoid clipping, amplify to full volume for audibility
+    peak = np.max(np.abs(y)) if y.size else 0.0
+    if peak > 0:
+        y = y * (0.98 / peak)  # Normalize to 98% of full scale to prevent clipping
+    y = np.clip(y, -1.0, 1.0).astype('float32')
+    observe("adjust_voice_male", time.perf_counter() - started)
+    return y
+
+def process_voice_male_batch(signals, sr, pitch_control=0.6, energy_control=0.9, duration_control=1.3, max_pad_ratio=1.25):
+    """
+    process_voice_male over many utterances as array operations. Utterances of similar length
+    (longest <= max_pad_ratio x shortest) are zero-padded into one (n, samples) matrix, so the
+    phase vocoder, resampler and EQ run once per group; levels are normalized per utterance.
+    Returns float32 arrays in input order.
+    """
+    started = time.perf_counter()
+    signals = [_to_mono(y) for y in signals]
+    results = [np.zeros(0, dtype='float32')] * len(signals)
+    rate = min(2.0, max(0.25, 1.0 / float(duration_control)))
+    sos = _eq_sos(sr)
+
+    order = [i for i in sorted(range(len(signals)), key=lambda i: len(signals[i])) if len(signals[i])]
+    groups = []
+    for i in order:
+        if groups and len(signals[i]) <= max_pad_ratio * len(signals[groups[-1][0]]):
+            groups[-1].append(i)
+        else:
+            groups.append([i])
+
+    for group in groups:
+        batch = np.zeros((len(group), len(signals[group[-1]])), dtype='float32')
+        for row, i in enumerate(group):
+            batch[row, :len(signals[i])] = signals[i]
+        y = _pitch_tempo(batch, sr, pitch_control, duration_control)
+        y = sosfilt(sos, y, axis=-1) * float(energy_control)
+        for row, i in enumerate(group):
+            out = y[row, :int(round(len(signals[i]) / rate))]
+            peak = np.max(np.abs(out)) if out.size else 0.0
+            if peak > 0:
+                out = out * (0.98 / peak)
+            results[i] = np.clip(out, -1.0, 1.0).astype('float32')
+    observe("adjust_voice_male_batch", time.perf_counter() - started)
+    return results
+
+def adjust_voice_male(wav_path, pitch_control=0.6, energy_control=0.9, duration_control=1.3):
+    try:
+        if not os.path.exists(wav_path):
+            return None
+        # Load WAV to float32 [-1,1]
+        y, sr = sf.read(wav_path, dtype='float32', always_2d=False)
+        y = process_voice_male(y, sr, pitch_control=pitch_control, energy_control=energy_control, duration_control=duration_control)
+        # Save back (keep original sample rate)
+        sf.write(wav_path, y, sr)
+        print(f"🎚️ Applied male voice controls (pitch={pitch_control}, energy={energy_control}, duration={duration_control}).")
+        return wav_path
+    except Exception as e:
+        print(f"⚠️ Post-processing failed: {e}")
+        return None
+
+class MaleVoiceStream:
+    """
+    Block-wise male voice post-processing for streamed audio (e.g. one sentence per block).
+    EQ filter state and the output gain carry across blocks, so consecutive chunks join
+    without filter restarts or loudness jumps. Instead of normalizing each block to full
+    scale, a slow automatic gain moves towards a fixed loudness (target_rms): each block
+    closes only `adapt` of the gap (in dB), ramped across the block, and peaks are clamped.
+    """
+
+    def __init__(self, sr, pitch_control=0.6, energy_control=0.9, duration_control=1.3,
+                 target_rms=0.1, adapt=0.5, max_gain=20.0, ceiling=0.98):
+        self.sr = sr
+        self.pitch_control = pitch_control
+        self.energy_control = float(energy_control)
+        self.duration_control = duration_control
+        self.target_rms = float(target_rms)
+        self.adapt = float(adapt)
+        self.max_gain = float(max_gain)
+        self.ceiling = float(ceiling)
+        self._sos = _eq_sos(sr)
+        self._zi = np.zeros((self._sos.shape[0], 2))
+        self._gain = None
+
+    def process(self, block):
+        y = _pitch_tempo(_to_mono(block), self.sr, self.pitch_control, self.duration_control)
+        y, self._zi = sosfilt(self._sos, y, zi=self._zi)
+        y = y * self.energy_control
+        rms = float(np.sqrt(np.mean(np.square(y)))) if y.size else 0.0
+        previous = self._gain
+        if rms > 1e-4:
+            wanted = min(self.max_gain, self.target_rms / rms)
+            # The first block sets the level; later ones only drift towards the target
+            self._gain = wanted if previous is None else previous * (wanted / previous) ** self.adapt
+        if self._gain is not None:
+            start = self._gain if previous is None else previous
+            y = y * np.linspace(start, self._gain, y.size, dtype='float32')
+        return np.clip(y, -self.ceiling, self.ceiling).astype('float32')
+
+    def reset(self):
+        self._zi[:] = 0.0
+        self._gain = None
+import os
+import time
+import soundfile as sf
+import numpy as np
+import librosa
+from scipy.signal import butter, sosfilt
+from services.voice_store import get_reference_style
+from services.audio_io import save_audio
+from services.metrics import observe, span
+
+
+def _reference_kwargs(model, reference_audio):
+    """Pass a cached style vector (ref_s) when available so the reference WAV isn't re-encoded."""
+    ref_s = get_reference_style(model, reference_audio)
+    if ref_s is not None:
+        return {"ref_s": ref_s}
+    return {"target_voice_path": reference_audio}
+
+# Load the StyleTTS2 model (CPU mode)
+def load_styletts():
+    try:
+        # Import lazily so the app can still run if package isn't installed
+        from styletts2 import tts
+        print("🎙️ Loading StyleTTS2 voice cloning model on CPU (PyPI package)...")
+        model = tts.StyleTTS2()  # downloads/caches default checkpoints
+        print("✅ StyleTTS2 loaded successfully (CPU mode).")
+        return model
+    except Exception as e:
+        print(f"❌ Failed to load StyleTTS2: {e}")
+        return None
+
+# Clone voice using the reference sample (with optional voice controls)
+def clone_voice_array(model, text, reference_audio, pitch_control=0.7, energy_control=0.85, duration_control=1.25):
+    """Clone into the reference voice entirely in memory; returns (samples, sr) or None."""
+    try:
+        if model is None:
+            print("⚠️ StyleTTS2 model not available, skipping cloning.")
+            return None
+        print(f"🧩 Cloning with reference voice: {reference_audio}")
+        if not reference_audio or not os.path.exists(reference_audio):
+            print("⚠️ Reference voice not found, skipping cloning.")
+            return None
+
+        # Prefer native tts() API if available (research repo style)
+        if hasattr(model, "tts"):
+            try:
+                with span("styletts2"):
+                    wav, sr = model.tts(
+                        text,
+                        style_vector=None,
+                        pitch_control=pitch_control,
+                        energy_control=energy_control,
+                        duration_control=duration_control,
+                    )
+                return np.asarray(wav, dtype='float32'), int(sr)
+            except Exception as _:
+                pass
+
+        # Fallback to PyPI inference + post processing
+        audio = None
+        try:
+            from styletts2 import tts as _tts  # ensure API present
+            with span("styletts2"):
+                audio = model.inference(
+                    text,
+                    output_sample_rate=24000,
+                    **_reference_kwargs(model, reference_audio),
+                )
+        except Exception:
+            pass
+
+        if audio is None:
+            print("⚠️ Cloning did not produce audio.")
+            return None
+        y = process_voice_male(audio, 24000, pitch_control=pitch_control, energy_control=energy_control, duration_control=duration_control)
+        print(f"🎚️ Applied male voice controls (pitch={pitch_control}, energy={energy_control}, duration={duration_control}).")
+        return y, 24000
+    except Exception as e:
+        print(f"❌ Voice cloning failed: {e}")
+        return None
+
+def clone_voice(model, text, reference_audio, output_path="results/kalam_cloned.wav", pitch_control=0.7, energy_control=0.85, duration_control=1.25):
+    """File-based wrapper around clone_voice_array; writes output_path once."""
+    audio = clone_voice_array(model, text, reference_audio, pitch_control, energy_control, duration_control)
+    if audio is None:
+        return None
+    save_audio(audio, output_path)
+    print(f"✅ Cloned Kalam voice saved: {output_path}")
+    return output_path
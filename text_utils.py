@@ -0,0 +1,31 @@
+# services/text_utils.py
+import re
+
+MIN_SENTENCE_CHARS = 12
+_SENTENCE_END = re.compile(r"[.!?]+[\"')\]]*\s+")
+
+
+def split_sentences(buffer, min_chars=MIN_SENTENCE_CHARS):
+    """Cut complete sentences off the front of buffer. Returns (sentences, remainder)."""
+    sentences = []
+    start = 0
+    for match in _SENTENCE_END.finditer(buffer):
+        candidate = buffer[start:match.end()].strip()
+        # Skip very short fragments ("Dr.", "1.") so they join the next sentence
+        if len(candidate) < min_chars:
+            continue
+        sentences.append(candidate)
+        start = match.end()
+    return sentences, buffer[start:]
+
+
+def sentences(text, min_chars=MIN_SENTENCE_CHARS):
+    """All sentences of a complete text, including a trailing one without punctuation."""
+    parts, rest = split_sentences(text.strip() + " ", min_chars)
+    rest = rest.strip()
+    if rest:
+        if parts and len(rest) < min_chars:
+            parts[-1] = f"{parts[-1]} {rest}"
+        else:
+            parts.append(rest)
+    return parts
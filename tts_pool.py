@@ -0,0 +1,337 @@
+# services/tts_pool.py
+import os
+import sys
+import json
+import time
+import queue
+import struct
+import tempfile
+import threading
+import subprocess
+
+import numpy as np
+import soundfile as sf
+
+# ----------------------------
+# Config
+# ----------------------------
+def default_driver():
+    """pyttsx3 driver for this OS: espeak on Linux hosts, SAPI5 on Windows, NSSpeech on macOS."""
+    if sys.platform.startswith("win"):
+        return "sapi5"
+    if sys.platform == "darwin":
+        return "nsss"
+    return "espeak"
+
+
+TTS_DRIVER = os.getenv("TTS_DRIVER") or default_driver()
+TTS_POOL_SIZE = int(os.getenv("TTS_POOL_SIZE", str(max(1, min(4, (os.cpu_count() or 2) // 2)))))
+TTS_TIMEOUT = float(os.getenv("TTS_TIMEOUT", "30"))
+TTS_POOL_ENABLED = os.getenv("TTS_POOL_ENABLED", "1") != "0"
+# Voice id or name fragment to speak with; empty = the first male-sounding voice
+TTS_VOICE = os.getenv("TTS_VOICE", "")
+TTS_RATE_SCALE = float(os.getenv("TTS_RATE_SCALE", "0.95"))
+TARGET_SR = 24000
+
+
+def voice_signature(driver=TTS_DRIVER):
+    """Everything besides the text that the base voice depends on (part of its audio cache key)."""
+    return f"pyttsx3:{driver}:{TTS_VOICE or 'male'}:{TTS_RATE_SCALE}"
+
+
+# ----------------------------
+# Engine helpers (shared by workers and the per-request path)
+# ----------------------------
+def init_engine(driver=TTS_DRIVER):
+    """Initialize pyttsx3 once with the configured (default: male) voice, slightly slower rate and full volume."""
+    import pyttsx3
+
+    engine = pyttsx3.init(driverName=driver)
+    try:
+        for v in engine.getProperty('voices'):
+            name = (getattr(v, 'name', '') or '').lower()
+            gender = (getattr(v, 'gender', '') or '').lower()
+            if TTS_VOICE:
+                chosen = v.id == TTS_VOICE or TTS_VOICE.lower() in name
+            else:
+                chosen = 'male' in gender or 'male' in name or 'david' in name or 'george' in name
+            if chosen:
+                engine.setProperty('voice', v.id)
+                break
+    except Exception:
+        pass
+    try:
+        engine.setProperty('rate', int(engine.getProperty('rate') * TTS_RATE_SCALE))
+    except Exception:
+        pass
+    try:
+        engine.setProperty('volume', 1.0)
+    except Exception:
+        pass
+    return engine
+
+
+def render(engine, text, tmp_wav):
+    """Render text with an initialized engine; returns float32 mono samples at 24 kHz."""
+    from scipy.signal import resample_poly
+
+    # IMPORTANT: pyttsx3 uses snake_case
+    engine.save_to_file(text, tmp_wav)
+    engine.runAndWait()
+    y, sr = sf.read(tmp_wav, dtype='float32', always_2d=False)
+    if y.ndim > 1:
+        y = np.mean(y, axis=1)
+    if sr != TARGET_SR:
+        g = np.gcd(int(sr), TARGET_SR)
+        y = resample_poly(y, TARGET_SR // g, int(sr) // g).astype('float32')
+    return y, TARGET_SR
+
+
+def synthesize_once(text, driver=TTS_DRIVER):
+    """Old per-request path: init engine, render, tear down (kept for benchmarks and pool-less mode)."""
+    engine = init_engine(driver)
+    with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as tmpf:
+        tmp_wav = tmpf.name
+    try:
+        return render(engine, text, tmp_wav)
+    finally:
+        try:
+            engine.stop()
+        except Exception:
+            pass
+        try:
+            os.remove(tmp_wav)
+        except OSError:
+            pass
+
+
+# ----------------------------
+# Wire protocol: length-prefixed frames over the worker's stdin/stdout
+# ----------------------------
+def _write_frame(stream, payload):
+    stream.write(struct.pack(">I", len(payload)))
+    stream.write(payload)
+    stream.flush()
+
+
+def _read_exact(stream, n):
+    data = b""
+    while len(data) < n:
+        chunk = stream.read(n - len(data))
+        if not chunk:
+            raise EOFError("TTS worker closed the pipe")
+        data += chunk
+    return data
+
+
+def _read_frame(stream):
+    (n,) = struct.unpack(">I", _read_exact(stream, 4))
+    return _read_exact(stream, n)
+
+
+def _worker_main(driver):
+    """Worker process: one long-lived engine, jobs read from stdin, samples written to stdout."""
+    proto_in = sys.stdin.buffer
+    proto_out = os.fdopen(os.dup(1), "wb")
+    os.dup2(2, 1)  # anything the engine prints goes to stderr, not into the protocol
+
+    engine = init_engine(driver)
+    with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as tmpf:
+        tmp_wav = tmpf.name
+    _write_frame(proto_out, json.dumps({"ready": True}).encode())
+    try:
+        while True:
+            try:
+                job = json.loads(_read_frame(proto_in))
+            except EOFError:
+                break
+            try:
+                y, sr = render(engine, job["text"], tmp_wav)
+                _write_frame(proto_out, json.dumps({"ok": True, "sr": sr}).encode())
+                _write_frame(proto_out, np.ascontiguousarray(y, dtype='<f4').tobytes())
+            except Exception as e:
+                _write_frame(proto_out, json.dumps({"ok": False, "error": str(e)}).encode())
+    finally:
+        try:
+            os.remove(tmp_wav)
+        except OSError:
+            pass
+
+
+# ----------------------------
+# Pool
+# ----------------------------
+class _Worker:
+    def __init__(self, driver):
+        self.driver = driver
+        self.ready = False
+        self.proc = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--worker", "--driver", driver],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+
+    def _with_deadline(self, timeout, fn):
+        # A hung engine is killed by the timer, which unblocks the pipe read with EOF
+        timer = threading.Timer(timeout, self.proc.kill)
+        timer.start()
+        try:
+            return fn()
+        except (EOFError, OSError, ValueError):
+            if not timer.is_alive():
+                raise TimeoutError(f"TTS worker exceeded {timeout:.0f}s")
+            raise
+        finally:
+            timer.cancel()
+
+    def synthesize(self, text, timeout):
+        def run():
+            if not self.ready:
+                json.loads(_read_frame(self.proc.stdout))
+                self.ready = True
+            _write_frame(self.proc.stdin, json.dumps({"text": text}).encode())
+            header = json.loads(_read_frame(self.proc.stdout))
+            if not header.get("ok"):
+                raise RuntimeError(header.get("error", "TTS worker error"))
+            return np.frombuffer(_read_frame(self.proc.stdout), dtype='<f4'), int(header["sr"])
+        return self._with_deadline(timeout, run)
+
+    def alive(self):
+        return self.proc.poll() is None
+
+    def close(self):
+        try:
+            self.proc.stdin.close()
+            self.proc.wait(timeout=5)
+        except Exception:
+            self.proc.kill()
+
+
+class TTSWorkerPool:
+    """
+    Long-lived pyttsx3 worker processes, each owning an initialized engine with the
+    male voice already selected. Callers borrow an idle worker per utterance; a worker
+    that times out or dies is replaced.
+    """
+
+    def __init__(self, size=TTS_POOL_SIZE, driver=TTS_DRIVER, timeout=TTS_TIMEOUT):
+        self.driver = driver
+        self.timeout = timeout
+        self._idle = queue.Queue()
+        self._workers = []
+        self._lock = threading.Lock()
+        for _ in range(max(1, int(size))):
+            self._spawn()
+        print(f"🗣️ TTS worker pool started ({len(self._workers)} x {driver}).")
+
+    def _spawn(self):
+        worker = _Worker(self.driver)
+        with self._lock:
+            self._workers.append(worker)
+        self._idle.put(worker)
+
+    def _retire(self, worker):
+        with self._lock:
+            if worker in self._workers:
+                self._workers.remove(worker)
+        worker.close()
+
+    def synthesize(self, text, timeout=None):
+        """Returns (samples, 24000); raises on timeout or engine error."""
+        timeout = timeout or self.timeout
+        started = time.monotonic()
+        try:
+            worker = self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError("No idle TTS worker")
+        try:
+            audio = worker.synthesize(text, max(1.0, timeout - (time.monotonic() - started)))
+        except Exception as e:
+            if isinstance(e, TimeoutError) or not worker.alive():
+                self._retire(worker)
+                self._spawn()
+            else:
+                self._idle.put(worker)
+            raise
+        self._idle.put(worker)
+        return audio
+
+    def queue_depth(self):
+        return len(self._workers) - self._idle.qsize()
+
+    def close(self):
+        with self._lock:
+            workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_tts_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = TTSWorkerPool()
+        return _pool
+
+
+def synthesize_pooled(text, timeout=None):
+    """Base TTS via the worker pool (or per-request engine when the pool is disabled); (samples, sr) or None."""
+    # Imported here: the module also runs as a bare worker script without the services package
+    from services.metrics import span
+
+    try:
+        with span("tts_pyttsx3"):
+            if TTS_POOL_ENABLED:
+                return get_tts_pool().synthesize(text, timeout=timeout)
+            return synthesize_once(text)
+    except Exception as e:
+        print(f"❌ TTS generation failed: {e}")
+        return None
+
+
+# ----------------------------
+# Worker entry point + latency benchmark
+# ----------------------------
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="pyttsx3 worker process / pool latency benchmark.")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--driver", default=TTS_DRIVER)
+    parser.add_argument("--utterances", type=int, default=10)
+    parser.add_argument("--pool-size", type=int, default=TTS_POOL_SIZE)
+    args = parser.parse_args()
+
+    if args.worker:
+        _worker_main(args.driver)
+        sys.exit(0)
+
+    sentences = [
+        "My dear students, always dream big.",
+        "Failure will never overtake me if my determination to succeed is strong enough.",
+        "Learning gives creativity, creativity leads to thinking.",
+    ]
+    texts = [sentences[i % len(sentences)] for i in range(args.utterances)]
+
+    def timed(fn):
+        latencies = []
+        for text in texts:
+            t0 = time.perf_counter()
+            fn(text)
+            latencies.append(time.perf_counter() - t0)
+        latencies.sort()
+        return latencies[len(latencies) // 2], latencies[int(round(0.95 * (len(latencies) - 1)))]
+
+    per_request = timed(lambda t: synthesize_once(t, args.driver))
+    pool = TTSWorkerPool(size=args.pool_size, driver=args.driver)
+    pool.synthesize(texts[0])  # wait for engines to come up
+    pooled = timed(pool.synthesize)
+    pool.close()
+
+    print(f"{'mode':<14}{'p50 ms':>10}{'p95 ms':>10}")
+    print(f"{'per-request':<14}{per_request[0] * 1000:>10.1f}{per_request[1] * 1000:>10.1f}")
+    print(f"{'pooled':<14}{pooled[0] * 1000:>10.1f}{pooled[1] * 1000:>10.1f}")
@@ -1,85 +1,226 @@
-import os
-import base64
-import requests
-from dotenv import load_dotenv
-
-load_dotenv()
-
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-TTS_API_URL = "https://texttospeech.googleapis.com/v1/text:synthesize"
-
-def synthesize_speech(text, output_path="output.wav"):
-    # Use gTTS for natural human-like voice
-    try:
-        from gtts import gTTS
-        import tempfile
-        import librosa
-        import soundfile as sf
-        import numpy as np
-
-        # Create gTTS with natural settings
-        tts = gTTS(text=text, lang='en', slow=False, tld='com.au')  # Australian accent for natural male voice
-
-        with tempfile.NamedTemporaryFile(suffix='.mp3', delete=False) as tmpf:
-            tmp_mp3 = tmpf.name
-        tts.save(tmp_mp3)
-
-        # Load and convert to WAV with high quality
-        y, sr = librosa.load(tmp_mp3, sr=24000, mono=True)
-
-        # Normalize to prevent clipping and amplify for audibility
-        peak = np.max(np.abs(y)) if y.size else 0.0
-        if peak > 0:
-            y = y / peak  # Normalize to [-1, 1]
-            y = y * 0.95  # Scale to 95% to prevent clipping, maximize volume
-
-        sf.write(output_path, y, 24000)
-        os.remove(tmp_mp3)
-        print(f"🔊 Natural TTS audio generated: {output_path}")
-        return output_path
-    except Exception as e:
-        print(f"❌ gTTS failed: {e}")
-        # Fallback to pyttsx3
-        try:
-            import pyttsx3
-            import tempfile
-            import librosa
-            import soundfile as sf
-            import numpy as np
-
-            engine = pyttsx3.init(driverName='sapi5')
-            # Select male voice
-            voices = engine.getProperty('voices')
-            male_voice_id = None
-            for v in voices:
-                name = (getattr(v, 'name', '') or '').lower()
-                gender = (getattr(v, 'gender', '') or '').lower()
-                if 'male' in gender or 'male' in name or 'david' in name or 'george' in name:
-                    male_voice_id = v.id
-                    break
-            if male_voice_id:
-                engine.setProperty('voice', male_voice_id)
-            # Set volume to max
-            engine.setProperty('volume', 1.0)
-            # Slower rate
-            rate = engine.getProperty('rate')
-            engine.setProperty('rate', int(rate * 0.95))
-
-            with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as tmpf:
-                tmp_wav = tmpf.name
-            engine.save_to_file(text, tmp_wav)
-            engine.runAndWait()
-
-            y, sr = sf.read(tmp_wav, dtype='float32', always_2d=False)
-            if y.ndim > 1:
-                y = np.mean(y, axis=1)
-            if sr != 24000:
-                y = librosa.resample(y, orig_sr=sr, target_sr=24000)
-                sr = 24000
-            sf.write(output_path, y, sr)
-            os.remove(tmp_wav)
-            print(f"🔊 Base TTS audio generated: {output_path}")
-            return output_path
-        except Exception as e:
-            print(f"❌ TTS generation failed: {e}")
-            return None
+import os
+import io
+import base64
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+from dotenv import load_dotenv
+
+from services.text_utils import sentences
+from services.metrics import span, in_context
+
+load_dotenv()
+
+GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+TTS_API_URL = "https://texttospeech.googleapis.com/v1/text:synthesize"
+
+# ----------------------------
+# Sentence-parallel gTTS
+# ----------------------------
+GTTS_LANG = os.getenv("GTTS_LANG", "en")
+GTTS_TLD = os.getenv("GTTS_TLD", "com.au")  # Australian accent for natural male voice
+GTTS_WORKERS = int(os.getenv("GTTS_WORKERS", "4"))
+GTTS_CACHE_MAX_MB = float(os.getenv("GTTS_CACHE_MAX_MB", "64"))
+CROSSFADE_MS = float(os.getenv("GTTS_CROSSFADE_MS", "20"))
+TARGET_SR = 24000
+
+_pool = None
+_pool_lock = threading.Lock()
+_segments = OrderedDict()  # (text, lang, tld) -> float32 PCM at TARGET_SR
+_segments_bytes = 0
+_segments_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0}
+
+
+def fetch_mp3(text, lang=GTTS_LANG, tld=GTTS_TLD):
+    """One gTTS round trip; returns the MP3 bytes."""
+    from gtts import gTTS
+
+    mp3 = io.BytesIO()
+    gTTS(text=text, lang=lang, slow=False, tld=tld).write_to_fp(mp3)
+    return mp3.getvalue()
+
+
+_fetcher = fetch_mp3
+
+
+def set_fetcher(fetcher):
+    """Swap the network call, e.g. for a local stand-in: fetcher(text, lang, tld) -> MP3 bytes."""
+    global _fetcher
+    _fetcher = fetcher or fetch_mp3
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=max(1, GTTS_WORKERS), thread_name_prefix="gtts")
+        return _pool
+
+
+def decode_mp3(data):
+    """Decode MP3 bytes in memory (libsndfile >= 1.1 reads MP3) to mono float32 at TARGET_SR."""
+    import soundfile as sf
+    from services.audio_io import to_mono_float32, resample_to
+
+    y, sr = sf.read(io.BytesIO(data), dtype='float32', always_2d=False)
+    return resample_to(to_mono_float32(y), sr, TARGET_SR)[0]
+
+
+def _cache_key(sentence, lang, tld):
+    return " ".join(sentence.lower().split()), lang, tld
+
+
+def _cache_get(key):
+    with _segments_lock:
+        y = _segments.get(key)
+        if y is not None:
+            _segments.move_to_end(key)
+            _stats["hits"] += 1
+        else:
+            _stats["misses"] += 1
+        return y
+
+
+def _cache_put(key, y):
+    global _segments_bytes
+    budget = GTTS_CACHE_MAX_MB * 2**20
+    if y.nbytes > budget:
+        return
+    with _segments_lock:
+        if key in _segments:
+            return
+        _segments[key] = y
+        _segments_bytes += y.nbytes
+        while _segments_bytes > budget:
+            _, old = _segments.popitem(last=False)
+            _segments_bytes -= old.nbytes
+
+
+def cache_stats():
+    with _segments_lock:
+        lookups = _stats["hits"] + _stats["misses"]
+        return {
+            **_stats,
+            "entries": len(_segments),
+            "mb": round(_segments_bytes / 2**20, 2),
+            "hit_rate": round(_stats["hits"] / lookups, 3) if lookups else 0.0,
+        }
+
+
+def _segment(sentence, lang, tld):
+    key = _cache_key(sentence, lang, tld)
+    y = _cache_get(key)
+    if y is None:
+        with span("gtts_fetch"):
+            data = _fetcher(sentence, lang, tld)
+        with span("mp3_decode"):
+            y = decode_mp3(data)
+        _cache_put(key, y)
+    return y
+
+
+def crossfade_concat(segments, sr=TARGET_SR, crossfade_ms=CROSSFADE_MS):
+    """Join segments with short linear crossfades so sentence seams don't click."""
+    segments = [s for s in segments if s.size]
+    if not segments:
+        return np.zeros(0, dtype=np.float32)
+    fade = int(sr * crossfade_ms / 1000)
+    total = sum(s.size for s in segments)
+    out = np.empty(total, dtype=np.float32)
+    pos = 0
+    for s in segments:
+        n = min(fade, pos, s.size)
+        if n:
+            ramp = np.linspace(0.0, 1.0, n, dtype=np.float32)
+            out[pos - n:pos] = out[pos - n:pos] * (1.0 - ramp) + s[:n] * ramp
+        out[pos:pos + s.size - n] = s[n:]
+        pos += s.size - n
+    return out[:pos]
+
+
+def synthesize_gtts(text, lang=GTTS_LANG, tld=GTTS_TLD, parallel=True):
+    """Split into sentences, fetch them concurrently (cached per sentence), crossfade together."""
+    parts = sentences(text) or [text]
+    if parallel and len(parts) > 1:
+        pool = _get_pool()
+        segments = [f.result() for f in [pool.submit(in_context(_segment), s, lang, tld) for s in parts]]
+    else:
+        segments = [_segment(s, lang, tld) for s in parts]
+    return crossfade_concat(segments)
+
+
+def synthesize_speech_array(text):
+    """Base TTS returned in memory as (samples, 24000) or None."""
+    # Use gTTS for natural human-like voice
+    try:
+        with span("tts_gtts"):
+            y = synthesize_gtts(text)
+
+        # Normalize to prevent clipping and amplify for audibility
+        peak = np.max(np.abs(y)) if y.size else 0.0
+        if peak > 0:
+            y = y / peak  # Normalize to [-1, 1]
+            y = y * 0.95  # Scale to 95% to prevent clipping, maximize volume
+
+        print("🔊 Natural TTS audio generated (in memory)")
+        return y.astype('float32'), TARGET_SR
+    except Exception as e:
+        print(f"❌ gTTS failed: {e}")
+        # Fallback to pyttsx3 (persistent worker pool)
+        from services.tts_pool import synthesize_pooled
+
+        audio = synthesize_pooled(text)
+        if audio is not None:
+            print("🔊 Base TTS audio generated (in memory)")
+        return audio
+
+
+def synthesize_speech(text, output_path="output.wav"):
+    """Base TTS persisted to output_path; returns the path or None."""
+    from services.audio_io import save_audio
+
+    audio = synthesize_speech_array(text)
+    if audio is None:
+        return None
+    save_audio(audio, output_path)
+    print(f"🔊 TTS audio saved: {output_path}")
+    return output_path
+
+
+# ----------------------------
+# Latency check against a local stand-in
+# ----------------------------
+if __name__ == "__main__":
+    import argparse
+    import time
+    import soundfile as sf
+
+    parser = argparse.ArgumentParser(description="Serial vs sentence-parallel gTTS latency against a local stand-in.")
+    parser.add_argument("--latency", type=float, default=0.4, help="simulated seconds per gTTS round trip")
+    parser.add_argument("--sentences", type=int, default=6)
+    args = parser.parse_args()
+
+    def standin(text, lang, tld):
+        """Sleep like a network call, then return a real MP3 of roughly the right length."""
+        time.sleep(args.latency)
+        sr = 24000
+        t = np.arange(int(sr * 0.06 * len(text))) / sr
+        buf = io.BytesIO()
+        sf.write(buf, 0.3 * np.sin(2 * np.pi * 180 * t), sr, format='MP3')
+        return buf.getvalue()
+
+    set_fetcher(standin)
+    text = " ".join(f"This is sentence number {i} of the benchmark text." for i in range(args.sentences))
+    for label, parallel in (("serial", False), ("parallel", True), ("cached", True)):
+        if label != "cached":
+            with _segments_lock:
+                _segments.clear()
+                _segments_bytes = 0
+        t0 = time.perf_counter()
+        y = synthesize_gtts(text, parallel=parallel)
+        print(f"{label:<9} {time.perf_counter() - t0:6.2f}s  audio={y.size / TARGET_SR:.2f}s")
+    print(f"📊 Segment cache: {cache_stats()}")
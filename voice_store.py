@@ -0,0 +1,85 @@
+# services/voice_store.py
+import os
+import hashlib
+import threading
+
+# ----------------------------
+# Reference-voice style vectors, keyed by content hash
+# ----------------------------
+VOICE_STORE_DIR = os.getenv("VOICE_STORE_DIR", "samples/.styles")
+
+_styles = {}       # sha256 -> style tensor
+_hashes = {}       # (path, size, mtime) -> sha256, so unchanged files are not re-hashed
+_lock = threading.Lock()
+
+
+def file_sha256(path):
+    """Content hash of a reference file (memoized on path/size/mtime)."""
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    with _lock:
+        digest = _hashes.get(key)
+    if digest:
+        return digest
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+    with _lock:
+        _hashes[key] = digest
+    return digest
+
+
+def _disk_path(digest):
+    return os.path.join(VOICE_STORE_DIR, f"{digest}.pt")
+
+
+def get_reference_style(model, reference_audio):
+    """
+    Style vector for a reference WAV: memory first, then disk, then computed once with
+    model.compute_style and persisted. Returns None if the model can't compute styles.
+    """
+    if model is None or not reference_audio or not os.path.exists(reference_audio):
+        return None
+    digest = file_sha256(reference_audio)
+    with _lock:
+        style = _styles.get(digest)
+    if style is not None:
+        return style
+
+    import torch
+
+    disk_path = _disk_path(digest)
+    if os.path.exists(disk_path):
+        try:
+            style = torch.load(disk_path, map_location="cpu")
+        except Exception as e:
+            print(f"⚠️ Ignoring unreadable cached style {disk_path}: {e}")
+            style = None
+
+    if style is None:
+        if not hasattr(model, "compute_style"):
+            return None
+        try:
+            with torch.inference_mode():
+                style = model.compute_style(reference_audio)
+        except Exception as e:
+            print(f"⚠️ Could not compute reference style: {e}")
+            return None
+        try:
+            os.makedirs(VOICE_STORE_DIR, exist_ok=True)
+            torch.save(style.detach().cpu(), disk_path)
+        except Exception as e:
+            print(f"⚠️ Could not persist reference style: {e}")
+        print(f"🎼 Cached style vector for {reference_audio} ({digest[:12]})")
+
+    with _lock:
+        _styles[digest] = style
+    return style
+
+
+def precompute_reference_style(model, reference_audio):
+    """Warm the store for a newly uploaded voice; returns its content hash (or None)."""
+    style = get_reference_style(model, reference_audio)
+    return file_sha256(reference_audio) if style is not None else None